@@ -0,0 +1,231 @@
+#Alignment of the Tobii, webcam and stimulus streams on a common time grid
+
+import numpy as np
+
+
+# Channel name -> (value column, validity column or None) of each tracker
+TOBII_CHANNELS = {
+    'tobii_left_x': ('left_gaze_x', 'left_gaze_validity'),
+    'tobii_left_y': ('left_gaze_y', 'left_gaze_validity'),
+    'tobii_right_x': ('right_gaze_x', 'right_gaze_validity'),
+    'tobii_right_y': ('right_gaze_y', 'right_gaze_validity'),
+    'tobii_left_pupil': ('left_pupil_diameter', 'left_pupil_validity'),
+    'tobii_right_pupil': ('right_pupil_diameter', 'right_pupil_validity'),
+}
+WEBCAM_CHANNELS = {
+    'webcam_right_x': ('right_eye_x', None),
+    'webcam_right_y': ('right_eye_y', None),
+    'webcam_left_x': ('left_eye_x', None),
+    'webcam_left_y': ('left_eye_y', None),
+}
+
+
+def _column(data, *names):
+    # Works with structured arrays, load_session column dicts and Stimulus.stimulus_data
+    for name in names:
+        try:
+            return np.asarray(data[name])
+        except (KeyError, ValueError):
+            continue
+    raise KeyError(f"None of the columns {names} found")
+
+
+def make_grid(start, end, rate):
+    """
+    Returns the sample times of a regular grid from start to end (seconds) at rate Hz.
+    """
+    return start + np.arange(int(np.floor((end - start) * rate)) + 1) / rate
+
+
+def resample(t, values, grid, valid=None, method='linear', max_gap=0.1):
+    """
+    Resample one or more channels onto a time grid.
+
+    Invalid samples are removed first; a grid point is valid only if it lies
+    between two valid samples less than max_gap apart (linear), or within
+    max_gap / 2 of a valid sample (nearest).
+
+    Args:
+    - t (np.ndarray): Sample times, sorted (seconds)
+    - values (np.ndarray): (n,) or (n, channels) sample values
+    - grid (np.ndarray): Target times
+    - valid (np.ndarray): Boolean mask of the usable samples (default: finite values)
+    - method (str): 'linear' or 'nearest'
+    - max_gap (float): Largest gap (seconds) that is bridged
+
+    Returns:
+    - (resampled values with NaN where invalid, boolean validity mask)
+    """
+    t = np.asarray(t, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    squeeze = values.ndim == 1
+    if squeeze:
+        values = values[:, None]
+    if valid is None:
+        valid = np.all(np.isfinite(values), axis=1)
+    tv = t[valid]
+    vv = values[valid]
+
+    out = np.full((len(grid), values.shape[1]), np.nan)
+    mask = np.zeros(len(grid), dtype=bool)
+    if len(tv) == 0:
+        return (out[:, 0], mask) if squeeze else (out, mask)
+
+    right = np.searchsorted(tv, grid, side='left')
+    left = right - 1
+    has_left = left >= 0
+    has_right = right < len(tv)
+    left_c = np.clip(left, 0, len(tv) - 1)
+    right_c = np.clip(right, 0, len(tv) - 1)
+
+    if method == 'nearest':
+        dist_left = np.where(has_left, grid - tv[left_c], np.inf)
+        dist_right = np.where(has_right, tv[right_c] - grid, np.inf)
+        nearest = np.where(dist_left <= dist_right, left_c, right_c)
+        mask = np.minimum(dist_left, dist_right) <= max_gap / 2
+        out[mask] = vv[nearest[mask]]
+    elif method == 'linear':
+        exact = has_right & (tv[right_c] == grid)
+        span = tv[right_c] - tv[left_c]
+        mask = exact | (has_left & has_right & (span <= max_gap))
+        left_m, right_m = left_c[mask], right_c[mask]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            w = np.where(exact[mask], 1.0, (grid[mask] - tv[left_m]) / span[mask])[:, None]
+        out[mask] = vv[left_m] * (1 - w) + vv[right_m] * w
+    else:
+        raise ValueError(f"Unknown method '{method}', expected 'linear' or 'nearest'")
+
+    return (out[:, 0], mask) if squeeze else (out, mask)
+
+
+def _resample_stream(data, channels, grid, method, max_gap):
+    t = _column(data, 'system_timestamp', 'timestamps').astype(np.float64)
+    order = None
+    if len(t) > 1 and np.any(np.diff(t) < 0):
+        order = np.argsort(t, kind='stable')
+        t = t[order]
+
+    # Channels sharing a validity column are resampled together (one searchsorted)
+    groups = {}
+    for name, (column, validity) in channels.items():
+        groups.setdefault(validity, []).append((name, column))
+
+    result = {}
+    for validity, members in groups.items():
+        values = np.column_stack([_column(data, column) for _, column in members]).astype(np.float64)
+        if order is not None:
+            values = values[order]
+        valid = np.all(np.isfinite(values), axis=1)
+        if validity is not None:
+            flags = _column(data, validity)
+            valid &= (flags[order] if order is not None else flags) == 1
+        resampled, mask = resample(t, values, grid, valid, method, max_gap)
+        for i, (name, _) in enumerate(members):
+            result[name] = (resampled[:, i].astype(np.float32), mask)
+    return result
+
+
+def align_session(stimulus, tobii=None, webcam=None, rate=120.0, method='linear', max_gap=0.1,
+                  start=None, end=None):
+    """
+    Put the Tobii and webcam channels on one regular time grid.
+
+    Args:
+    - stimulus: Stimulus data (Stimulus.stimulus_data, STIMULUS_DTYPE array or column dict)
+    - tobii: Tobii data (TOBII_DTYPE array or column dict), optional
+    - webcam: Webcam data (WEBCAM_DTYPE array or column dict), optional
+    - rate (float): Grid rate in Hz
+    - method (str): 'linear' or 'nearest'
+    - max_gap (float): Gaps longer than this (seconds) are not interpolated
+    - start, end (float): Grid limits, default to the extent of the recorded data
+
+    Returns:
+    - dict with 'time' (n,), 'channels' (names), 'values' (n, channels) float32
+      with NaN where invalid, and 'valid' (n, channels) bool; the grid is empty
+      when every stream is empty and start or end is not given
+    """
+    streams = []
+    if tobii is not None:
+        streams.append((tobii, TOBII_CHANNELS))
+    if webcam is not None:
+        streams.append((webcam, WEBCAM_CHANNELS))
+
+    times = [_column(data, 'system_timestamp', 'timestamps') for data, _ in streams]
+    times.append(_column(stimulus, 'system_timestamp', 'timestamps'))
+    times = [t for t in times if len(t)]
+    if not times and (start is None or end is None):
+        grid = np.empty(0)  # nothing was recorded, there is no extent to default to
+    else:
+        if start is None:
+            start = min(np.min(t) for t in times)
+        if end is None:
+            end = max(np.max(t) for t in times)
+        grid = make_grid(start, end, rate)
+
+    names = []
+    values = []
+    valid = []
+    for data, channels in streams:
+        result = _resample_stream(data, channels, grid, method, max_gap)
+        for name in channels:
+            names.append(name)
+            values.append(result[name][0])
+            valid.append(result[name][1])
+
+    return {
+        'time': grid,
+        'channels': names,
+        'values': np.column_stack(values) if values else np.empty((len(grid), 0), np.float32),
+        'valid': np.column_stack(valid) if valid else np.empty((len(grid), 0), bool),
+    }
+
+
+def epochs(aligned, stimulus, pre=0.2, post=2.0):
+    """
+    Cut the aligned channels into one epoch per stimulus onset.
+
+    Args:
+    - aligned (dict): Result of align_session
+    - stimulus: Stimulus data with the onsets and offsets (cm)
+    - pre, post (float): Seconds before and after each onset
+
+    Returns:
+    - dict with 'data' (epochs, samples, channels) float32 (NaN outside the
+      recording or where invalid), 'valid' (same shape, bool), 'time' (samples,)
+      relative to onset, 'onset' and 'offset_cm' per epoch
+    """
+    grid = aligned['time']
+    rate = 1.0 / (grid[1] - grid[0]) if len(grid) > 1 else 1.0
+    onsets = _column(stimulus, 'system_timestamp', 'timestamps').astype(np.float64)
+    offsets = _column(stimulus, 'stimulus_offset_cm', 'stimulus_offsets_cm')
+
+    rel = np.arange(-int(round(pre * rate)), int(round(post * rate)) + 1)
+    onset_index = np.rint((onsets - grid[0]) * rate).astype(np.int64) if len(grid) else np.zeros(0, np.int64)
+    index = onset_index[:, None] + rel[None, :]
+    inside = (index >= 0) & (index < len(grid))
+    index = np.clip(index, 0, max(len(grid) - 1, 0))
+
+    n_channels = aligned['values'].shape[1]
+    data = aligned['values'][index] if len(grid) else np.full(index.shape + (n_channels,), np.nan, np.float32)
+    valid = aligned['valid'][index] & inside[:, :, None] if len(grid) else np.zeros(data.shape, bool)
+    data = np.where(valid, data, np.nan).astype(np.float32)
+
+    return {
+        'data': data,
+        'valid': valid,
+        'time': rel / rate,
+        'onset': onsets,
+        'offset_cm': offsets,
+        'channels': aligned['channels'],
+    }
+
+
+def epochs_by_offset(epoch_data):
+    """
+    Group the epochs by stimulus offset.
+
+    Returns:
+    - dict offset_cm -> (epochs, samples, channels) array
+    """
+    return {float(offset): epoch_data['data'][epoch_data['offset_cm'] == offset]
+            for offset in np.unique(epoch_data['offset_cm'])}
@@ -0,0 +1,447 @@
+#Analysis of many recorded sessions on a process pool, with a result cache
+
+import argparse
+import ast
+import csv
+import hashlib
+import json
+import math
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from DataExport import CSV_NAMES, load_session, load_streams, read_csv
+from EventDetector import EventDetector, FIXATION, SACCADE, BLINK
+from GazeBuffer import (TOBII_DTYPE, WEBCAM_DTYPE, MARKER_DTYPE, STIMULUS_DTYPE, SCREEN_GAZE_DTYPE,
+                        EVENT_DTYPE, BUS_MARKER_DTYPE, tobii_record)
+from Quality import session_quality
+
+
+# Bump when the analysis changes, so every cached result is recomputed
+ANALYSIS_VERSION = 1
+
+DEFAULT_PARAMS = {
+    'screen_width': None,           # px, from the session metadata if None
+    'display_size_mm': (527.0, 296.0),  # from the session metadata (screen cm) when it has it
+    'distance_mm': 650.0,
+    'event_method': 'ivt',
+    'velocity_threshold': 30.0,
+    'dispersion_threshold': 1.0,
+}
+
+# Stream name -> dtype, for the CSV files (the session meta has the exact dtypes)
+STREAM_DTYPES = {
+    'stimulus': STIMULUS_DTYPE,
+    'tobii': TOBII_DTYPE,
+    'tobii_markers': MARKER_DTYPE,
+    'webcam': WEBCAM_DTYPE,
+    'webcam_markers': MARKER_DTYPE,
+    'webcam_screen': SCREEN_GAZE_DTYPE,
+    'tobii_events': EVENT_DTYPE,
+    'markers': BUS_MARKER_DTYPE,
+}
+
+# Columns of the summary table: (key, header, format)
+SUMMARY_COLUMNS = [
+    ('session', 'session', '{}'),
+    ('format', 'format', '{}'),
+    ('duration_s', 'dur s', '{:.0f}'),
+    ('tobii_rate_hz', 'tobii Hz', '{:.1f}'),
+    ('tobii_data_loss', 'loss', '{:.1%}'),
+    ('tobii_left_validity', 'val L', '{:.1%}'),
+    ('tobii_right_validity', 'val R', '{:.1%}'),
+    ('tobii_precision_deg', 'RMS deg', '{:.3f}'),
+    ('tobii_accuracy_deg', 'acc deg', '{:.2f}'),
+    ('webcam_rate_hz', 'cam Hz', '{:.1f}'),
+    ('webcam_validity', 'cam val', '{:.1%}'),
+    ('fixations', 'fix', '{:.0f}'),
+    ('fixation_ms', 'fix ms', '{:.0f}'),
+    ('saccades', 'sacc', '{:.0f}'),
+    ('blinks', 'blinks', '{:.0f}'),
+]
+
+_TIMESTAMP = re.compile(r'^(?P<name>.+)_(?P<timestamp>\d{8}_\d{6})(?P<extension>\.\w+)?$')
+_PREFIXES = {prefix: stream for stream, prefix in CSV_NAMES.items()}
+
+
+def discover_sessions(directory):
+    """
+    Find the sessions saved by Experiment.save_data under a directory.
+
+    The npy export is a session_data_<timestamp> directory, the npz export a
+    session_data_<timestamp>.npz archive; CSV files (the CSV export and the
+    older stimulus_data_ / tobii_data_ / webcam_gaze_data_ files) are grouped
+    by their timestamp suffix.
+
+    Returns:
+    - list of dicts with id, format, path and files (sorted by id)
+    """
+    sessions = []
+    csv_groups = {}
+    for root, dirs, files in os.walk(directory):
+        for name in sorted(dirs):
+            match = _TIMESTAMP.match(name)
+            path = os.path.join(root, name)
+            if match and match['name'] == 'session_data' and os.path.exists(os.path.join(path, 'meta.json')):
+                sessions.append({'id': match['timestamp'], 'format': 'npy', 'path': path,
+                                 'files': sorted(os.path.join(stream_root, f) for stream_root, _, stream_files
+                                                 in os.walk(path) for f in stream_files)})
+        # The export directories are read whole, not searched for more sessions
+        dirs[:] = [name for name in dirs if not name.startswith('session_data_')]
+        for name in sorted(files):
+            match = _TIMESTAMP.match(name)
+            if not match:
+                continue
+            path = os.path.join(root, name)
+            if match['extension'] == '.npz' and match['name'] == 'session_data':
+                sessions.append({'id': match['timestamp'], 'format': 'npz', 'path': path, 'files': [path]})
+            elif match['extension'] in ('.csv', '.json'):
+                csv_groups.setdefault((root, match['timestamp']), []).append(path)
+
+    for (root, timestamp), files in csv_groups.items():
+        if any(os.path.basename(f).startswith(('tobii_data_', 'webcam_gaze_data_')) for f in files):
+            sessions.append({'id': timestamp, 'format': 'csv', 'path': root, 'files': sorted(files)})
+
+    # Sessions of different directories may share a timestamp
+    counts = {}
+    for session in sessions:
+        counts[session['id']] = counts.get(session['id'], 0) + 1
+    for session in sessions:
+        if counts[session['id']] > 1:
+            session['id'] = os.path.join(os.path.relpath(os.path.dirname(session['files'][0]), directory),
+                                         session['id'])
+    return sorted(sessions, key=lambda session: session['id'])
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _read_legacy_csv(stream, path):
+    # CSV files of the first save_data: SDK dictionaries (tuples as text) for
+    # Tobii, samples and markers interleaved for the webcam
+    with open(path, newline='') as f:
+        rows = list(csv.reader(f))
+    header, rows = rows[0], rows[1:]
+    if stream == 'stimulus':
+        return np.array([tuple(_number(value) for value in row[:3]) for row in rows], dtype=STIMULUS_DTYPE)
+    if stream == 'webcam':
+        samples, markers = [], []
+        for row in rows:
+            if row[1] not in ('', 'None'):
+                samples.append(tuple(_number(value) for value in row[:5]) + (0,))  # all FaceMesh
+            elif len(row) > 5 and row[5] not in ('', 'None'):
+                markers.append((_number(row[0]), len(samples), row[5]))
+        return {'webcam': np.array(samples, dtype=WEBCAM_DTYPE),
+                'webcam_markers': np.array(markers, dtype=MARKER_DTYPE)}
+    if stream == 'tobii':
+        keys = header[1:]
+        records = []
+        for row in rows:
+            gaze_data = {}
+            for key, value in zip(keys, row[1:]):
+                try:
+                    gaze_data[key] = ast.literal_eval(value)
+                except (ValueError, SyntaxError):
+                    gaze_data[key] = value
+            try:
+                records.append(tobii_record(gaze_data, _number(row[0])))
+            except (KeyError, TypeError, IndexError):
+                continue  # marker rows (their fields are empty)
+        return np.array(records, dtype=TOBII_DTYPE)
+    return None
+
+
+def _load_csv_session(session):
+    streams = {}
+    metadata = {}
+    dtypes = dict(STREAM_DTYPES)
+    meta_path = next((f for f in session['files'] if os.path.basename(f).startswith('session_meta_')), None)
+    if meta_path is not None:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        metadata = meta.get('metadata', {})
+        for name, info in meta['streams'].items():
+            dtypes[name] = np.dtype([(column, code) for column, code in info['columns'].items()])
+
+    for path in session['files']:
+        match = _TIMESTAMP.match(os.path.basename(path))
+        if match['extension'] != '.csv':
+            continue
+        stream = _PREFIXES.get(match['name'], match['name'])
+        dtype = dtypes.get(stream)
+        with open(path) as f:
+            header = f.readline().strip()
+        if dtype is not None and header == ','.join(dtype.names):
+            streams[stream] = read_csv(path, dtype)
+            continue
+        legacy = _read_legacy_csv(stream, path)
+        if isinstance(legacy, dict):
+            streams.update(legacy)
+        elif legacy is not None:
+            streams[stream] = legacy
+    return streams, metadata
+
+
+def load_session_streams(session):
+    """
+    Streams and metadata of a discovered session.
+
+    Returns:
+    - (dict stream name -> structured array, metadata dict)
+    """
+    if session['format'] == 'csv':
+        return _load_csv_session(session)
+    meta = load_session(session['path'], mmap=False)['meta']
+    return load_streams(session['path']), meta.get('metadata', {})
+
+
+def file_digest(path, block_size=1 << 20):
+    """SHA-1 of the content of a file."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ResultCache:
+
+    """
+    Per-session results stored under a hash of the input files and the parameters.
+
+    A key is the SHA-1 of the analysis version, the parameters and the
+    content digest of every input file, so a result is reused exactly when
+    nothing it depends on changed, wherever the session is stored. File
+    digests are remembered by path, size and modification time, so unchanged
+    files are not read again.
+
+    Args:
+    - directory (str): Cache directory, created if needed
+    """
+
+    def __init__(self, directory='.analysis_cache'):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.digests_path = os.path.join(directory, 'digests.json')
+        try:
+            with open(self.digests_path) as f:
+                self.digests = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.digests = {}
+
+    def digest(self, path):
+        stat = os.stat(path)
+        known = self.digests.get(os.path.abspath(path))
+        if known is not None and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2]
+        digest = file_digest(path)
+        self.digests[os.path.abspath(path)] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def save_digests(self):
+        temporary = self.digests_path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(self.digests, f)
+        os.replace(temporary, self.digests_path)
+
+    def key(self, session, params):
+        """Cache key of a session analysed with params."""
+        files = sorted((os.path.relpath(path, session['path']) if session['format'] == 'npy'
+                        else os.path.basename(path), self.digest(path)) for path in session['files'])
+        content = json.dumps({'version': ANALYSIS_VERSION, 'params': params, 'files': files}, sort_keys=True)
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    def _path(self, key, extension):
+        return os.path.join(self.directory, key[:2], key + extension)
+
+    def load(self, key):
+        """Returns the cached result, or None."""
+        try:
+            with open(self._path(key, '.json')) as f:
+                result = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        arrays = self._path(key, '.npz')
+        if os.path.exists(arrays):
+            with np.load(arrays) as f:
+                result['arrays'] = {name: f[name] for name in f.files}
+        return result
+
+    def store(self, key, result):
+        """Store a result (dict, its 'arrays' entry in a .npz), each file written atomically."""
+        os.makedirs(os.path.dirname(self._path(key, '')), exist_ok=True)
+        result = dict(result)
+        arrays = result.pop('arrays', None)
+        if arrays:
+            temporary = self._path(key, '.tmp.npz')
+            np.savez(temporary, **arrays)
+            os.replace(temporary, self._path(key, '.npz'))
+        temporary = self._path(key, '.json.tmp')
+        with open(temporary, 'w') as f:
+            json.dump(result, f)
+        os.replace(temporary, self._path(key, '.json'))
+
+
+def analyze_session(session, params):
+    """
+    Quality report (see Quality) and eye movement events (see EventDetector) of one session.
+
+    Returns:
+    - dict with summary (one row of the table), quality (full report) and arrays (events)
+    """
+    streams, metadata = load_session_streams(session)
+    screen_width = params['screen_width'] or metadata.get('screen_width')
+    display_size_mm = tuple(params['display_size_mm'])
+    if 'screen_width_cm' in metadata and 'screen_height_cm' in metadata:
+        display_size_mm = (metadata['screen_width_cm'] * 10, metadata['screen_height_cm'] * 10)
+    quality = session_quality(streams, screen_width, display_size_mm, params['distance_mm'])
+
+    summary = {'session': session['id'], 'format': session['format']}
+    tobii = quality.get('tobii', {})
+    webcam = quality.get('webcam', {})
+    summary['duration_s'] = tobii.get('duration_s', webcam.get('duration_s', math.nan))
+    summary['tobii_rate_hz'] = tobii.get('effective_rate_hz', math.nan)
+    summary['tobii_data_loss'] = tobii.get('data_loss', math.nan)
+    summary['tobii_left_validity'] = tobii.get('left_validity', math.nan)
+    summary['tobii_right_validity'] = tobii.get('right_validity', math.nan)
+    precision = [tobii.get(f'{eye}_precision_rms_deg', math.nan) for eye in ('left', 'right')]
+    precision = [value for value in precision if not math.isnan(value)]
+    summary['tobii_precision_deg'] = sum(precision) / len(precision) if precision else math.nan
+    summary['tobii_accuracy_deg'] = tobii.get('accuracy_deg', math.nan)
+    summary['webcam_rate_hz'] = webcam.get('effective_rate_hz', math.nan)
+    summary['webcam_validity'] = min(webcam.get('left_validity', math.nan), webcam.get('right_validity', math.nan))
+
+    events = np.empty(0, dtype=EVENT_DTYPE)
+    if len(streams.get('tobii', ())) > 1:
+        detector = EventDetector(params['event_method'], frequency=tobii['nominal_rate_hz'],
+                                 velocity_threshold=params['velocity_threshold'],
+                                 dispersion_threshold=params['dispersion_threshold'],
+                                 display_size_mm=display_size_mm, distance_mm=params['distance_mm'])
+        events = detector.detect(streams['tobii'])
+    fixations = events[events['event'] == FIXATION]
+    summary['fixations'] = len(fixations)
+    summary['fixation_ms'] = float(np.mean(fixations['offset'] - fixations['onset']) * 1e3) if len(fixations) else math.nan
+    summary['saccades'] = int(np.count_nonzero(events['event'] == SACCADE))
+    summary['blinks'] = int(np.count_nonzero(events['event'] == BLINK))
+    summary = {key: float(value) if isinstance(value, np.floating) else value for key, value in summary.items()}
+    return {'summary': summary, 'quality': quality, 'arrays': {'events': events}}
+
+
+def _analyze(session, params, key, cache_directory):
+    # Runs in a worker process: analyse and store the result for next time
+    result = analyze_session(session, params)
+    ResultCache(cache_directory).store(key, result)
+    return result['summary']
+
+
+def run_batch(directory, params=None, workers=None, cache_directory='.analysis_cache', force=False):
+    """
+    Analyse every session under a directory, on a process pool.
+
+    Sessions whose inputs and parameters did not change since a previous run
+    are taken from the cache; only the others are analysed.
+
+    Args:
+    - directory (str): Directory searched for sessions (see discover_sessions)
+    - params (dict): Analysis parameters, DEFAULT_PARAMS for the ones not given
+    - workers (int): Worker processes, os.cpu_count() by default
+    - cache_directory (str): Directory of the ResultCache
+    - force (bool): Analyse every session again
+
+    Returns:
+    - list of summary dicts (one per session, with 'cached'), sorted by session
+    """
+    params = dict(DEFAULT_PARAMS, **(params or {}))
+    params['display_size_mm'] = list(params['display_size_mm'])
+    cache = ResultCache(cache_directory)
+    sessions = discover_sessions(directory)
+    start = time.perf_counter()
+
+    summaries = []
+    pending = []
+    for session in sessions:
+        key = cache.key(session, params)
+        cached = None if force else cache.load(key)
+        if cached is not None:
+            summaries.append(dict(cached['summary'], session=session['id'], cached=True))
+        else:
+            pending.append((session, key))
+    cache.save_digests()
+    print(f"[Batch] {len(sessions)} sessions found, {len(summaries)} cached, {len(pending)} to analyse.")
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            futures = {pool.submit(_analyze, session, params, key, cache_directory): session
+                       for session, key in pending}
+            for done, future in enumerate(as_completed(futures), start=1):
+                session = futures[future]
+                try:
+                    summaries.append(dict(future.result(), cached=False))
+                except Exception as e:
+                    print(f"[Batch] {session['id']} failed: {e}")
+                    summaries.append({'session': session['id'], 'format': session['format'], 'cached': False,
+                                      'error': str(e)})
+                print(f"[Batch] {done}/{len(pending)} analysed ({session['id']})")
+    print(f"[Batch] Done in {time.perf_counter() - start:.1f}s.")
+    return sorted(summaries, key=lambda summary: summary['session'])
+
+
+def print_summary(summaries):
+    """Print the summary table, with the mean of every column over the sessions."""
+    columns = SUMMARY_COLUMNS
+    means = {'session': 'mean', 'format': ''}
+    for key, _, _ in columns[2:]:
+        values = [summary.get(key, math.nan) for summary in summaries]
+        values = [value for value in values if isinstance(value, (int, float)) and not math.isnan(value)]
+        means[key] = sum(values) / len(values) if values else math.nan
+
+    def cells(row):
+        return [fmt.format(row[key]) if key in row and not (isinstance(row[key], float) and math.isnan(row[key]))
+                else '-' for key, _, fmt in columns]
+
+    table = [[header for _, header, _ in columns]] + [cells(summary) for summary in summaries] + [cells(means)]
+    widths = [max(len(row[i]) for row in table) for i in range(len(columns))]
+    for i, row in enumerate(table):
+        if i == len(table) - 1:
+            print('  '.join('-' * width for width in widths))
+        print('  '.join(cell.rjust(width) if i else cell.ljust(width) for cell, width in zip(row, widths)))
+
+
+def write_summary(path, summaries):
+    """Write the summary table as CSV."""
+    keys = [key for key, _, _ in SUMMARY_COLUMNS] + ['cached', 'error']
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, keys, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(summaries)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Analyse all sessions in a directory.')
+    parser.add_argument('directory', help='directory with the saved sessions')
+    parser.add_argument('--workers', type=int, help='worker processes (default: all cores)')
+    parser.add_argument('--cache', default='.analysis_cache', help='result cache directory')
+    parser.add_argument('--force', action='store_true', help='ignore the cached results')
+    parser.add_argument('--output', help='also write the summary table to this CSV file')
+    parser.add_argument('--screen-width', type=int, help='screen width in px (default: from the session)')
+    parser.add_argument('--distance-mm', type=float, default=DEFAULT_PARAMS['distance_mm'])
+    parser.add_argument('--method', choices=('ivt', 'idt'), default=DEFAULT_PARAMS['event_method'])
+    parser.add_argument('--velocity-threshold', type=float, default=DEFAULT_PARAMS['velocity_threshold'])
+    args = parser.parse_args()
+
+    summaries = run_batch(args.directory, {'screen_width': args.screen_width, 'distance_mm': args.distance_mm,
+                                           'event_method': args.method,
+                                           'velocity_threshold': args.velocity_threshold},
+                          args.workers, args.cache, args.force)
+    print_summary(summaries)
+    if args.output:
+        write_summary(args.output, summaries)
+        print(f"[Batch] Summary written to {args.output}")
@@ -0,0 +1,286 @@
+#Throughput and latency benchmarks on simulated devices, with JSON baselines
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from FakeDevices import FakeTobiiResearch, SyntheticCamera
+from SessionWriter import SessionWriter
+from ClockSync import now
+
+
+BASELINE_DIR = 'benchmarks'
+# Relative change a metric may worsen by before it counts as a regression
+TOLERANCE = 0.25
+# Metrics where a larger value is better; for every other metric smaller is better
+HIGHER_IS_BETTER = ('fps',)
+# Metrics that are reported but not compared: they describe the run, or (maxima) are single outliers
+NOT_COMPARED = ('samples', 'frames', 'trials', 'data_mb_per_hour', '_max_')
+# Smallest baseline value changes are measured against, so near-zero metrics do not explode
+MIN_SCALE = {'sample_loss': 0.01}
+
+
+def bench_tobii(frequency, duration, writer=True):
+    """
+    Record a simulated tracker through Tobii and the session writer.
+
+    Returns:
+    - dict with the callback duration and delivery delay percentiles (us),
+      the sample loss (fraction of simulated samples not in the buffer) and
+      the number of batches the writer dropped
+    """
+    from Tobii import Tobii
+
+    backend = FakeTobiiResearch(frequency=frequency)
+    tobii = Tobii(backend)
+    with tempfile.TemporaryDirectory() as directory:
+        session_writer = None
+        if writer:
+            session_writer = SessionWriter(directory)
+            tobii.attach_writer(session_writer)
+            session_writer.start()
+        tobii.start_recording()
+        time.sleep(duration)
+        tobii.stop_recording()
+        if session_writer is not None:
+            session_writer.close()
+
+    tracker = backend.eyetrackers[0]
+    results = tracker.callback_stats()
+    results['sample_loss'] = 1 - len(tobii.get_data()) / max(tracker.emitted, 1)
+    if session_writer is not None:
+        results['writer_lost_rows'] = session_writer.lost_rows
+    return results
+
+
+def bench_memory(frequency, duration, warmup=0.5):
+    """
+    Memory growth while recording a simulated tracker, extrapolated to one hour.
+
+    The Python heap is traced between the end of the warm-up and the end of
+    the run. The planned growth of the sample buffers is separated from the
+    rest, which should stay close to zero (anything else is a leak).
+
+    Returns:
+    - dict with 'mb_per_hour' (recorded data + other growth), 'data_mb_per_hour'
+      and 'other_mb_per_hour'
+    """
+    from Tobii import Tobii
+
+    backend = FakeTobiiResearch(frequency=frequency)
+    tracker = backend.eyetrackers[0]
+    tobii = Tobii(backend)
+    buffers = (tobii.gaze_data, tracker.timing)
+
+    def allocated():
+        return sum(buffer.capacity * buffer.dtype.itemsize for buffer in buffers)
+
+    tracemalloc.start()
+    try:
+        tobii.start_recording()
+        time.sleep(warmup)
+        start_traced, _ = tracemalloc.get_traced_memory()
+        start_buffers = allocated()
+        start_samples = len(tobii.gaze_data)
+        start = now()
+        time.sleep(duration)
+        end_traced, _ = tracemalloc.get_traced_memory()
+        end_buffers = allocated()
+        samples = len(tobii.gaze_data) - start_samples
+        elapsed = now() - start
+        tobii.stop_recording()
+    finally:
+        tracemalloc.stop()
+
+    per_hour = 3600 / elapsed / 1e6
+    data = samples * sum(buffer.dtype.itemsize for buffer in buffers) * per_hour
+    other = ((end_traced - start_traced) - (end_buffers - start_buffers)) * per_hour
+    return {
+        'mb_per_hour': data + other,
+        'data_mb_per_hour': data,
+        'other_mb_per_hour': other,
+    }
+
+
+def bench_webcam(duration, source=None, **webcam_args):
+    """
+    Run the webcam pipeline headless on a synthetic camera (or the given video file).
+
+    Returns:
+    - dict with the capture and processing FPS and the dropped frames, or
+      {'skipped': reason} if MediaPipe is not installed
+    """
+    try:
+        import mediapipe
+    except ImportError as e:
+        return {'skipped': str(e)}
+    from Webcam import Webcam
+
+    if source is None:
+        source = SyntheticCamera
+    elif not callable(source):
+        from functools import partial
+        from MultiCamera import VideoFileSource
+        source = partial(VideoFileSource, source, loop=True)
+    webcam = Webcam(cam_index=source, show_preview=False, **webcam_args)
+    thread = threading.Thread(target=webcam.start_recording_webcam, daemon=True)
+    thread.start()
+    time.sleep(duration)
+    webcam.stop_recording()
+    thread.join()
+    stats = webcam.pipeline_stats()
+    return {
+        'capture_fps': stats.get('capture_fps', 0.0),
+        'processed_fps': stats.get('processed_fps', 0.0),
+        'dropped': stats.get('dropped', 0),
+        'frames': stats.get('captured', 0),
+    }
+
+
+def bench_stimulus(trials, interval=0.1):
+    """
+    Onset accuracy of the stimulus scheduler with a real window.
+
+    Returns:
+    - Stimulus.timing_stats(), or {'skipped': reason} without a display
+    """
+    from Stimulus import Stimulus
+
+    stimulus = Stimulus(1920, 1200, 38, 24, 1920 / 38)
+    try:
+        cv2.namedWindow('Stimulus Presentation', cv2.WINDOW_NORMAL)
+    except cv2.error as e:
+        return {'skipped': f'no display ({e.err})'}
+    try:
+        stimulus.measure_wait_overshoot()
+        _, blank_time, _ = stimulus.show(stimulus.blank_screen)
+        target = blank_time + interval
+        for trial in range(trials):
+            offset_pixel = stimulus.offset_pixel[trial % len(stimulus.offset_pixel)]
+            stimulus.wait_until(target)
+            issued, onset, _ = stimulus.show(stimulus.frames[offset_pixel])
+            stimulus.timing['target_onsets'].append(target)
+            stimulus.timing['issued'].append(issued)
+            stimulus.timing['onsets'].append(onset)
+            target = onset + interval
+    finally:
+        cv2.destroyWindow('Stimulus Presentation')
+    return stimulus.timing_stats()
+
+
+def run_all(quick=False, video=None):
+    """
+    Run the whole suite.
+
+    Args:
+    - quick (bool): Shorter runs (noisier numbers, for a smoke test)
+    - video (str): Video file for the webcam benchmark instead of the synthetic camera
+
+    Returns:
+    - dict benchmark name -> metrics
+    """
+    duration = 2.0 if quick else 10.0
+    results = {}
+    for frequency in (60, 300, 600, 1200):
+        print(f"[Benchmark] Tobii callback at {frequency} Hz...")
+        results[f'tobii_{frequency}hz'] = bench_tobii(frequency, duration)
+    print("[Benchmark] Memory growth at 1200 Hz...")
+    results['memory_1200hz'] = bench_memory(1200, duration)
+    print("[Benchmark] Webcam pipeline...")
+    results['webcam'] = bench_webcam(duration, video)
+    print("[Benchmark] Stimulus onsets...")
+    results['stimulus'] = bench_stimulus(20 if quick else 100)
+    return results
+
+
+def environment():
+    """Describes the machine, baselines are only comparable on the same one."""
+    return {
+        'node': platform.node(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+    }
+
+
+def baseline_path(directory=BASELINE_DIR):
+    return os.path.join(directory, f'{platform.node() or "baseline"}.json')
+
+
+def save_baseline(results, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'environment': environment(),
+                   'results': results}, f, indent=2)
+    print(f"[Benchmark] Baseline saved to {path}")
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Find the metrics that got worse than the baseline by more than tolerance.
+
+    Returns:
+    - list of (benchmark, metric, baseline value, current value, relative change)
+    """
+    regressions = []
+    for name, metrics in results.items():
+        reference = baseline.get(name, {})
+        for metric, value in metrics.items():
+            base = reference.get(metric)
+            if any(key in metric for key in NOT_COMPARED) or not isinstance(value, (int, float)) or not isinstance(base, (int, float)):
+                continue
+            higher_is_better = any(key in metric for key in HIGHER_IS_BETTER)
+            change = (value - base) / max(abs(base), MIN_SCALE.get(metric, 1.0))
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append((name, metric, base, value, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the recording pipeline on simulated devices.')
+    parser.add_argument('--quick', action='store_true', help='short runs for a smoke test')
+    parser.add_argument('--video', help='video file for the webcam benchmark')
+    parser.add_argument('--save', nargs='?', const=baseline_path(), help='store the results as baseline')
+    parser.add_argument('--compare', nargs='?', const=baseline_path(), help='compare against a baseline')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    start = now()
+    results = run_all(args.quick, args.video)
+    print(json.dumps(results, indent=2))
+    print(f"[Benchmark] Done in {now() - start:.0f}s.")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=2)
+    if args.save:
+        save_baseline(results, args.save)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('environment', {}).get('node') != platform.node():
+            print("[Benchmark] Warning: the baseline was recorded on another machine.")
+        regressions = compare(results, baseline['results'], args.tolerance)
+        for name, metric, base, value, change in regressions:
+            print(f"[Benchmark] REGRESSION {name}.{metric}: {base:.4g} -> {value:.4g} ({change:+.0%})")
+        if regressions:
+            return 1
+        print("[Benchmark] No regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
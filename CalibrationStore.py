@@ -0,0 +1,164 @@
+#Calibrations kept on disk, so returning participants do not have to recalibrate
+
+import hashlib
+import json
+import os
+import time
+
+
+# Seconds a stored calibration stays usable
+MAX_AGE = 14 * 24 * 3600
+
+
+class CalibrationStore:
+
+    """
+    Tracker calibrations (retrieve_calibration_data() blobs) indexed by tracker
+    serial number, participant id and screen geometry.
+
+    Every blob is a file named by its SHA-1 in directory; index.json lists the
+    entries with their creation time and validation score (mean error in
+    degrees, None if not validated). The index is replaced atomically, so an
+    interrupted write never loses the stored calibrations.
+
+    Args:
+    - directory (str): Directory of the store, created if needed
+    - max_age (float): Seconds an entry is kept; older entries are evicted
+    - keep (int): Entries kept per tracker, participant and screen (newest first)
+    """
+
+    def __init__(self, directory='calibrations', max_age=MAX_AGE, keep=3):
+        self.directory = directory
+        self.max_age = max_age
+        self.keep = keep
+        self.index_path = os.path.join(directory, 'index.json')
+        os.makedirs(directory, exist_ok=True)
+        self.entries = self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+        except ValueError:
+            print(f"[CalibrationStore] {self.index_path} is damaged, starting a new index.")
+            return []
+
+    def _save_index(self):
+        temporary = self.index_path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(temporary, self.index_path)
+
+    def _blob_path(self, entry):
+        return os.path.join(self.directory, entry['blob'] + '.bin')
+
+    @staticmethod
+    def _matches(entry, serial_number, participant_id, screen):
+        return (entry['serial_number'] == serial_number and entry['participant_id'] == str(participant_id)
+                and entry['screen'] == list(screen))
+
+    def save(self, serial_number, participant_id, screen, calibration_data, score=None):
+        """
+        Store a calibration.
+
+        Args:
+        - serial_number (str): Serial number of the tracker
+        - participant_id (str): Participant the calibration belongs to
+        - screen (tuple): Screen geometry, e.g. (width px, height px)
+        - calibration_data (bytes): Blob from retrieve_calibration_data()
+        - score (float): Validation error in degrees, None if not validated
+
+        Returns:
+        - dict: The new index entry
+        """
+        blob = hashlib.sha1(calibration_data).hexdigest()
+        entry = {
+            'serial_number': serial_number,
+            'participant_id': str(participant_id),
+            'screen': list(screen),
+            'created': time.time(),
+            'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'score': score,
+            'blob': blob,
+        }
+        path = self._blob_path(entry)
+        if not os.path.exists(path):
+            with open(path + '.tmp', 'wb') as f:
+                f.write(calibration_data)
+            os.replace(path + '.tmp', path)
+        self.entries.append(entry)
+        self.evict()
+        return entry
+
+    def find(self, serial_number, participant_id, screen, max_score=None):
+        """
+        Newest usable calibration of a participant on this tracker and screen.
+
+        Args:
+        - max_score (float): Only accept entries validated with at most this error
+          (degrees); None also accepts entries that were never validated
+
+        Returns:
+        - dict: Index entry, or None
+        """
+        oldest = time.time() - self.max_age
+        for entry in sorted(self.entries, key=lambda entry: entry['created'], reverse=True):
+            if entry['created'] < oldest or not self._matches(entry, serial_number, participant_id, screen):
+                continue
+            # not <=: a validation without valid samples scores NaN
+            if max_score is not None and (entry['score'] is None or not entry['score'] <= max_score):
+                continue
+            if os.path.exists(self._blob_path(entry)):
+                return entry
+        return None
+
+    def load(self, entry):
+        """Returns the calibration blob of an entry."""
+        with open(self._blob_path(entry), 'rb') as f:
+            return f.read()
+
+    def set_score(self, entry, score):
+        """Record the result of a later validation of an entry."""
+        entry['score'] = score
+        entry['validated_at'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        self._save_index()
+
+    def evict(self):
+        """
+        Drop stale entries and all but the newest keep entries of each
+        tracker / participant / screen, and delete blobs nothing refers to.
+
+        Returns:
+        - int: Number of entries removed
+        """
+        oldest = time.time() - self.max_age
+        kept = []
+        counts = {}
+        for entry in sorted(self.entries, key=lambda entry: entry['created'], reverse=True):
+            key = (entry['serial_number'], entry['participant_id'], tuple(entry['screen']))
+            counts[key] = counts.get(key, 0) + 1
+            if entry['created'] >= oldest and counts[key] <= self.keep:
+                kept.append(entry)
+        removed = len(self.entries) - len(kept)
+        self.entries = kept[::-1]
+        self._save_index()
+
+        referenced = {entry['blob'] + '.bin' for entry in self.entries}
+        for name in os.listdir(self.directory):
+            if name.endswith('.bin') and name not in referenced:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+        return removed
+
+
+if __name__ == "__main__":
+
+    store = CalibrationStore()
+    print(f"[CalibrationStore] {store.evict()} stale entries removed, {len(store.entries)} kept:")
+    for entry in store.entries:
+        print(f"  {entry['created_at']}  {entry['serial_number']}  {entry['participant_id']}  "
+              f"{entry['screen']}  score={entry['score']}")
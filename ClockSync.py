@@ -0,0 +1,240 @@
+#Clock synchronization between the Tobii clocks and the common timebase
+
+import threading
+import time
+
+import numpy as np
+
+
+def now():
+    """
+    Common timebase of every stream and marker: a high-resolution monotonic clock in seconds.
+
+    Unlike time.time() it is not affected by NTP adjustments.
+    """
+    return time.perf_counter()
+
+
+class OnlineClockFit:
+
+    """
+    Robust online estimate of y = offset + slope * (x - x_ref) between two clocks.
+
+    Pairs come from round-trip measurements. Only the pairs with the shortest
+    round trips of the window are used (their midpoint is the most accurate),
+    the line is fitted by least squares and refitted without the outliers
+    beyond 3 MAD. The window keeps the fit following slow drift.
+
+    Pairs are added from the SDK callback threads, so the fit is not redone
+    for every pair: it is refitted for each of the first refit_every pairs
+    (until the estimate settles), then once every refit_every pairs.
+
+    The estimate is published as one tuple, params = (x_ref, offset, slope),
+    replaced in a single assignment by each fit: a reader on another thread
+    takes params once and never mixes the slope of one fit with the offset
+    of the next.
+
+    Args:
+    - window (int): Number of most recent pairs used for the fit
+    - keep_fraction (float): Fraction of the pairs with the shortest round trip used for the fit
+    - refit_every (int): Number of pairs between two fits once the first ones are in
+    """
+
+    def __init__(self, window=256, keep_fraction=0.5, refit_every=16):
+        self.window = window
+        self.keep_fraction = keep_fraction
+        self.refit_every = refit_every
+        self._x = np.zeros(window)
+        self._y = np.zeros(window)
+        self._rtt = np.zeros(window)
+        self._count = 0
+        self._lock = threading.Lock()
+        self._x_ref = None
+        self.params = None  # (x_ref, offset, slope) of the last fit
+        self.residual = float('nan')
+
+    @property
+    def ready(self):
+        return self.params is not None
+
+    @property
+    def count(self):
+        return self._count
+
+    def add(self, x, y, rtt):
+        """
+        Add one pair, the fit is updated on the refit_every cadence.
+
+        Args:
+        - x (float): Time in the source clock (seconds), midpoint of the round trip
+        - y (float): Time in the target clock (seconds)
+        - rtt (float): Round-trip time of the measurement (seconds)
+        """
+        self.add_many((x,), (y,), (rtt,))
+
+    def add_many(self, x, y, rtt):
+        """
+        Add several pairs (sequences like add's arguments) with at most one fit.
+        """
+        with self._lock:
+            if self._x_ref is None:
+                self._x_ref = x[0]
+            before = self._count
+            for pair in zip(x, y, rtt):
+                i = self._count % self.window
+                self._x[i] = pair[0] - self._x_ref
+                self._y[i] = pair[1]
+                self._rtt[i] = pair[2]
+                self._count += 1
+            if self._count <= self.refit_every or self._count // self.refit_every > before // self.refit_every:
+                self._fit()
+
+    def refit(self):
+        """Fit the pairs added since the last fit now (e.g. before reporting the estimate)."""
+        with self._lock:
+            if self._count:
+                self._fit()
+
+    def _fit(self):
+        n = min(self._count, self.window)
+        x, y, rtt = self._x[:n], self._y[:n], self._rtt[:n]
+        if n >= 8:
+            keep = rtt <= np.quantile(rtt, self.keep_fraction)
+            x, y = x[keep], y[keep]
+
+        if len(x) < 3 or np.ptp(x) < 1e-3:
+            slope = 1.0
+            offset = np.median(y - x)
+        else:
+            slope, offset = np.polyfit(x, y, 1)
+            residuals = y - (offset + slope * x)
+            mad = np.median(np.abs(residuals - np.median(residuals)))
+            inliers = np.abs(residuals) <= 3 * 1.4826 * mad + 1e-9
+            if 3 <= inliers.sum() < len(x):
+                slope, offset = np.polyfit(x[inliers], y[inliers], 1)
+                x, y = x[inliers], y[inliers]
+        self.residual = float(np.std(y - (offset + slope * x)))
+        self.params = (self._x_ref, float(offset), float(slope))
+
+    def forward(self, x):
+        """Maps source-clock time(s) to the target clock (works on arrays)."""
+        x_ref, offset, slope = self.params
+        return offset + slope * (np.asarray(x, dtype=np.float64) - x_ref)
+
+    def inverse(self, y):
+        """Maps target-clock time(s) back to the source clock (works on arrays)."""
+        x_ref, offset, slope = self.params
+        return x_ref + (np.asarray(y, dtype=np.float64) - offset) / slope
+
+
+class ClockSync:
+
+    """
+    Maps the Tobii clocks onto the common timebase (see now()).
+
+    Two relations are estimated continuously:
+    - the SDK system clock (tr.get_system_time_stamp(), in which the samples'
+      system_time_stamp is expressed) against now(), from bracketed reads;
+    - the eye tracker device clock against the SDK system clock, from the
+      SDK time-synchronization stream.
+    Both use OnlineClockFit, so offset and drift follow the clocks over the session.
+
+    Args:
+    - eyetracker: tobii_research EyeTracker, or None to only map the system clock
+    - window (int): Number of recent measurements each fit uses
+    - backend: Module providing the tobii_research API, defaults to tobii_research
+    """
+
+    def __init__(self, eyetracker=None, window=256, backend=None):
+        self.eyetracker = eyetracker
+        self.backend = backend
+        self.system_fit = OnlineClockFit(window)   # now() -> SDK system clock
+        self.device_fit = OnlineClockFit(window)   # SDK system clock -> device clock
+        # Anchor to convert the common timebase back to wall-clock time
+        self.wall_anchor = (time.time(), now())
+        self._subscribed = False
+
+    def _tr(self):
+        if self.backend is None:
+            import tobii_research
+            self.backend = tobii_research
+        return self.backend
+
+    def measure_system_offset(self, repeats=20):
+        """Bracket tr.get_system_time_stamp() between two now() reads, repeats times."""
+        tr = self._tr()
+        midpoints, systems, rtts = [], [], []
+        for _ in range(repeats):
+            t0 = now()
+            system = tr.get_system_time_stamp() * 1e-6
+            t1 = now()
+            midpoints.append((t0 + t1) / 2)
+            systems.append(system)
+            rtts.append(t1 - t0)
+        self.system_fit.add_many(midpoints, systems, rtts)
+
+    def start(self):
+        """Measures the system clock offset and subscribes to the time-synchronization stream."""
+        self.measure_system_offset()
+        if self.eyetracker is not None and not self._subscribed:
+            self.eyetracker.subscribe_to(self._tr().EYETRACKER_TIME_SYNCHRONIZATION_DATA,
+                                         self._time_sync_callback, as_dictionary=True)
+            self._subscribed = True
+
+    def stop(self):
+        """Unsubscribes from the time-synchronization stream."""
+        if self._subscribed:
+            self.eyetracker.unsubscribe_from(self._tr().EYETRACKER_TIME_SYNCHRONIZATION_DATA,
+                                             self._time_sync_callback)
+            self._subscribed = False
+
+    def _time_sync_callback(self, time_sync_data):
+        request = time_sync_data['system_request_time_stamp'] * 1e-6
+        response = time_sync_data['system_response_time_stamp'] * 1e-6
+        self.device_fit.add((request + response) / 2, time_sync_data['device_time_stamp'] * 1e-6,
+                            response - request)
+        # Piggyback a fresh system clock measurement to follow its drift too
+        self.measure_system_offset(repeats=3)
+
+    def system_to_common(self, system_time_stamp):
+        """
+        Convert SDK system time stamps (microseconds, scalar or array) to the common timebase.
+        """
+        params = self.system_fit.params  # read once, a fit on another thread may replace it
+        if np.ndim(system_time_stamp) == 0:
+            # Scalar path for the gaze callback, plain float arithmetic is much cheaper
+            if params is None:
+                return now()
+            x_ref, offset, slope = params
+            return x_ref + (system_time_stamp * 1e-6 - offset) / slope
+        if params is None:
+            return np.full(np.shape(system_time_stamp), np.nan)
+        x_ref, offset, slope = params
+        return x_ref + (np.asarray(system_time_stamp, dtype=np.float64) * 1e-6 - offset) / slope
+
+    def device_to_common(self, device_time_stamp):
+        """
+        Convert device time stamps (microseconds, scalar or array) to the common timebase.
+        """
+        if not self.device_fit.ready:
+            return np.full(np.shape(device_time_stamp), np.nan)
+        return self.system_to_common(self.device_fit.inverse(np.asarray(device_time_stamp) * 1e-6) * 1e6)
+
+    def to_wall_clock(self, t):
+        """Convert common timebase seconds to Unix time (for display only)."""
+        return self.wall_anchor[0] + (np.asarray(t) - self.wall_anchor[1])
+
+    def status(self):
+        """Returns the current offset and drift estimates (JSON-serializable)."""
+        status = {'wall_anchor': list(self.wall_anchor)}
+        for name, fit in (('system', self.system_fit), ('device', self.device_fit)):
+            fit.refit()
+            if fit.ready:
+                x_ref, offset, slope = fit.params
+                status[name] = {
+                    'offset_s': offset - x_ref,
+                    'drift_ppm': (slope - 1.0) * 1e6,
+                    'residual_us': fit.residual * 1e6,
+                    'measurements': fit.count,
+                }
+        return status
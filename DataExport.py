@@ -0,0 +1,219 @@
+#Columnar export of the session data
+
+import csv
+import json
+import os
+import warnings
+
+import numpy as np
+
+from GazeBuffer import STIMULUS_DTYPE
+from SessionWriter import recover_session
+
+
+FORMAT_VERSION = 1
+# File name prefixes of the CSV fallback (kept compatible with the old save_data output)
+CSV_NAMES = {
+    'stimulus': 'stimulus_data',
+    'tobii': 'tobii_data',
+    'tobii_markers': 'tobii_markers',
+    'webcam': 'webcam_gaze_data',
+    'webcam_markers': 'webcam_markers',
+}
+
+
+def stimulus_array(stimulus_data):
+    """
+    Convert Stimulus.stimulus_data (dict of lists) to a STIMULUS_DTYPE array.
+    """
+    data = np.empty(len(stimulus_data['timestamps']), dtype=STIMULUS_DTYPE)
+    data['system_timestamp'] = stimulus_data['timestamps']
+    data['stimulus_position'] = stimulus_data['stimulus_positions']
+    data['stimulus_offset_cm'] = stimulus_data['stimulus_offsets_cm']
+    return data
+
+
+def export_session(output_dir, timestamp, streams, metadata=None, fmt='npy'):
+    """
+    Write every stream of a session as typed columns.
+
+    Args:
+    - output_dir (str): Directory the files are written to
+    - timestamp (str): Session timestamp used in the file names
+    - streams (dict): Stream name -> structured array (see GazeBuffer dtypes)
+    - metadata (dict): JSON-serializable session information stored with the data
+    - fmt (str): 'npy' one uncompressed .npy file per column (memory-mappable),
+      'npz' a single compressed archive, 'csv' one CSV file per stream
+
+    Returns:
+    - path of the written directory / archive / first CSV file
+    """
+    meta = {
+        'format_version': FORMAT_VERSION,
+        'timestamp': timestamp,
+        'metadata': metadata or {},
+        'streams': {name: {'rows': len(data),
+                           'columns': {col: data.dtype[col].str for col in data.dtype.names}}
+                    for name, data in streams.items()},
+    }
+
+    if fmt == 'npy':
+        path = os.path.join(output_dir, f'session_data_{timestamp}')
+        for name, data in streams.items():
+            stream_dir = os.path.join(path, name)
+            os.makedirs(stream_dir, exist_ok=True)
+            for col in data.dtype.names:
+                # Copy each field out of the interleaved rows into its own contiguous column
+                np.save(os.path.join(stream_dir, col + '.npy'), np.ascontiguousarray(data[col]))
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    elif fmt == 'npz':
+        path = os.path.join(output_dir, f'session_data_{timestamp}.npz')
+        columns = {f'{name}/{col}': data[col] for name, data in streams.items() for col in data.dtype.names}
+        columns['meta.json'] = np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8)
+        np.savez_compressed(path, **columns)
+
+    elif fmt == 'csv':
+        path = None
+        for name, data in streams.items():
+            csv_path = os.path.join(output_dir, f'{CSV_NAMES.get(name, name)}_{timestamp}.csv')
+            write_csv(csv_path, data)
+            path = path or csv_path
+        with open(os.path.join(output_dir, f'session_meta_{timestamp}.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    else:
+        raise ValueError(f"Unknown export format '{fmt}', expected 'npy', 'npz' or 'csv'")
+
+    return path
+
+
+def _csv_field(value):
+    # Quoted the way csv.writer does, only when needed (e.g. a marker with a comma)
+    if any(c in value for c in ',"\r\n'):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def write_csv(path, data, chunk_size=65536):
+    """
+    Write a structured array as CSV with one format string for all rows.
+
+    The rows are formatted chunk by chunk from per-column lists, which is
+    several times faster than csv.writer or np.savetxt on structured rows.
+    String fields are quoted like csv.writer does.
+
+    Args:
+    - path (str): Output file
+    - data (np.ndarray): Structured array, its field names are used as header
+    - chunk_size (int): Rows formatted at once
+    """
+    fmts = []
+    for col in data.dtype.names:
+        kind = data.dtype[col].kind
+        if kind == 'f':
+            fmts.append('%.17g' if data.dtype[col].itemsize == 8 else '%.9g')
+        elif kind in 'iub':
+            fmts.append('%d')
+        else:
+            fmts.append('%s')
+    row_format = ','.join(fmts) + '\n'
+
+    with open(path, 'w', newline='') as f:
+        f.write(','.join(data.dtype.names) + '\n')
+        for start in range(0, len(data), chunk_size):
+            chunk = data[start:start + chunk_size]
+            columns = [chunk[col].tolist() for col in data.dtype.names]
+            for i, col in enumerate(data.dtype.names):
+                if data.dtype[col].kind == 'U':
+                    columns[i] = [_csv_field(value) for value in columns[i]]
+            f.write(''.join([row_format % row for row in zip(*columns)]))
+
+
+def read_csv(path, dtype):
+    """
+    Read a CSV file written by write_csv back into a structured array.
+
+    Args:
+    - path (str): CSV file
+    - dtype (np.dtype): Structured dtype of the rows (see the 'streams' of the session meta)
+
+    Returns:
+    - np.ndarray
+    """
+    dtype = np.dtype(dtype)
+    if any(dtype[name].kind == 'U' for name in dtype.names):
+        # Quoted strings (markers) need a real CSV parser, the columns are converted afterwards
+        with open(path, newline='') as f:
+            rows = list(csv.reader(f))[1:]
+        data = np.empty(len(rows), dtype=dtype)
+        for name, values in zip(dtype.names, zip(*rows)):
+            data[name] = np.array(values).astype(dtype[name])
+        return data
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # a stream without rows is only a header
+        return np.loadtxt(path, dtype=dtype, delimiter=',', skiprows=1, ndmin=1, comments=None)
+
+
+def load_session(path, mmap=True):
+    """
+    Load a session written by export_session.
+
+    Args:
+    - path (str): session_data_<timestamp> directory or .npz archive
+    - mmap (bool): Memory-map the columns of a directory instead of reading them
+
+    Returns:
+    - dict: stream name -> {column name -> np.ndarray}, plus 'meta' -> dict
+    """
+    session = {}
+    if os.path.isdir(path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            session['meta'] = json.load(f)
+        for name, info in session['meta']['streams'].items():
+            session[name] = {col: np.load(os.path.join(path, name, col + '.npy'),
+                                          mmap_mode='r' if mmap else None)
+                             for col in info['columns']}
+    else:
+        archive = np.load(path)
+        session['meta'] = json.loads(archive['meta.json'].tobytes().decode())
+        for name, info in session['meta']['streams'].items():
+            session[name] = {col: archive[f'{name}/{col}'] for col in info['columns']}
+    return session
+
+
+def to_records(columns):
+    """
+    Rebuild a structured array from the column dict of one stream (copies the data).
+    """
+    names = list(columns)
+    data = np.empty(len(columns[names[0]]) if names else 0,
+                    dtype=[(name, columns[name].dtype) for name in names])
+    for name in names:
+        data[name] = columns[name]
+    return data
+
+
+def load_streams(path):
+    """
+    Load the recorded streams of a session as structured arrays.
+
+    Args:
+    - path (str): Exported session (session_data_<timestamp> directory or .npz, see
+      export_session), a SessionWriter directory (also of a crashed session) or its recovered .npz
+
+    Returns:
+    - dict: stream name -> np.ndarray
+    """
+    if os.path.isdir(path):
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            session = load_session(path, mmap=False)
+            return {name: to_records(columns) for name, columns in session.items() if name != 'meta'}
+        return recover_session(path)
+    with np.load(path) as archive:
+        exported = 'meta.json' in archive.files
+        if not exported:
+            return {name: archive[name] for name in archive.files}
+    session = load_session(path)
+    return {name: to_records(columns) for name, columns in session.items() if name != 'meta'}
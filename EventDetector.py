@@ -0,0 +1,374 @@
+#Online fixation, saccade and blink detection on the Tobii gaze stream
+
+import math
+import struct
+from collections import deque
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from GazeBuffer import GazeBuffer, EVENT_DTYPE
+
+
+FIXATION = 'fixation'
+FIXATION_START = 'fixation_start'
+SACCADE = 'saccade'
+BLINK = 'blink'
+
+# Labels of single samples
+_GAP, _FIXATION, _SACCADE, _UNKNOWN = 0, 1, 2, 3
+
+_FLOAT32 = struct.Struct('4f')
+
+
+def binocular_gaze(gaze_data):
+    """
+    Gaze point of one SDK sample: mean of the valid eyes, NaN if neither is valid.
+
+    The eyes are rounded to float32 first, like the TOBII_DTYPE columns, so
+    binocular_gaze_array() gives the same values on the recorded data.
+
+    Returns:
+    - (x, y) in normalized display coordinates
+    """
+    left = gaze_data['left_gaze_point_on_display_area']
+    right = gaze_data['right_gaze_point_on_display_area']
+    lx, ly, rx, ry = _FLOAT32.unpack(_FLOAT32.pack(left[0], left[1], right[0], right[1]))
+    if gaze_data['left_gaze_point_validity']:
+        if gaze_data['right_gaze_point_validity']:
+            return (lx + rx) / 2, (ly + ry) / 2
+        return lx, ly
+    if gaze_data['right_gaze_point_validity']:
+        return rx, ry
+    return math.nan, math.nan
+
+
+def binocular_gaze_array(data):
+    """
+    binocular_gaze() of every row of a Tobii recording (TOBII_DTYPE).
+
+    Returns:
+    - (x, y) float64 arrays
+    """
+    left = data['left_gaze_validity'] != 0
+    right = data['right_gaze_validity'] != 0
+    gaze = []
+    for axis in ('x', 'y'):
+        lv = data['left_gaze_' + axis].astype(np.float64)
+        rv = data['right_gaze_' + axis].astype(np.float64)
+        gaze.append(np.where(left & right, (lv + rv) / 2, np.where(left, lv, np.where(right, rv, np.nan))))
+    return gaze[0], gaze[1]
+
+
+def same_events(a, b, atol=1e-6):
+    """True if two event tables have the same events (positions compared with atol)."""
+    return (len(a) == len(b) and np.array_equal(a['event'], b['event'])
+            and np.array_equal(a['onset'], b['onset']) and np.array_equal(a['offset'], b['offset'])
+            and np.allclose(a['x'], b['x'], atol=atol, equal_nan=True)
+            and np.allclose(a['y'], b['y'], atol=atol, equal_nan=True))
+
+
+class EventDetector:
+
+    """
+    Incremental I-VT / I-DT classification of the gaze into fixations,
+    saccades and blinks.
+
+    Every sample is labelled from a rolling window of the current valid
+    stretch of data, with O(1) amortized work: I-VT compares the velocity
+    over the last velocity_window seconds with velocity_threshold; I-DT
+    keeps monotonic deques of the extremes of the last min_fixation seconds
+    and compares their dispersion with dispersion_threshold. Runs of equal
+    labels become events, which are stored in events and passed to the
+    subscribers as soon as they end:
+
+    - 'fixation_start' once a fixation has lasted min_fixation (for gaze-contingent displays)
+    - 'fixation' when it ends, with its mean position
+    - 'saccade' with its landing point
+    - 'blink' for data losses between min_blink and max_blink seconds
+
+    detect() runs the same classification vectorized over a recording and
+    returns the same events, for validation and offline analysis.
+
+    Args:
+    - method (str): 'ivt' or 'idt'
+    - frequency (float): Sampling frequency of the tracker (Hz), sets the window lengths in samples
+    - velocity_threshold (float): I-VT threshold in degrees per second
+    - dispersion_threshold (float): I-DT threshold in degrees (x range + y range)
+    - min_fixation (float): Shortest fixation in seconds (also the I-DT window)
+    - min_blink, max_blink (float): Duration range of a data loss counted as a blink (seconds)
+    - velocity_window (float): Seconds the I-VT velocity is measured over
+    - display_size_mm (tuple): Width and height of the display area in mm
+    - distance_mm (float): Viewing distance in mm
+    """
+
+    def __init__(self, method='ivt', frequency=600.0, velocity_threshold=30.0, dispersion_threshold=1.0,
+                 min_fixation=0.06, min_blink=0.05, max_blink=0.5, velocity_window=0.02,
+                 display_size_mm=(527.0, 296.0), distance_mm=650.0):
+        if method not in ('ivt', 'idt'):
+            raise ValueError(f"Unknown method {method!r}, use 'ivt' or 'idt'")
+        self.method = method
+        self.frequency = frequency
+        self.velocity_threshold = velocity_threshold
+        self.dispersion_threshold = dispersion_threshold
+        self.min_fixation = min_fixation
+        self.min_blink = min_blink
+        self.max_blink = max_blink
+        # Degrees of visual angle per unit of normalized display coordinates
+        self.scale_x = math.degrees(2 * math.atan(display_size_mm[0] / 2 / distance_mm))
+        self.scale_y = math.degrees(2 * math.atan(display_size_mm[1] / 2 / distance_mm))
+        self.velocity_samples = max(1, int(round(velocity_window * frequency)))
+        self.window_samples = max(2, int(round(min_fixation * frequency)) + 1)
+        # Half a sample of slack in duration checks, so timestamp jitter does not cost a sample
+        self.tolerance = 0.5 / frequency
+        self.events = GazeBuffer(EVENT_DTYPE, capacity=1024, chunk_size=1024)
+        self._subscribers = []
+        self.reset()
+
+    def reset(self):
+        """Forget the current run and the detected events."""
+        self.events.clear()
+        self.current_fixation = None  # (onset, x, y) while a fixation of min_fixation is going on
+        self._run = None
+        self._count = 0
+        self._recent = deque()
+        self._extremes = (deque(), deque(), deque(), deque())
+
+    def subscribe(self, callback):
+        """
+        Call callback(event) for every new event, with event a (type, onset, offset, x, y) tuple.
+
+        Callbacks run on the tracker's callback thread and must return quickly.
+        """
+        self._subscribers.append(callback)
+
+    def _emit(self, event):
+        self.events.append(event)
+        for callback in self._subscribers:
+            callback(event)
+
+    def _ivt(self, t, x, y):
+        recent = self._recent
+        recent.append((t, x, y))
+        if len(recent) > self.velocity_samples + 1:
+            recent.popleft()
+        t0, x0, y0 = recent[0]
+        if t <= t0:
+            return _FIXATION, t
+        dx = x - x0
+        dy = y - y0
+        velocity = math.sqrt(dx * dx + dy * dy) / (t - t0)
+        return (_FIXATION if velocity < self.velocity_threshold else _SACCADE), t
+
+    def _idt(self, t, x, y):
+        index = self._count
+        first = index - self.window_samples + 1
+        times = self._recent
+        times.append(t)
+        if len(times) > self.window_samples:
+            times.popleft()
+        max_x, min_x, max_y, min_y = self._extremes
+        for extremes, value, larger in ((max_x, x, True), (min_x, x, False), (max_y, y, True), (min_y, y, False)):
+            while extremes and (extremes[-1][1] <= value if larger else extremes[-1][1] >= value):
+                extremes.pop()
+            extremes.append((index, value))
+            if extremes[0][0] < first:
+                extremes.popleft()
+        if first < 0:
+            return _UNKNOWN, t
+        dispersion = (max_x[0][1] - min_x[0][1]) + (max_y[0][1] - min_y[0][1])
+        if dispersion <= self.dispersion_threshold:
+            return _FIXATION, times[0]
+        return _SACCADE, t
+
+    def add(self, t, x, y):
+        """
+        Classify one sample.
+
+        Args:
+        - t (float): Timestamp (seconds)
+        - x, y (float): Gaze in normalized display coordinates, NaN if invalid (see binocular_gaze)
+        """
+        if x != x or y != y:
+            label, onset = _GAP, t
+            if self._count:
+                self._count = 0
+                self._recent.clear()
+                for extremes in self._extremes:
+                    extremes.clear()
+        else:
+            if self.method == 'ivt':
+                label, onset = self._ivt(t, x * self.scale_x, y * self.scale_y)
+            else:
+                label, onset = self._idt(t, x * self.scale_x, y * self.scale_y)
+            self._count += 1
+
+        run = self._run
+        if run is None or label != run[0]:
+            if run is not None:
+                if run[0] == _FIXATION:
+                    self.current_fixation = None
+                if label == _FIXATION:
+                    # The I-DT window does not reach back past the previous run
+                    onset = max(onset, run[2])
+                event = self._close(run, onset)
+                if event is not None:
+                    self._emit(event)
+            run = self._run = [label, onset, t, t, 0, 0.0, 0.0, x, y, False]
+        run[3] = t
+        run[4] += 1
+        run[5] += x
+        run[6] += y
+        run[7] = x
+        run[8] = y
+        if label == _FIXATION and not run[9] and t - run[1] >= self.min_fixation - self.tolerance:
+            run[9] = True
+            self.current_fixation = (run[1], run[5] / run[4], run[6] / run[4])
+            self._emit((FIXATION_START, run[1], t, run[5] / run[4], run[6] / run[4]))
+
+    def flush(self):
+        """End the current run (at the end of a recording)."""
+        self.current_fixation = None
+        if self._run is not None:
+            event = self._close(self._run, math.inf)
+            if event is not None:
+                self._emit(event)
+        self._run = None
+        self._count = 0
+        self._recent.clear()
+        for extremes in self._extremes:
+            extremes.clear()
+
+    def _close(self, run, next_onset):
+        # Event of a run that ended, next_onset is the onset of the run after it
+        label, onset, first, last, n, sum_x, sum_y, last_x, last_y, started = run
+        if label == _FIXATION:
+            if started:
+                return (FIXATION, onset, last, sum_x / n, sum_y / n)
+        elif label == _SACCADE:
+            if next_onset > onset:
+                return (SACCADE, onset, min(last, next_onset), last_x, last_y)
+        elif label == _GAP:
+            if self.min_blink <= last - first + 1 / self.frequency <= self.max_blink:
+                return (BLINK, first, last, math.nan, math.nan)
+        return None
+
+    def labels(self, t, x, y):
+        """
+        Vectorized sample labels of a recording, identical to the online ones.
+
+        Returns:
+        - (labels, onsets): label of every sample and the onset its run would get
+        """
+        n = len(t)
+        index = np.arange(n)
+        valid = np.isfinite(x) & np.isfinite(y)
+        # First index of the valid stretch every sample belongs to
+        run_start = np.maximum.accumulate(np.where(valid, 0, index + 1))
+        gaze_x = np.where(valid, x * self.scale_x, 0.0)
+        gaze_y = np.where(valid, y * self.scale_y, 0.0)
+        onsets = t.copy()
+
+        if self.method == 'ivt':
+            # An invalid sample's stretch starts after it (index + 1), it is its own reference
+            reference = np.minimum(np.maximum(index - self.velocity_samples, run_start), index)
+            dx = gaze_x - gaze_x[reference]
+            dy = gaze_y - gaze_y[reference]
+            dt = t - t[reference]
+            moving = dt > 0
+            velocity = np.zeros(n)
+            velocity[moving] = np.sqrt(dx[moving] * dx[moving] + dy[moving] * dy[moving]) / dt[moving]
+            labels = np.where(velocity < self.velocity_threshold, _FIXATION, _SACCADE)
+        else:
+            k = self.window_samples
+            first = index - k + 1
+            full = first >= run_start
+            dispersion = np.full(n, np.inf)
+            if n >= k:
+                windows_x = sliding_window_view(gaze_x, k)
+                windows_y = sliding_window_view(gaze_y, k)
+                dispersion[k - 1:] = ((windows_x.max(axis=1) - windows_x.min(axis=1))
+                                      + (windows_y.max(axis=1) - windows_y.min(axis=1)))
+            fixation = full & (dispersion <= self.dispersion_threshold)
+            labels = np.where(full, np.where(fixation, _FIXATION, _SACCADE), _UNKNOWN)
+            onsets[fixation] = t[first[fixation]]
+        labels[~valid] = _GAP
+        return labels, onsets
+
+    def detect(self, data):
+        """
+        Offline mode: the events of a whole Tobii recording (TOBII_DTYPE).
+
+        Samples are labelled in one vectorized pass; only the runs are
+        looped over. The result equals the events the online detector emits
+        for the same samples (followed by flush()).
+
+        Returns:
+        - np.ndarray with EVENT_DTYPE
+        """
+        t = data['system_timestamp'].astype(np.float64)
+        x, y = binocular_gaze_array(data)
+        labels, onsets = self.labels(t, x, y)
+        events = []
+        if not len(t):
+            return np.array(events, dtype=EVENT_DTYPE)
+
+        starts = np.flatnonzero(np.diff(labels)) + 1
+        starts = np.concatenate([[0], starts])
+        ends = np.concatenate([starts[1:], [len(t)]])
+        # Running sums for the mean positions (NaN of invalid samples replaced, those runs have no position)
+        cumulative_x = np.concatenate([[0.0], np.cumsum(np.where(np.isfinite(x), x, 0.0))])
+        cumulative_y = np.concatenate([[0.0], np.cumsum(np.where(np.isfinite(y), y, 0.0))])
+
+        previous = None
+        for start, end in zip(starts, ends):
+            label = int(labels[start])
+            onset = onsets[start]
+            if previous is not None:
+                if label == _FIXATION:
+                    onset = max(onset, previous[2])
+                event = self._close(previous, onset)
+                if event is not None:
+                    events.append(event)
+            started = False
+            if label == _FIXATION:
+                # First sample at which the fixation had lasted min_fixation
+                reached = start + int(np.searchsorted(t[start:end] - onset, self.min_fixation - self.tolerance))
+                if reached < end:
+                    started = True
+                    count = reached - start + 1
+                    events.append((FIXATION_START, onset, t[reached],
+                                   (cumulative_x[reached + 1] - cumulative_x[start]) / count,
+                                   (cumulative_y[reached + 1] - cumulative_y[start]) / count))
+            n = end - start
+            previous = [label, onset, t[start], t[end - 1], n,
+                        cumulative_x[end] - cumulative_x[start], cumulative_y[end] - cumulative_y[start],
+                        x[end - 1], y[end - 1], started]
+        event = self._close(previous, math.inf)
+        if event is not None:
+            events.append(event)
+        return np.array(events, dtype=EVENT_DTYPE)
+
+    def get_events(self):
+        """Returns a zero-copy view of the events detected online."""
+        return self.events.view()
+
+
+if __name__ == "__main__":
+
+    import time
+    from FakeDevices import FakeTobiiResearch
+    from Tobii import Tobii
+
+    # Online detection on a simulated tracker, checked against the offline mode
+    tobii = Tobii(FakeTobiiResearch(frequency=600))
+    for method in ('ivt', 'idt'):
+        detector = EventDetector(method, frequency=600)
+        tobii.attach_detector(detector)
+        tobii.start_recording()
+        time.sleep(5)
+        tobii.stop_recording()
+        online = detector.get_events()
+        offline = detector.detect(tobii.get_data())
+        counts = {name: int(np.sum(online['event'] == name)) for name in (FIXATION, SACCADE, BLINK)}
+        print(f"[EventDetector] {method}: {counts}, offline mode identical: {same_events(online, offline)}")
@@ -1,60 +1,73 @@
 from Tobii import Tobii 
-from Webcam import Webcam
+from WebcamProcess import WebcamProcess
 import time
 import cv2
 import numpy as np
-import threading
 from Stimulus import Stimulus
-import csv
+from CalibrationStore import CalibrationStore
+from GazeMapping import GazeModel, calibrate_webcam, fit_webcam
+from EventDetector import EventDetector
+from Filters import OneEuroFilter
+from MarkerBus import MarkerBus
+from Quality import session_quality, print_report, write_report
+from SessionWriter import SessionWriter
+from DataExport import export_session, stimulus_array
+from ClockSync import now
+from concurrent.futures import ThreadPoolExecutor
 import datetime
+import json
+import os
 
-def save_data(stimulus_data, tobii_data, webcam_data):
+def save_data(stimulus_data, tobii_data, webcam_data, tobii_markers=None, webcam_markers=None,
+              metadata=None, fmt='npy', output_dir='.', webcam_screen=None, tobii_events=None, markers=None,
+              webcam_smoothed=None):
 
         """
-        Save experimental data to CSV files.
-        
+        Save experimental data as typed columns (see DataExport).
+
         Args:
             stimulus_data (dict): Stimulus presentation data
-            tobii_data (list): Tobii eye tracking data
-            webcam_data (dict): Webcam eye tracking data
+            tobii_data (np.ndarray): Tobii eye tracking data (structured array)
+            webcam_data (np.ndarray): Webcam eye tracking data (structured array)
+            tobii_markers (np.ndarray): Tobii marker table (structured array)
+            webcam_markers (np.ndarray): Webcam marker table (structured array)
+            metadata (dict): Session information stored with the data
+            fmt (str): 'npy' (memory-mappable columns), 'npz' (compressed) or 'csv'
+            output_dir (str): Directory the data is written to
+            webcam_screen (np.ndarray): Webcam gaze mapped onto the screen (see GazeMapping)
+            tobii_events (np.ndarray): Fixations, saccades and blinks detected online (see EventDetector)
+            markers (np.ndarray): Markers published to both trackers (see MarkerBus)
+            webcam_smoothed (np.ndarray): Smoothed webcam iris positions (see Filters)
         """
     
         timestamp_now = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
 
-        # Save stimulus data
-        with open(f'stimulus_data_{timestamp_now}.csv', 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(['Timestamp', 'Stimulus Position (px)', 'Stimulus Offset (cm)'])
-            for i in range(len(stimulus_data['timestamps'])):
-                writer.writerow([
-                    stimulus_data['timestamps'][i],
-                    stimulus_data['stimulus_positions'][i],
-                    stimulus_data['stimulus_offsets_cm'][i]
-                ])
-
-        with open(f'tobii_data_{timestamp_now}.csv', 'w', newline='') as f:
-            writer = csv.writer(f)
-            if tobii_data:
-                writer.writerow(['System Timestamp']+list(tobii_data[0].keys()))
-                for data_point in tobii_data:
-                    row = [data_point.get('system_timestamp', '')] + [data_point.get(key, '') for key in tobii_data[0].keys()]
-                    writer.writerow(row)
-
-
-        with open(f'webcam_gaze_data_{timestamp_now}.csv', 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(['Timestamp', 'Right Eye X', 'Right Eye Y', 'Left Eye X', 'Left Eye Y', 'Markers'])
-            for i in range(len(webcam_data['timestamps'])):
-                writer.writerow([
-                    webcam_data['timestamps'][i],
-                    webcam_data['right_eye_x'][i],
-                    webcam_data['right_eye_y'][i],
-                    webcam_data['left_eye_x'][i],
-                    webcam_data['left_eye_y'][i],
-                    webcam_data['markers'][i]
-                ])
-
-        print(f"[Experiment] Data saved with timestamp: {timestamp_now}")
+        streams = {
+            'stimulus': stimulus_array(stimulus_data),
+            'tobii': tobii_data,
+            'webcam': webcam_data,
+        }
+        if tobii_markers is not None:
+            streams['tobii_markers'] = tobii_markers
+        if webcam_markers is not None:
+            streams['webcam_markers'] = webcam_markers
+        if webcam_screen is not None:
+            streams['webcam_screen'] = webcam_screen
+        if tobii_events is not None:
+            streams['tobii_events'] = tobii_events
+        if markers is not None:
+            streams['markers'] = markers
+        if webcam_smoothed is not None:
+            streams['webcam_smoothed'] = webcam_smoothed
+
+        path = export_session(output_dir, timestamp_now, streams, metadata, fmt=fmt)
+        print(f"[Experiment] Data saved with timestamp: {timestamp_now} ({path})")
+        return path
+
+def _timed(function, *args):
+    # Returns the result of the call and the time it finished
+    result = function(*args)
+    return result, now()
 
 def main():
     screen_width = 1920
@@ -65,35 +78,108 @@ def main():
     wait_time = 5
     num_sequence = 3
     cm_to_pixel = screen_width / screen_width_cm
+    calibration_points = [(0.5, 0.5), (0.1, 0.1), (0.1, 0.9), (0.9, 0.1), (0.9, 0.9)]
 
     tobii_tracker = None
     webcam = None
-    webcam_thread = None
+    session_writer = None
 
     try:
-        # Initialize Tobii
-        tobii_tracker = Tobii()
-        #Initialize Webcam
-        webcam = Webcam(show_preview=False)  # Set to False to reduce window conflicts
-
-        # Prepare for data collection
-        input("[Experiment] Press Enter to start the experiment...")
-        
-        #Start recording - use threading for webcam to avoid blocking
+        # Tobii discovery and the webcam start-up (process spawn, camera open and
+        # FaceMesh warm-up, see WebcamProcess.open) run in the background while
+        # the operator reads the instructions
+        launch = now()
+        webcam = WebcamProcess(show_preview=False, smoothing=OneEuroFilter())  # Set to False to reduce window conflicts
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            tobii_future = pool.submit(_timed, Tobii)
+            webcam_future = pool.submit(_timed, webcam.open)
+
+            #initialize Stimulus (pre-renders its frames in the meantime)
+            stimulus = Stimulus(screen_width, screen_height, screen_width_cm, screen_height_cm, cm_to_pixel)
+            stimulus_ready = now()
+
+            # Prepare for data collection
+            participant_id = input("[Experiment] Participant id (empty to skip the calibration), then Enter to start...").strip()
+            entered = now()
+            tobii_tracker, tobii_ready = tobii_future.result()
+            webcam_opened, webcam_ready = webcam_future.result()
+        if not webcam_opened:
+            raise RuntimeError("the webcam process did not start")
+
+        ready = max(tobii_ready, webcam_ready, stimulus_ready)
+        startup = {
+            'ready_s': ready - launch,
+            'tobii_s': tobii_ready - launch,
+            'webcam_s': webcam_ready - launch,
+            'webcam': webcam.startup,
+            'stimulus_s': stimulus_ready - launch,
+            'operator_s': entered - launch,
+        }
+        print(f"[Experiment] Devices ready in {startup['ready_s']:.2f}s (Tobii {startup['tobii_s']:.2f}s, "
+              f"webcam {startup['webcam_s']:.2f}s, stimulus {startup['stimulus_s']:.2f}s)"
+              + (f", {ready - entered:.2f}s after Enter." if ready > entered else "."))
+
+        # Stream everything to disk while recording, so a crash does not lose the session
+        session_writer = SessionWriter(f'session_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}')
+        tobii_tracker.attach_writer(session_writer)
+        session_writer.start()
+
+        #The webcam records from here on, so it is calibrated on the Tobii calibration points
+        webcam.start_recording()
+
+        # A returning participant's stored calibration is validated instead of recalibrating
+        webcam_model = None
+        tobii_calibrated = None
+        if participant_id:
+            store = CalibrationStore()
+            webcam_model_path = os.path.join(store.directory, f'webcam_{participant_id}.npz')
+            points = []
+            # A failed calibration is the operator's call: retry, or record with the tracker's current one
+            while True:
+                tobii_calibrated = tobii_tracker.ensure_calibration(store, participant_id, calibration_points,
+                                                                    screen_width, screen_height, point_radius,
+                                                                    wait_time, on_point=lambda *point: points.append(point))
+                if tobii_calibrated:
+                    break
+                answer = input("[Experiment] The Tobii calibration failed: r to retry, c to continue without it, "
+                               "q to quit...").strip().lower()
+                if answer == 'q':
+                    raise RuntimeError("the Tobii calibration failed")
+                if answer == 'c':
+                    print("[Experiment] Continuing with the tracker's current calibration.")
+                    break
+                points.clear()
+            try:
+                if points:
+                    webcam_model = fit_webcam(webcam, points, path=webcam_model_path)
+                elif os.path.exists(webcam_model_path):
+                    webcam_model = GazeModel.load(webcam_model_path)
+                else:
+                    webcam_model = calibrate_webcam(webcam, calibration_points, screen_width, screen_height,
+                                                    point_radius, wait_time, path=webcam_model_path)
+            except ValueError as e:
+                # A weak webcam calibration must not cost the Tobii session
+                print(f"[Experiment] Webcam calibration failed ({e}), recording without the webcam gaze model.")
+                webcam_model = None
+
+        # The calibration samples were only needed for the webcam model: the webcam
+        # stream, its markers and the quality report start with the session
+        webcam.clear()
+        webcam.attach_writer(session_writer)
+
+        # Fixations and saccades are classified live, e.g. for gaze-contingent stimuli
+        event_detector = EventDetector(frequency=tobii_tracker.my_eyetracker.get_gaze_output_frequency())
+        tobii_tracker.attach_detector(event_detector)
+
+        #Start recording
         tobii_tracker.start_recording()
-        webcam_thread = threading.Thread(target=webcam.start_recording_webcam)
-        webcam_thread.daemon = True  # This allows the thread to exit when the main program exits
-        webcam_thread.start()
-
-        # Add flags
-        tobii_tracker.add_marker('Start stimulus')
-        webcam.add_marker('Start stimulus')
 
-        # Give webcam time to initialize
-        time.sleep(2)  # Increased delay for better initialization
+        # Add flags (one timestamp for both trackers)
+        marker_bus = MarkerBus(tobii_tracker, webcam)
+        marker_bus.attach_writer(session_writer)
+        marker_bus.publish('Start stimulus')
 
-        #initialize Stimulus
-        stimulus = Stimulus(screen_width, screen_height, screen_width_cm, screen_height_cm, cm_to_pixel)
+        stimulus.attach_writer(session_writer)
         
         print("[Experiment] Starting stimulus presentation...")
         
@@ -109,21 +195,58 @@ def main():
         stimulus_data = stimulus.stimulus_loop(num_sequence)
 
         # Add marker for end of stimulus
-        tobii_tracker.add_marker('End stimulus')
-        webcam.add_marker('End stimulus')
+        marker_bus.publish('End stimulus')
 
         #Stop recording
         print("[Experiment] Stopping recordings...")
         tobii_tracker.stop_recording()
-        webcam.stop_recording()
-        if webcam_thread:
-            webcam_thread.join(timeout=3)  # Wait for webcam thread to finish, but not forever
+        webcam.stop_recording()  # Collects the last samples and joins the webcam process
+        marker_bus.flush()  # Markers the writer queue refused while recording
 
         # Retrieve data
         print("[Experiment] Retrieving data...")
         tobii_gaze_data = tobii_tracker.get_data()
         webcam_gaze_data = webcam.get_data()
-        save_data(stimulus_data, tobii_gaze_data, webcam_gaze_data)
+        metadata = {
+            'participant_id': participant_id,
+            'tobii_calibrated': tobii_calibrated,
+            'screen_width': screen_width,
+            'screen_height': screen_height,
+            'screen_width_cm': screen_width_cm,
+            'screen_height_cm': screen_height_cm,
+            'tobii_model': tobii_tracker.my_eyetracker.model,
+            'tobii_serial_number': tobii_tracker.my_eyetracker.serial_number,
+            'webcam_frame_width': webcam.frame_width,
+            'webcam_frame_height': webcam.frame_height,
+            'webcam_pipeline': webcam.pipeline_stats(),
+            'clock_sync': tobii_tracker.clock.status(),
+            'startup': startup,
+            'stimulus_timing': stimulus.timing_stats(),
+            'metrics': {
+                'tobii': tobii_tracker.metrics.snapshot(),
+                'webcam': webcam.metrics_snapshot(),
+            },
+        }
+        # Next to the streamed chunks too, so the timings survive a failed export
+        with open(os.path.join(session_writer.directory, 'metrics.json'), 'w') as f:
+            json.dump(metadata['metrics'], f, indent=2)
+        if webcam_model is not None:
+            metadata['webcam_gaze_model_error'] = webcam_model.training_error
+        webcam_screen = None if webcam_model is None else webcam_model.map(webcam_gaze_data, webcam.get_contours())
+        path = save_data(stimulus_data, tobii_gaze_data, webcam_gaze_data,
+                         tobii_tracker.get_markers(), webcam.get_markers(), metadata,
+                         webcam_screen=webcam_screen,
+                         tobii_events=event_detector.get_events(), markers=marker_bus.get_markers(),
+                         webcam_smoothed=webcam.get_smoothed_data())
+
+        # Is the data usable? Checked right away, while the participant is still there
+        quality = session_quality({'tobii': tobii_gaze_data, 'webcam': webcam_gaze_data,
+                                   'stimulus': stimulus_array(stimulus_data), 'webcam_screen': webcam_screen},
+                                  screen_width=screen_width,
+                                  display_size_mm=(screen_width_cm * 10, screen_height_cm * 10),
+                                  tobii_frequency=tobii_tracker.my_eyetracker.get_gaze_output_frequency())
+        print_report(quality)
+        write_report(path, quality)
         print("[Experiment] Experiment completed successfully!")
 
     except Exception as e:
@@ -143,6 +266,8 @@ def main():
                 webcam.stop_recording()
             except:
                 pass
+        if session_writer:
+            session_writer.close()
         # Force destroy all OpenCV windows
         cv2.destroyAllWindows()
 
@@ -0,0 +1,84 @@
+#Face region tracking for downscaled FaceMesh inference
+
+import cv2
+
+
+# Landmarks spanning the face: forehead, chin, right and left face edge
+FACE_EXTENT_LANDMARKS = (10, 152, 234, 454)
+
+
+class FaceRoi:
+
+    """
+    Crop the frame around the face found in the previous frame.
+
+    The box is derived from a few landmarks of the previous result, padded
+    and made square, and the crop is downscaled to at most target_width
+    pixels before inference. Without a previous face (start, or tracking
+    lost) the full frame is used so FaceMesh can detect the face again.
+
+    Args:
+    - padding (float): Margin added on each side, as a fraction of the face size
+    - target_width (int): Width the crop is downscaled to (0 keeps the crop size)
+    - min_size (int): Smallest box side in pixels
+    """
+
+    def __init__(self, padding=0.35, target_width=256, min_size=96):
+        self.padding = padding
+        self.target_width = target_width
+        self.min_size = min_size
+        self.box = None  # (x0, y0, x1, y1) in frame pixels
+        self.tracked_frames = 0
+        self.full_frames = 0
+        self.lost = 0
+
+    def crop(self, frame):
+        """
+        Returns the image to run inference on and its box (x0, y0, width, height) in the frame.
+        """
+        height, width = frame.shape[:2]
+        if self.box is None:
+            self.full_frames += 1
+            return frame, (0, 0, width, height)
+
+        self.tracked_frames += 1
+        x0, y0, x1, y1 = self.box
+        image = frame[y0:y1, x0:x1]
+        if self.target_width and x1 - x0 > self.target_width:
+            scale = self.target_width / (x1 - x0)
+            image = cv2.resize(image, (self.target_width, max(1, int(round((y1 - y0) * scale)))),
+                               interpolation=cv2.INTER_AREA)
+        return image, (x0, y0, x1 - x0, y1 - y0)
+
+    def update(self, landmark, box, frame_shape):
+        """
+        Set the box for the next frame from the landmarks found in this one.
+
+        Args:
+        - landmark: FaceMesh landmark list, normalized to the image given to FaceMesh
+        - box (tuple): (x0, y0, width, height) returned by crop() for this frame
+        - frame_shape (tuple): Shape of the full frame
+        """
+        bx, by, bw, bh = box
+        xs = [bx + landmark[i].x * bw for i in FACE_EXTENT_LANDMARKS]
+        ys = [by + landmark[i].y * bh for i in FACE_EXTENT_LANDMARKS]
+        cx = (min(xs) + max(xs)) / 2
+        cy = (min(ys) + max(ys)) / 2
+        size = max(max(xs) - min(xs), max(ys) - min(ys)) * (1 + 2 * self.padding)
+        size = max(size, self.min_size)
+
+        height, width = frame_shape[:2]
+        x0 = int(max(0, cx - size / 2))
+        y0 = int(max(0, cy - size / 2))
+        x1 = int(min(width, cx + size / 2))
+        y1 = int(min(height, cy + size / 2))
+        if x1 - x0 < 2 or y1 - y0 < 2:
+            self.reset()
+        else:
+            self.box = (x0, y0, x1, y1)
+
+    def reset(self):
+        """Tracking lost: detect on the full frame next time."""
+        if self.box is not None:
+            self.lost += 1
+        self.box = None
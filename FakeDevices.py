@@ -0,0 +1,352 @@
+#Simulated Tobii tracker and webcam for running and benchmarking without hardware
+
+import math
+import random
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from GazeBuffer import GazeBuffer
+from ClockSync import now
+
+
+# Timing of every delivered sample: how late the callback was called and how long it ran
+CALLBACK_DTYPE = np.dtype([
+    ('delay', 'f8'),
+    ('duration', 'f8'),
+])
+
+# Display area of a Tobii Pro Spectrum setup in user coordinates (mm)
+DISPLAY_WIDTH_MM = 527.0
+DISPLAY_HEIGHT_MM = 296.0
+EYE_DISTANCE_MM = 650.0
+NAN3 = (math.nan, math.nan, math.nan)
+
+
+class FakeCalibrationResult:
+
+    def __init__(self, status):
+        self.status = status
+        self.calibration_points = []
+
+
+class FakeDisplayArea:
+
+    def __init__(self, width=DISPLAY_WIDTH_MM, height=DISPLAY_HEIGHT_MM):
+        self.width = width
+        self.height = height
+
+
+class FakeScreenBasedCalibration:
+
+    """Stand-in of tr.ScreenBasedCalibration, every point succeeds."""
+
+    def __init__(self, eyetracker):
+        self.eyetracker = eyetracker
+        self.points = []
+
+    def enter_calibration_mode(self):
+        self.points = []
+
+    def leave_calibration_mode(self):
+        pass
+
+    def collect_data(self, x, y):
+        self.points.append((x, y))
+        return self.eyetracker.backend.CALIBRATION_STATUS_SUCCESS
+
+    def discard_data(self, x, y):
+        if (x, y) in self.points:
+            self.points.remove((x, y))
+
+    def compute_and_apply(self):
+        self.eyetracker.calibration_data = repr(self.points).encode()
+        return FakeCalibrationResult(self.eyetracker.backend.CALIBRATION_STATUS_SUCCESS)
+
+
+class FakeEyeTracker:
+
+    """
+    Stand-in of tr.EyeTracker that delivers simulated gaze at a fixed frequency.
+
+    The gaze alternates fixations and saccades over the display, with noise,
+    blinks (invalid samples) and a slowly varying pupil. Time stamps follow
+    the SDK: system_time_stamp in the SDK system clock and device_time_stamp
+    in a device clock with its own offset and drift, both in microseconds.
+    Samples are delivered on one thread like the SDK does; if the callback
+    falls behind, the overdue samples are delivered in a burst. The delay and
+    duration of every callback are recorded (see callback_stats()).
+
+    Args:
+    - backend (FakeTobiiResearch): Module stand-in the tracker belongs to
+    - frequency (float): Gaze output frequency in Hz (60 - 1200)
+    - drop_rate (float): Fraction of samples the simulated tracker loses
+    - blink_rate (float): Blinks per second
+    - seed (int): Seed of the simulation
+    """
+
+    def __init__(self, backend, frequency=600, drop_rate=0.0, blink_rate=0.3, seed=0):
+        self.backend = backend
+        self.address = 'tet-tcp://127.0.0.1'
+        self.model = 'Tobii Pro Spectrum (simulated)'
+        self.device_name = 'Simulated tracker'
+        self.serial_number = f'SIM-{seed:04d}'
+        self.frequency = frequency
+        self.drop_rate = drop_rate
+        self.blink_rate = blink_rate
+        self.calibration_data = b''
+        self.device_offset_us = 1_000_000_000
+        self.device_drift_ppm = 20.0
+        self.emitted = 0
+        self.timing = GazeBuffer(CALLBACK_DTYPE, capacity=65536, chunk_size=65536)
+        self._random = random.Random(seed)
+        self._subscriptions = {}
+        self._threads = {}
+        self._stop_events = {}
+
+    def get_all_gaze_output_frequencies(self):
+        return (60.0, 120.0, 300.0, 600.0, 1200.0)
+
+    def get_gaze_output_frequency(self):
+        return float(self.frequency)
+
+    def set_gaze_output_frequency(self, frequency):
+        self.frequency = frequency
+
+    def get_display_area(self):
+        return FakeDisplayArea()
+
+    def retrieve_calibration_data(self):
+        return self.calibration_data or None
+
+    def apply_calibration_data(self, calibration_data):
+        self.calibration_data = bytes(calibration_data)
+
+    def subscribe_to(self, subscription_type, callback, as_dictionary=False):
+        if subscription_type in self._threads:
+            self.unsubscribe_from(subscription_type)
+        if subscription_type == self.backend.EYETRACKER_GAZE_DATA:
+            target = self._gaze_loop
+        elif subscription_type == self.backend.EYETRACKER_TIME_SYNCHRONIZATION_DATA:
+            target = self._time_sync_loop
+        else:
+            raise ValueError(f"Unsupported subscription {subscription_type}")
+        self._subscriptions[subscription_type] = callback
+        self._stop_events[subscription_type] = stop = threading.Event()
+        self._threads[subscription_type] = thread = threading.Thread(
+            target=target, args=(callback, stop), name=f'FakeEyeTracker-{subscription_type}', daemon=True)
+        thread.start()
+
+    def unsubscribe_from(self, subscription_type, callback=None):
+        if subscription_type not in self._threads:
+            return
+        if callback is not None and callback != self._subscriptions[subscription_type]:
+            return  # the SDK only removes the subscription of that callback
+        self._stop_events.pop(subscription_type).set()
+        thread = self._threads.pop(subscription_type)
+        if thread is not threading.current_thread():
+            thread.join()
+        del self._subscriptions[subscription_type]
+
+    def device_time_stamp(self, system_time_stamp):
+        return int(system_time_stamp * (1 + self.device_drift_ppm * 1e-6)) + self.device_offset_us
+
+    def callback_stats(self):
+        """
+        Percentiles (microseconds) of the callback duration and of the delivery delay.
+        """
+        timing = self.timing.view()
+        if not len(timing):
+            return {}
+        stats = {'samples': len(timing)}
+        for name in ('duration', 'delay'):
+            values = timing[name] * 1e6
+            for q in (50, 95, 99):
+                stats[f'callback_{name}_p{q}_us'] = float(np.percentile(values, q))
+            stats[f'callback_{name}_max_us'] = float(values.max())
+        return stats
+
+    def _gaze_loop(self, callback, stop):
+        rnd = self._random
+        period = 1.0 / self.frequency
+        gaze = [0.5, 0.5]
+        target = [0.5, 0.5]
+        fixation_end = saccade_end = blink_end = 0.0
+        saccade_start = (0.5, 0.5)
+        pupil_phase = rnd.uniform(0, 2 * math.pi)
+        timing = self.timing
+        t = now()
+        next_sample = t
+
+        while not stop.is_set():
+            t = now()
+            if t < next_sample:
+                time.sleep(next_sample - t)
+                continue
+            # Deliver every sample that is due (a burst if we are late)
+            while next_sample <= t and not stop.is_set():
+                scheduled = next_sample
+                next_sample += period
+                self.emitted += 1
+
+                # Fixation -> saccade to a random point -> fixation ...
+                if scheduled >= saccade_end and scheduled >= fixation_end:
+                    saccade_start = tuple(gaze)
+                    target = [rnd.uniform(0.1, 0.9), rnd.uniform(0.1, 0.9)]
+                    saccade_end = scheduled + 0.03
+                    fixation_end = saccade_end + rnd.expovariate(1 / 0.25)
+                if scheduled < saccade_end:
+                    progress = 1 - (saccade_end - scheduled) / 0.03
+                    gaze = [s + (e - s) * progress for s, e in zip(saccade_start, target)]
+                else:
+                    gaze = list(target)
+                if scheduled >= blink_end and rnd.random() < self.blink_rate * period:
+                    blink_end = scheduled + rnd.uniform(0.1, 0.2)
+                if rnd.random() < self.drop_rate:
+                    continue
+
+                system_time_stamp = int((scheduled + self.backend.system_offset) * 1e6)
+                sample = {
+                    'device_time_stamp': self.device_time_stamp(system_time_stamp),
+                    'system_time_stamp': system_time_stamp,
+                }
+                valid = scheduled >= blink_end
+                pupil = 3.5 + 0.3 * math.sin(pupil_phase + scheduled * 0.5)
+                for eye, side in (('left', -1), ('right', 1)):
+                    if valid:
+                        x = gaze[0] + rnd.gauss(0, 0.003)
+                        y = gaze[1] + rnd.gauss(0, 0.003)
+                        point = (x, y)
+                        point_ucs = ((x - 0.5) * DISPLAY_WIDTH_MM, (0.5 - y) * DISPLAY_HEIGHT_MM + 150.0, 0.0)
+                        origin_ucs = (side * 32.0, 150.0, EYE_DISTANCE_MM)
+                        origin_tbcs = (0.5 - side * 0.05, 0.5, 0.5)
+                        diameter = pupil + rnd.gauss(0, 0.02)
+                    else:
+                        point, point_ucs, origin_ucs, origin_tbcs = (math.nan, math.nan), NAN3, NAN3, NAN3
+                        diameter = math.nan
+                    sample[eye + '_gaze_point_on_display_area'] = point
+                    sample[eye + '_gaze_point_in_user_coordinate_system'] = point_ucs
+                    sample[eye + '_gaze_point_validity'] = int(valid)
+                    sample[eye + '_pupil_diameter'] = diameter
+                    sample[eye + '_pupil_validity'] = int(valid)
+                    sample[eye + '_gaze_origin_in_user_coordinate_system'] = origin_ucs
+                    sample[eye + '_gaze_origin_in_trackbox_coordinate_system'] = origin_tbcs
+                    sample[eye + '_gaze_origin_validity'] = int(valid)
+
+                start = now()
+                callback(sample)
+                end = now()
+                timing.append((start - scheduled, end - start))
+
+    def _time_sync_loop(self, callback, stop):
+        rnd = self._random
+        while not stop.wait(0.5):
+            request = self.backend.get_system_time_stamp()
+            rtt = rnd.randint(100, 400)
+            callback({
+                'system_request_time_stamp': request,
+                'device_time_stamp': self.device_time_stamp(request + rtt // 2),
+                'system_response_time_stamp': request + rtt,
+            })
+
+
+class FakeTobiiResearch:
+
+    """
+    Stand-in of the tobii_research module, pass it as Tobii(backend=...).
+
+    Args:
+    - frequency (float): Gaze output frequency of the simulated tracker (Hz)
+    - trackers (int): Number of trackers find_all_eyetrackers() returns (0 simulates none connected)
+    - **tracker_args: Further arguments of FakeEyeTracker (drop_rate, blink_rate, seed)
+    """
+
+    EYETRACKER_GAZE_DATA = 'eyetracker_gaze_data'
+    EYETRACKER_TIME_SYNCHRONIZATION_DATA = 'eyetracker_time_synchronization_data'
+    CALIBRATION_STATUS_SUCCESS = 'calibration_status_success'
+    CALIBRATION_STATUS_FAILURE = 'calibration_status_failure'
+
+    def __init__(self, frequency=600, trackers=1, **tracker_args):
+        # The SDK system clock runs on its own epoch
+        self.system_offset = 50_000.0
+        self.ScreenBasedCalibration = FakeScreenBasedCalibration
+        self.eyetrackers = [FakeEyeTracker(self, frequency, seed=i, **tracker_args) for i in range(trackers)]
+
+    def find_all_eyetrackers(self):
+        return list(self.eyetrackers)
+
+    def get_system_time_stamp(self):
+        return int((now() + self.system_offset) * 1e6)
+
+
+class SyntheticCamera:
+
+    """
+    VideoCapture-like source drawing a schematic face with moving irises.
+
+    It exercises capture, queueing, preview and recording at a given frame
+    size and rate without a camera. Whether a landmark model finds the face
+    depends on the model; use a recorded clip (MultiCamera.VideoFileSource)
+    when detection quality matters.
+
+    Args:
+    - width, height (int): Frame size
+    - fps (float): Frame rate the frames are delivered at
+    - frames (int): Number of frames before the stream ends (None: endless)
+    """
+
+    def __init__(self, width=640, height=480, fps=30.0, frames=None):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.frames = frames
+        self.index = 0
+        self._next_frame = None
+        self._opened = True
+        self._background = np.full((height, width, 3), 90, dtype=np.uint8)
+        self._center = (width // 2, height // 2)
+        self._eye_dx = width // 10
+        self._eye_y = height // 2 - height // 12
+        cv2.ellipse(self._background, self._center, (width // 6, height // 3), 0, 0, 360, (150, 180, 220), -1)
+        for side in (-1, 1):
+            cv2.ellipse(self._background, (self._center[0] + side * self._eye_dx, self._eye_y),
+                        (width // 30, height // 60), 0, 0, 360, (255, 255, 255), -1)
+        cv2.ellipse(self._background, (self._center[0], self._center[1] + height // 6),
+                    (width // 20, height // 80), 0, 0, 360, (60, 60, 160), -1)
+
+    def isOpened(self):
+        return self._opened
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.height)
+        if prop == cv2.CAP_PROP_FPS:
+            return float(self.fps)
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(self.frames or 0)
+        return 0.0
+
+    def read(self):
+        if not self._opened or (self.frames is not None and self.index >= self.frames):
+            return False, None
+        t = now()
+        if self._next_frame is None:
+            self._next_frame = t
+        elif t < self._next_frame:
+            time.sleep(self._next_frame - t)
+        self._next_frame = max(self._next_frame + 1.0 / self.fps, now() - 1.0 / self.fps)
+
+        frame = self._background.copy()
+        dx = int(self.width / 60 * math.sin(self.index / self.fps * 2.0))
+        for side in (-1, 1):
+            cv2.circle(frame, (self._center[0] + side * self._eye_dx + dx, self._eye_y),
+                       self.height // 70, (40, 30, 20), -1)
+        self.index += 1
+        return True, frame
+
+    def release(self):
+        self._opened = False
@@ -0,0 +1,250 @@
+#Capture / inference pipeline for camera frames
+
+import collections
+import threading
+import time
+
+from ClockSync import now
+from Metrics import Metrics
+
+
+# What the capture thread does when the queue to the workers is full
+DROP_OLDEST = 'drop_oldest'   # discard the oldest queued frame
+KEEP_LATEST = 'keep_latest'   # discard every queued frame, only the newest is processed
+BLOCK = 'block'               # wait for a worker (the camera buffer absorbs the delay)
+POLICIES = (DROP_OLDEST, KEEP_LATEST, BLOCK)
+
+
+class FrameQueue:
+
+    """Bounded queue between the capture thread and the inference workers."""
+
+    def __init__(self, maxsize, policy=DROP_OLDEST):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown frame-drop policy '{policy}', expected one of {POLICIES}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self._items = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def put(self, item):
+        """
+        Queue one item according to the policy.
+
+        Returns:
+        - list of the items that were dropped to make room
+        """
+        dropped = []
+        with self._cond:
+            if self._closed:
+                return [item]
+            if self.policy == KEEP_LATEST:
+                dropped.extend(self._items)
+                self._items.clear()
+            elif self.policy == DROP_OLDEST:
+                while len(self._items) >= self.maxsize:
+                    dropped.append(self._items.popleft())
+            else:
+                while len(self._items) >= self.maxsize and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return [item]
+            self._items.append(item)
+            self._cond.notify_all()
+        return dropped
+
+    def get(self, timeout=None):
+        """Returns the next item, or None if the queue is closed or the timeout expires."""
+        with self._cond:
+            if not self._items and not self._closed:
+                self._cond.wait(timeout)
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def close(self):
+        """Wakes up every waiting thread; the remaining items are returned and not processed."""
+        with self._cond:
+            self._closed = True
+            remaining = list(self._items)
+            self._items.clear()
+            self._cond.notify_all()
+        return remaining
+
+
+class FramePipeline:
+
+    """
+    Grab frames on a dedicated thread and run inference on a pool of workers.
+
+    The capture thread timestamps every frame right after it is grabbed and
+    hands it to the workers through a FrameQueue. Each worker gets its own
+    processing function from worker_factory (e.g. its own FaceMesh instance).
+    Results are passed to on_result in capture order, one call at a time.
+
+    Args:
+    - source: Object with the cv2.VideoCapture read() interface. If it also has
+      grab_timestamp(), that gives the timestamp of the frame just read instead
+      of now() (replayed recordings keep their original timing, see Replay)
+    - worker_factory (callable): Called once per worker thread, returns process(frame, frame_index) -> result
+    - on_result (callable): on_result(frame_index, timestamp, result)
+    - num_workers (int): Number of inference threads
+    - queue_size (int): Capacity of the queue between capture and inference
+    - policy (str): One of DROP_OLDEST, KEEP_LATEST, BLOCK
+    - max_read_failures (int): Stop after this many consecutive failed reads (None retries forever)
+    - on_capture (callable): on_capture(frame_index, timestamp, frame), called on the capture thread
+      for every grabbed frame, e.g. to record the raw video
+    - metrics (Metrics): Receives the 'read', 'queue_wait' and 'process' stage times
+    """
+
+    def __init__(self, source, worker_factory, on_result, num_workers=1, queue_size=4,
+                 policy=DROP_OLDEST, max_read_failures=None, on_capture=None, metrics=None):
+        self.source = source
+        self._grab_timestamp = getattr(source, 'grab_timestamp', None)
+        self.worker_factory = worker_factory
+        self.on_result = on_result
+        self.num_workers = num_workers
+        self.max_read_failures = max_read_failures
+        self.on_capture = on_capture
+        self.queue = FrameQueue(queue_size, policy)
+        self.metrics = metrics if metrics is not None else Metrics()
+
+        self.captured = 0
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.read_failures = 0
+
+        self._running = False
+        self._threads = []
+        self._start_time = None
+        self._stop_time = None
+        self._result_lock = threading.Lock()
+        self._done = {}
+        self._next_index = 0
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self):
+        """Starts the capture thread and the inference workers."""
+        self._running = True
+        self._start_time = time.time()
+        self._threads = [threading.Thread(target=self._capture_loop, name='FrameCapture', daemon=True)]
+        for i in range(self.num_workers):
+            self._threads.append(threading.Thread(target=self._worker_loop, name=f'FrameWorker-{i}', daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=None):
+        """Stops capturing, discards the frames still queued and waits for the threads."""
+        self._running = False
+        for index, _, _ in self.queue.close():
+            self.dropped += 1
+            self._complete(index, None)
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+        self._threads = []
+        if self._stop_time is None:
+            self._stop_time = time.time()
+
+    def stats(self):
+        """Returns the frame counters and the achieved capture / processing rates."""
+        end = self._stop_time or time.time()
+        elapsed = max(end - (self._start_time or end), 1e-9)
+        return {
+            'captured': self.captured,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'read_failures': self.read_failures,
+            'capture_fps': self.captured / elapsed,
+            'processed_fps': self.processed / elapsed,
+        }
+
+    def _capture_loop(self):
+        read_time = self.metrics.stage('read').record
+        consecutive_failures = 0
+        while self._running:
+            start = now()
+            ret, frame = self.source.read()
+            timestamp = now()  # grab time, before any processing
+            read_time(timestamp - start)
+            if self._grab_timestamp is not None:
+                timestamp = self._grab_timestamp()
+            if not ret:
+                self.read_failures += 1
+                consecutive_failures += 1
+                if self.max_read_failures is not None and consecutive_failures >= self.max_read_failures:
+                    print("[FramePipeline] No more frames from the source, stopping capture.")
+                    break
+                time.sleep(0.01)
+                continue
+            consecutive_failures = 0
+
+            index = self.captured
+            self.captured += 1
+            if self.on_capture is not None:
+                self.on_capture(index, timestamp, frame)
+            for dropped_index, _, _ in self.queue.put((index, timestamp, frame)):
+                self.dropped += 1
+                self._complete(dropped_index, None)
+        self._stop_time = time.time()
+        # Let the workers finish what is queued, then wake them up. running stays
+        # True until then, so a caller waiting for the end of the source does not
+        # stop() the pipeline and discard the last frames
+        while len(self.queue) and self._threads_alive():
+            time.sleep(0.005)
+        self.queue.close()
+        self._running = False
+
+    def _threads_alive(self):
+        return any(thread.is_alive() for thread in self._threads[1:])
+
+    def _worker_loop(self):
+        process = self.worker_factory()
+        queue_wait_time = self.metrics.stage('queue_wait').record
+        process_time = self.metrics.stage('process').record
+        while True:
+            item = self.queue.get(timeout=0.1)
+            if item is None:
+                if self.queue.closed:
+                    break
+                continue
+            index, timestamp, frame = item
+            start = now()
+            queue_wait_time(start - timestamp)
+            try:
+                result = process(frame, index)
+                process_time(now() - start)
+            except Exception as e:
+                print(f"[FramePipeline] Error processing frame {index}: {e}")
+                self._complete(index, None, failed=True)
+                continue
+            self._complete(index, (timestamp, result))
+
+    def _complete(self, index, item, failed=False):
+        # Release results in capture order, skipping dropped frames
+        with self._result_lock:
+            if item is not None:
+                self.processed += 1
+            if failed:
+                self.failed += 1
+            self._done[index] = item
+            while self._next_index in self._done:
+                done = self._done.pop(self._next_index)
+                if done is not None:
+                    self.on_result(self._next_index, done[0], done[1])
+                self._next_index += 1
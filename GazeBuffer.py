@@ -0,0 +1,208 @@
+#Columnar storage for eye tracking samples
+
+import numpy as np
+
+
+# Every system_timestamp column is in the common timebase of ClockSync.now().
+
+# One row per Tobii sample, with the tuples of the SDK dictionary
+# unpacked into flat, fixed-dtype columns (x/y/z per eye).
+TOBII_DTYPE = np.dtype([
+    ('system_timestamp', 'f8'),
+    ('device_time_stamp', 'i8'),
+    ('system_time_stamp', 'i8'),
+    ('left_gaze_x', 'f4'),
+    ('left_gaze_y', 'f4'),
+    ('left_gaze_ucs_x', 'f4'),
+    ('left_gaze_ucs_y', 'f4'),
+    ('left_gaze_ucs_z', 'f4'),
+    ('left_gaze_validity', 'i1'),
+    ('left_pupil_diameter', 'f4'),
+    ('left_pupil_validity', 'i1'),
+    ('left_origin_ucs_x', 'f4'),
+    ('left_origin_ucs_y', 'f4'),
+    ('left_origin_ucs_z', 'f4'),
+    ('left_origin_tbcs_x', 'f4'),
+    ('left_origin_tbcs_y', 'f4'),
+    ('left_origin_tbcs_z', 'f4'),
+    ('left_origin_validity', 'i1'),
+    ('right_gaze_x', 'f4'),
+    ('right_gaze_y', 'f4'),
+    ('right_gaze_ucs_x', 'f4'),
+    ('right_gaze_ucs_y', 'f4'),
+    ('right_gaze_ucs_z', 'f4'),
+    ('right_gaze_validity', 'i1'),
+    ('right_pupil_diameter', 'f4'),
+    ('right_pupil_validity', 'i1'),
+    ('right_origin_ucs_x', 'f4'),
+    ('right_origin_ucs_y', 'f4'),
+    ('right_origin_ucs_z', 'f4'),
+    ('right_origin_tbcs_x', 'f4'),
+    ('right_origin_tbcs_y', 'f4'),
+    ('right_origin_tbcs_z', 'f4'),
+    ('right_origin_validity', 'i1'),
+])
+
+# Markers live in their own table; sample_index is the number of samples
+# recorded when the marker was added, so it points at the next sample.
+MARKER_DTYPE = np.dtype([
+    ('system_timestamp', 'f8'),
+    ('sample_index', 'i8'),
+    ('marker', 'U64'),
+])
+
+# Markers of the shared MarkerBus, one row per published marker (the same
+# timestamp is in the marker table of every recorder)
+BUS_MARKER_DTYPE = np.dtype([
+    ('system_timestamp', 'f8'),
+    ('marker', 'U64'),
+])
+
+# Iris positions (landmarks 473/468) in frame pixels and the landmark backend that found them
+WEBCAM_DTYPE = np.dtype([
+    ('system_timestamp', 'f8'),
+    ('right_eye_x', 'f4'),
+    ('right_eye_y', 'f4'),
+    ('left_eye_x', 'f4'),
+    ('left_eye_y', 'f4'),
+    ('backend', 'u1'),
+])
+
+# Landmark backend that produced a webcam sample, 'backend' is the index (see LandmarkBackends)
+WEBCAM_BACKENDS = ('face_mesh', 'cascade')
+
+# Iris positions of several cameras merged in time order (see MultiCamera)
+MULTI_WEBCAM_DTYPE = np.dtype(WEBCAM_DTYPE.descr + [('camera_id', 'i2')])
+
+# Optional eye contours (16 points per eye, same order as the MediaPipe eye connections)
+CONTOUR_DTYPE = np.dtype([
+    ('system_timestamp', 'f8'),
+    ('right_eye', 'f4', (16, 2)),
+    ('left_eye', 'f4', (16, 2)),
+])
+
+# Webcam gaze mapped onto the screen, normalized display coordinates like
+# Tobii's gaze point (see GazeMapping)
+SCREEN_GAZE_DTYPE = np.dtype([
+    ('system_timestamp', 'f8'),
+    ('gaze_x', 'f4'),
+    ('gaze_y', 'f4'),
+])
+
+# Eye movement events (see EventDetector); x, y is the mean fixation position or
+# the landing point of a saccade, in normalized display coordinates
+EVENT_DTYPE = np.dtype([
+    ('event', 'U16'),
+    ('onset', 'f8'),
+    ('offset', 'f8'),
+    ('x', 'f4'),
+    ('y', 'f4'),
+])
+
+# One row per stimulus onset
+STIMULUS_DTYPE = np.dtype([
+    ('system_timestamp', 'f8'),
+    ('stimulus_position', 'i4'),
+    ('stimulus_offset_cm', 'f4'),
+])
+
+
+def _eye_values(gaze_data, eye):
+    gaze = gaze_data[eye + '_gaze_point_on_display_area']
+    gaze_ucs = gaze_data[eye + '_gaze_point_in_user_coordinate_system']
+    origin_ucs = gaze_data[eye + '_gaze_origin_in_user_coordinate_system']
+    origin_tbcs = gaze_data[eye + '_gaze_origin_in_trackbox_coordinate_system']
+    return (gaze[0], gaze[1],
+            gaze_ucs[0], gaze_ucs[1], gaze_ucs[2],
+            gaze_data[eye + '_gaze_point_validity'],
+            gaze_data[eye + '_pupil_diameter'],
+            gaze_data[eye + '_pupil_validity'],
+            origin_ucs[0], origin_ucs[1], origin_ucs[2],
+            origin_tbcs[0], origin_tbcs[1], origin_tbcs[2],
+            gaze_data[eye + '_gaze_origin_validity'])
+
+
+def tobii_record(gaze_data, system_timestamp):
+    """
+    Flatten one Tobii gaze dictionary into a TOBII_DTYPE row.
+
+    Args:
+    - gaze_data (dict): Sample as delivered by the SDK with as_dictionary=True
+    - system_timestamp (float): Timestamp to store in the first column
+
+    Returns:
+    - tuple matching the fields of TOBII_DTYPE
+    """
+    return ((system_timestamp,
+             gaze_data['device_time_stamp'],
+             gaze_data['system_time_stamp'])
+            + _eye_values(gaze_data, 'left')
+            + _eye_values(gaze_data, 'right'))
+
+
+class GazeBuffer:
+
+    """
+    Growable columnar buffer backed by a single NumPy structured array.
+
+    Rows are written in place into preallocated storage, so appending a sample
+    does not create any Python objects that outlive the call. When the storage
+    is full it grows geometrically (at least by chunk_size rows).
+    A single thread is expected to append; any thread may read.
+    """
+
+    def __init__(self, dtype=TOBII_DTYPE, capacity=65536, chunk_size=65536):
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size
+        self._data = np.empty(capacity, dtype=self.dtype)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def capacity(self):
+        return len(self._data)
+
+    def append(self, record):
+        """
+        Append one row.
+
+        Args:
+        - record (tuple): Values in the order of the buffer's dtype fields
+        """
+        if self._size == len(self._data):
+            self._grow(self._size + 1)
+        self._data[self._size] = record
+        # Publish the row only after it is fully written
+        self._size += 1
+
+    def extend(self, records):
+        """
+        Append several rows at once.
+
+        Args:
+        - records (np.ndarray): Structured array with the buffer's dtype
+        """
+        n = len(records)
+        if self._size + n > len(self._data):
+            self._grow(self._size + n)
+        self._data[self._size:self._size + n] = records
+        self._size += n
+
+    def _grow(self, needed):
+        new_capacity = max(needed, len(self._data) * 2, len(self._data) + self.chunk_size)
+        new_data = np.empty(new_capacity, dtype=self.dtype)
+        new_data[:self._size] = self._data[:self._size]
+        # Views handed out earlier keep referencing the old array, which
+        # stays valid because it is never written again.
+        self._data = new_data
+
+    def view(self):
+        """Returns a zero-copy view of the recorded rows."""
+        return self._data[:self._size]
+
+    def clear(self):
+        """Start over with fresh storage (views handed out earlier stay intact)."""
+        self._data = np.empty(len(self._data), dtype=self.dtype)
+        self._size = 0
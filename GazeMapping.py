@@ -0,0 +1,312 @@
+#Mapping of the webcam iris positions onto the screen
+
+import os
+from itertools import combinations_with_replacement
+
+import cv2
+import numpy as np
+
+from GazeBuffer import SCREEN_GAZE_DTYPE
+from ClockSync import now
+
+
+# Indices of the eye corners in the 16 contour points of CONTOUR_DTYPE
+# (RIGHT_EYE_CONTOUR starts at 33 / 133 is index 8, LEFT_EYE_CONTOUR at 263 / 362 is index 8)
+OUTER_CORNER = 0
+INNER_CORNER = 8
+
+# Fewer distinct calibration targets than this are fitted with a linear model (see default_degree)
+MIN_QUADRATIC_TARGETS = 10
+
+
+def eye_features(data, contours=None):
+    """
+    Features of the gaze model, one row per webcam sample.
+
+    Without contours the features are the iris positions in frame pixels.
+    With contours every iris is expressed relative to its eye corners (the
+    corner midpoint and the eye width), which removes most of the head
+    translation, and the head position and scale (mean corner midpoint and
+    eye width) are added so the model can correct for the rest.
+
+    Args:
+    - data (np.ndarray): Webcam samples (WEBCAM_DTYPE), a single row works too
+    - contours (np.ndarray): Matching eye contours (CONTOUR_DTYPE), None to use the irises only
+
+    Returns:
+    - np.ndarray: (n, 4) or (n, 7) float64 features, NaN where an eye is missing
+    """
+    right = np.column_stack([data['right_eye_x'], data['right_eye_y']]).astype(np.float64)
+    left = np.column_stack([data['left_eye_x'], data['left_eye_y']]).astype(np.float64)
+    if contours is None:
+        return np.hstack([right, left])
+
+    features = []
+    centers = []
+    widths = []
+    for iris, contour in ((right, contours['right_eye']), (left, contours['left_eye'])):
+        outer = contour[:, OUTER_CORNER].astype(np.float64)
+        inner = contour[:, INNER_CORNER].astype(np.float64)
+        center = (outer + inner) / 2
+        width = np.hypot(*(inner - outer).T)
+        features.append((iris - center) / width[:, None])
+        centers.append(center)
+        widths.append(width)
+    head = np.column_stack([(centers[0] + centers[1]) / 2, (widths[0] + widths[1]) / 2])
+    return np.hstack(features + [head])
+
+
+def match_contours(data, contours):
+    """
+    Rows of the samples and of the eye contours recorded on the same frames.
+
+    The two tables of a WebcamProcess are drained from separate rings, so
+    they are joined on system_timestamp rather than by row.
+
+    Returns:
+    - (data, contours) with one row per frame found in both
+    """
+    _, rows, contour_rows = np.intersect1d(data['system_timestamp'], contours['system_timestamp'],
+                                           return_indices=True)
+    return data[rows], contours[contour_rows]
+
+
+class GazeModel:
+
+    """
+    Regularized polynomial regression from eye features to normalized screen coordinates.
+
+    Features are standardized and expanded to all monomials up to degree;
+    the two screen coordinates are fitted together by ridge regression (the
+    intercept is not penalized). Prediction is one gather and one matrix
+    product, so a whole recording is mapped in one call and a single frame
+    takes about 20 us.
+
+    Args:
+    - degree (int): Degree of the polynomial
+    - alpha (float): Ridge penalty
+    """
+
+    def __init__(self, degree=2, alpha=1e-3):
+        self.degree = degree
+        self.alpha = alpha
+        self.mean = None
+        self.scale = None
+        self.coef = None
+        self.terms = None
+        self.training_error = None
+
+    def _expand(self, features):
+        # Every monomial is a product of degree columns of [z, 1]; one gather, one product
+        z = (features - self.mean) / self.scale
+        z = np.hstack([z, np.ones((len(z), 1))])
+        return z[:, self.terms].prod(axis=2)
+
+    def fit(self, features, targets):
+        """
+        Fit the model.
+
+        Args:
+        - features (np.ndarray): (n, k) features from eye_features(), rows with NaN are skipped
+        - targets (np.ndarray): (n, 2) normalized screen coordinates the participant looked at
+
+        Returns:
+        - self
+        """
+        features = np.asarray(features, dtype=np.float64)
+        targets = np.asarray(targets, dtype=np.float64)
+        valid = np.isfinite(features).all(axis=1) & np.isfinite(targets).all(axis=1)
+        features, targets = features[valid], targets[valid]
+        if not len(features):
+            raise ValueError("no valid samples to fit the gaze model")
+
+        self.mean = features.mean(axis=0)
+        self.scale = features.std(axis=0)
+        self.scale[self.scale == 0] = 1.0
+        # Monomials as rows of column indices, padded with the constant column (index k);
+        # the first row (all constant) is the intercept
+        k = features.shape[1]
+        self.terms = np.array([(k,) * (self.degree - len(term)) + term for d in range(self.degree + 1)
+                               for term in combinations_with_replacement(range(k), d)], dtype=np.intp)
+        design = self._expand(features)
+        penalty = self.alpha * len(design) * np.eye(design.shape[1])
+        penalty[0, 0] = 0.0
+        self.coef = np.linalg.solve(design.T @ design + penalty, design.T @ targets)
+        self.training_error = float(np.mean(np.hypot(*(design @ self.coef - targets).T)))
+        return self
+
+    def predict(self, features):
+        """
+        Map features to normalized screen coordinates.
+
+        Args:
+        - features (np.ndarray): (n, k) or (k,) features from eye_features()
+
+        Returns:
+        - np.ndarray: (n, 2) or (2,) screen coordinates, NaN where a feature is missing
+        """
+        features = np.asarray(features, dtype=np.float64)
+        single = features.ndim == 1
+        gaze = self._expand(np.atleast_2d(features)) @ self.coef
+        return gaze[0] if single else gaze
+
+    def map(self, data, contours=None):
+        """
+        Map a whole recording (or the latest rows of one) onto the screen.
+
+        With contours, samples without the contours of their frame are left out.
+
+        Returns:
+        - np.ndarray with SCREEN_GAZE_DTYPE
+        """
+        if contours is not None:
+            data, contours = match_contours(data, contours)
+        gaze = self.predict(eye_features(data, contours))
+        mapped = np.empty(len(data), dtype=SCREEN_GAZE_DTYPE)
+        mapped['system_timestamp'] = data['system_timestamp']
+        mapped['gaze_x'] = gaze[:, 0]
+        mapped['gaze_y'] = gaze[:, 1]
+        return mapped
+
+    def save(self, path):
+        """Cache the fitted model in a .npz file."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        np.savez(path, degree=self.degree, alpha=self.alpha, mean=self.mean, scale=self.scale,
+                 coef=self.coef, terms=self.terms, training_error=self.training_error)
+
+    @classmethod
+    def load(cls, path):
+        """Load a model saved with save()."""
+        with np.load(path) as f:
+            model = cls(int(f['degree']), float(f['alpha']))
+            model.mean = f['mean']
+            model.scale = f['scale']
+            model.coef = f['coef']
+            model.terms = f['terms'].astype(np.intp)
+            model.training_error = float(f['training_error'])
+        return model
+
+
+def calibration_samples(data, points, contours=None, settle_time=0.5):
+    """
+    Training set of the gaze model from the calibration point windows.
+
+    Args:
+    - data (np.ndarray): Webcam samples recorded during the calibration (WEBCAM_DTYPE)
+    - points (list): (x, y, shown, collected) of every point, as passed to
+      the on_point callback of Tobii.calibrate
+    - contours (np.ndarray): Matching eye contours, None to use the irises only
+    - settle_time (float): Seconds after a point appeared that are not used (saccade to the point)
+
+    Returns:
+    - (features, targets) arrays for GazeModel.fit
+    """
+    features = eye_features(data, contours)
+    t = data['system_timestamp']
+    rows = []
+    targets = []
+    for x, y, shown, collected in points:
+        index = np.flatnonzero((t >= shown + settle_time) & (t <= collected))
+        rows.append(index)
+        targets.append(np.tile((x, y), (len(index), 1)))
+    rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.intp)
+    targets = np.vstack(targets) if targets else np.empty((0, 2))
+    return features[rows], targets
+
+
+def default_degree(points):
+    """
+    Polynomial degree the calibration points support: a quadratic model has 15
+    coefficients per axis with both irises, which a few targets do not constrain.
+
+    Args:
+    - points (list): (x, y, ...) of every calibration point
+
+    Returns:
+    - int: 2 with at least MIN_QUADRATIC_TARGETS distinct targets, otherwise 1
+    """
+    return 2 if len({(x, y) for x, y, *_ in points}) >= MIN_QUADRATIC_TARGETS else 1
+
+
+def calibrate_webcam(webcam, calibration_points, screen_width, screen_height, point_radius, wait_time,
+                     settle_time=0.5, degree=None, alpha=1e-3, path=None):
+    """
+    Calibrate the webcam on its own with the point sequence of Tobii.calibrate.
+
+    The webcam (Webcam or WebcamProcess) must be recording. To calibrate both
+    trackers at once, pass a list's append as on_point to Tobii.calibrate and
+    fit on calibration_samples() instead.
+
+    Args:
+    - webcam: Recording Webcam or WebcamProcess
+    - calibration_points, screen_width, screen_height, point_radius, wait_time: As for Tobii.calibrate
+    - settle_time (float): Seconds after a point appeared that are not used
+    - degree, alpha: Parameters of GazeModel, degree defaults to default_degree(calibration_points)
+    - path (str): Cache the fitted model in this file
+
+    Returns:
+    - GazeModel
+    """
+    window_name = "Webcam calibration"
+    cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
+    cv2.resizeWindow(window_name, screen_width, screen_height)
+    points = []
+    try:
+        for i, (x, y) in enumerate(calibration_points, start=1):
+            background = np.full((screen_height, screen_width, 3), 255, dtype=np.uint8)
+            cv2.circle(background, (int(x * screen_width), int(y * screen_height)), point_radius, (0, 0, 255), -1)
+            cv2.putText(background, f"Point {i}/{len(calibration_points)}", (50, 50),
+                        cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 0), 2)
+            cv2.imshow(window_name, background)
+            cv2.waitKey(1)
+            shown = now()
+            while now() - shown < wait_time:
+                cv2.waitKey(1)
+            points.append((x, y, shown, now()))
+    finally:
+        cv2.destroyWindow(window_name)
+
+    return fit_webcam(webcam, points, settle_time, degree, alpha, path)
+
+
+def fit_webcam(webcam, points, settle_time=0.5, degree=None, alpha=1e-3, path=None):
+    """
+    Fit the gaze model on the samples a webcam recorded during calibration points.
+
+    Args:
+    - webcam: Webcam or WebcamProcess that recorded the points
+    - points (list): (x, y, shown, collected) of every point (see Tobii.calibrate on_point)
+    - degree (int): Degree of the GazeModel, default_degree(points) by default
+
+    Returns:
+    - GazeModel
+
+    Raises:
+    - ValueError: if the webcam recorded no usable sample during the points
+    """
+    if points:
+        # The samples of the last point may still be in the pipeline or the webcam process's ring
+        webcam.wait_for_samples(points[-1][3])
+    data = webcam.get_data()
+    contours = webcam.get_contours()
+    if contours is not None:
+        data, contours = match_contours(data, contours)
+    features, targets = calibration_samples(data, points, contours, settle_time)
+    model = GazeModel(default_degree(points) if degree is None else degree, alpha).fit(features, targets)
+    print(f"[Webcam] Gaze model fitted on {len(features)} samples, training error "
+          f"{model.training_error:.3f} (screen fraction).")
+    if path is not None:
+        model.save(path)
+    return model
+
+
+if __name__ == "__main__":
+
+    # Synthetic check: a quadratic screen mapping is recovered from noisy iris positions
+    rng = np.random.default_rng(0)
+    screen = rng.uniform(0.1, 0.9, (500, 2))
+    iris = np.column_stack([300 + 40 * screen[:, 0] + 5 * screen[:, 0] ** 2, 200 + 25 * screen[:, 1],
+                            360 + 40 * screen[:, 0], 200 + 25 * screen[:, 1] + 3 * screen[:, 0] * screen[:, 1]])
+    iris += rng.normal(0, 0.2, iris.shape)
+    model = GazeModel().fit(iris, screen)
+    print(f"[Webcam] Training error {model.training_error:.4f}")
@@ -0,0 +1,340 @@
+#Landmark step of the webcam pipeline: FaceMesh, a low-power cascade eye detector and adaptive switching
+
+import math
+import os
+
+import cv2
+import numpy as np
+
+from GazeBuffer import WEBCAM_BACKENDS
+from ClockSync import now
+from Metrics import Metrics
+
+
+# Values of the Webcam backend argument
+BACKENDS = ('face_mesh', 'cascade', 'adaptive')
+
+
+class LandmarkBackend:
+
+    """
+    Finds the eyes in one frame.
+
+    process(image) runs on a BGR image and, when a face is found, fills
+    self.points with the landmarks normalized to the image (x / width,
+    y / height), in the order of the Webcam's landmark indices: right iris,
+    left iris, then the eye contours. Landmarks a backend does not estimate
+    are NaN. It returns the backend that produced the points (the one whose
+    name tags the sample), or None without a face.
+
+    Args:
+    - num_points (int): Number of landmarks of a sample
+    """
+
+    name = None
+
+    def __init__(self, num_points):
+        self.points = np.full((num_points, 2), np.nan, dtype=np.float32)
+        # FaceMesh landmark list of the last face, for FaceRoi; None for the other backends
+        self.landmarks = None
+
+    @property
+    def code(self):
+        """Value of the 'backend' column of the samples (see GazeBuffer.WEBCAM_BACKENDS)."""
+        return WEBCAM_BACKENDS.index(self.name)
+
+    def process(self, image):
+        raise NotImplementedError
+
+    def skip(self):
+        """True if the next frame should be dropped to stay within the CPU budget."""
+        return False
+
+    def draw(self, frame):
+        """Draw the last result on the frame it was found in."""
+
+    def reset(self):
+        """Forget the state of the previous frames (new recording)."""
+
+
+class FaceMeshBackend(LandmarkBackend):
+
+    """
+    MediaPipe FaceMesh with refined irises: all landmarks, the most accurate
+    and by far the most expensive backend.
+
+    Args:
+    - face_mesh: FaceMesh instance (see Webcam._create_face_mesh)
+    - indices (list): FaceMesh landmark indices of a sample
+    - metrics (Metrics): Receives the 'cvtColor' and 'face_mesh' stage times
+    - draw (callable): draw(frame, face_landmarks), draws the mesh on the preview
+    """
+
+    name = 'face_mesh'
+
+    def __init__(self, face_mesh, indices, metrics=None, draw=None):
+        super().__init__(len(indices))
+        self.face_mesh = face_mesh
+        self.indices = indices
+        self.face = None
+        self._draw = draw
+        metrics = metrics if metrics is not None else Metrics()
+        self._convert_time = metrics.stage('cvtColor').record
+        self._face_mesh_time = metrics.stage('face_mesh').record
+
+    def process(self, image):
+        t0 = now()
+        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        image_rgb.flags.writeable = False  # lets MediaPipe use the buffer without a copy
+        t1 = now()
+        self._convert_time(t1 - t0)
+        results = self.face_mesh.process(image_rgb)
+        self._face_mesh_time(now() - t1)
+
+        if not results.multi_face_landmarks:
+            self.face = self.landmarks = None
+            return None
+        self.face = results.multi_face_landmarks[0]
+        self.landmarks = landmark = self.face.landmark
+        points = self.points
+        for i, index in enumerate(self.indices):
+            points[i, 0] = landmark[index].x
+            points[i, 1] = landmark[index].y
+        return self
+
+    def draw(self, frame):
+        if self._draw is not None and self.face is not None:
+            self._draw(frame, self.face)
+
+
+class CascadeBackend(LandmarkBackend):
+
+    """
+    Low-power eye detector: OpenCV's bundled Haar cascades and pupil centroids.
+
+    The face is detected on a grayscale copy of the frame downscaled to
+    detect_width pixels, the eyes in the upper half of the face, and the
+    pupil of each eye is the centroid of its darkest pixels. It costs a
+    fraction of FaceMesh on a CPU, but only the two iris positions are
+    estimated (the contours are NaN), they are noisier, and an eye the
+    cascade misses is NaN for that frame.
+
+    Args:
+    - num_points (int): Number of landmarks of a sample
+    - detect_width (int): Width the frame is downscaled to for the face detection
+    - dark_fraction (float): Fraction of the darkest pixels of an eye taken as the pupil
+    - cascade_dir (str): Directory of the cascade files, cv2.data.haarcascades by default
+    - metrics (Metrics): Receives the 'cascade' and 'pupil' stage times
+    """
+
+    name = 'cascade'
+
+    def __init__(self, num_points, detect_width=320, dark_fraction=0.08, cascade_dir=None, metrics=None):
+        super().__init__(num_points)
+        if not hasattr(cv2, 'CascadeClassifier'):
+            raise RuntimeError("this OpenCV build has no CascadeClassifier, "
+                               "the cascade backend needs opencv-python 4.x")
+        if cascade_dir is None:
+            cascade_dir = cv2.data.haarcascades
+        self.face_cascade = cv2.CascadeClassifier(os.path.join(cascade_dir, 'haarcascade_frontalface_default.xml'))
+        self.eye_cascade = cv2.CascadeClassifier(os.path.join(cascade_dir, 'haarcascade_eye.xml'))
+        if self.face_cascade.empty() or self.eye_cascade.empty():
+            raise RuntimeError(f"could not load the Haar cascades from {cascade_dir}")
+        self.detect_width = detect_width
+        self.dark_fraction = dark_fraction
+        self.face_box = None
+        self.eye_boxes = []
+        metrics = metrics if metrics is not None else Metrics()
+        self._cascade_time = metrics.stage('cascade').record
+        self._pupil_time = metrics.stage('pupil').record
+
+    def _detect_face(self, gray):
+        scale = min(1.0, self.detect_width / gray.shape[1])
+        small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else gray
+        min_side = max(24, small.shape[1] // 6)
+        faces = self.face_cascade.detectMultiScale(small, scaleFactor=1.15, minNeighbors=4,
+                                                   minSize=(min_side, min_side))
+        if len(faces) == 0:
+            return None
+        x, y, w, h = max(faces, key=lambda face: face[2] * face[3])
+        return tuple(int(round(v / scale)) for v in (x, y, w, h))
+
+    def _detect_eyes(self, gray, face):
+        # Eyes are searched in the upper half of the face, downscaled to a fixed width
+        x, y, w, h = face
+        top, bottom = y + h // 5, y + h * 11 // 20
+        region = gray[top:bottom, x:x + w]
+        scale = min(1.0, 160 / max(1, w))
+        small = cv2.resize(region, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else region
+        eyes = self.eye_cascade.detectMultiScale(small, scaleFactor=1.1, minNeighbors=3,
+                                                 minSize=(small.shape[1] // 8, small.shape[1] // 8))
+        # The participant's right eye is on the left of the (unmirrored) image;
+        # keep the largest detection on each side of the face
+        sides = [None, None]
+        for ex, ey, ew, eh in sorted(eyes, key=lambda eye: eye[2] * eye[3]):
+            box = tuple(int(round(v / scale)) for v in (ex, ey, ew, eh))
+            box = (x + box[0], top + box[1], box[2], box[3])
+            sides[0 if box[0] + box[2] / 2 < x + w / 2 else 1] = box
+        return sides
+
+    def _pupil(self, gray, box):
+        # Centroid of the darkest pixels, without the brow at the top of the eye box
+        x, y, w, h = box
+        eye = gray[y + h // 4:y + h * 17 // 20, x:x + w]
+        if eye.size == 0:
+            return x + w / 2, y + h / 2
+        eye = cv2.GaussianBlur(eye, (5, 5), 0)
+        k = int(eye.size * self.dark_fraction)
+        threshold = np.partition(eye, k, axis=None)[k]
+        moments = cv2.moments((eye <= threshold).view(np.uint8), binaryImage=True)
+        if moments['m00'] == 0:
+            return x + w / 2, y + h / 2
+        return x + moments['m10'] / moments['m00'], y + h // 4 + moments['m01'] / moments['m00']
+
+    def process(self, image):
+        t0 = now()
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        self.face_box = self._detect_face(gray)
+        self.eye_boxes = self._detect_eyes(gray, self.face_box) if self.face_box is not None else []
+        t1 = now()
+        self._cascade_time(t1 - t0)
+        if self.face_box is None or not any(self.eye_boxes):
+            self.face_box = None
+            return None
+
+        height, width = gray.shape
+        points = self.points
+        points[:] = np.nan
+        for i, box in enumerate(self.eye_boxes):
+            if box is not None:
+                px, py = self._pupil(gray, box)
+                points[i, 0] = px / width
+                points[i, 1] = py / height
+        self._pupil_time(now() - t1)
+        return self
+
+    def draw(self, frame):
+        if self.face_box is None:
+            return
+        x, y, w, h = self.face_box
+        cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 1)
+        for i, box in enumerate(self.eye_boxes):
+            if box is not None:
+                x, y, w, h = box
+                cv2.rectangle(frame, (x, y), (x + w, y + h), (255, 255, 0), 1)
+                px, py = self.points[i] * (frame.shape[1], frame.shape[0])
+                cv2.circle(frame, (int(px), int(py)), 3, (0, 0, 255), -1)
+
+    def reset(self):
+        self.face_box = None
+        self.eye_boxes = []
+
+
+class AdaptiveBackend(LandmarkBackend):
+
+    """
+    Keeps the time of the landmark step under a per-frame budget.
+
+    The cost of a frame is the wall time of the backend's process() call,
+    averaged per backend. That is what decides whether a worker keeps up
+    with the camera, and it is one quantity whatever runs where: it
+    includes the inference MediaPipe runs on its own graph threads, and the
+    time the worker waits for the CPU or the GIL while the capture, the
+    writer or the Tobii callbacks run, so a loaded machine also moves to the
+    cheaper backend. While the primary backend (FaceMesh) costs more than
+    the budget, the fallback (cascade) runs instead; every probe_every
+    frames the primary is tried on a few frames and takes over again once
+    its average is below hysteresis * frame_budget. When the running
+    backend alone is over budget, only one frame in ceil(cost / frame_budget)
+    is processed and skip() asks the caller to drop the others.
+
+    Args:
+    - primary (LandmarkBackend): Preferred backend
+    - fallback (LandmarkBackend): Cheaper backend, None to only skip frames
+    - frame_budget (float): Seconds (wall time) per frame and worker
+    - probe_every (int): Frames of the fallback between two tries of the primary
+    - probe_frames (int): Frames of the primary per try
+    - hysteresis (float): The primary takes over again below hysteresis * budget
+    - smoothing (float): Weight of the newest frame in the cost averages
+    """
+
+    def __init__(self, primary, fallback=None, frame_budget=1 / 30, probe_every=90, probe_frames=5,
+                 hysteresis=0.8, smoothing=0.1):
+        super().__init__(len(primary.points))
+        self.primary = primary
+        self.fallback = fallback
+        self.frame_budget = frame_budget
+        self.probe_every = probe_every
+        self.probe_frames = probe_frames
+        self.hysteresis = hysteresis
+        self.smoothing = smoothing
+        self.switches = 0
+        self.skipped = 0
+        self.reset()
+
+    def reset(self):
+        self.active = self.primary
+        self.cost = {self.primary: 0.0, self.fallback: 0.0}
+        self._since_probe = 0
+        self._probing = 0
+        self._frame = 0
+        self._last = self.primary
+        self.primary.reset()
+        if self.fallback is not None:
+            self.fallback.reset()
+
+    def skip(self):
+        cost = self.cost[self.active]
+        if self._probing or cost <= self.frame_budget:
+            return False
+        self._frame += 1
+        if self._frame % math.ceil(cost / self.frame_budget):
+            self.skipped += 1
+            return True
+        return False
+
+    def process(self, image):
+        backend = self.active
+        if backend is not self.primary:
+            self._since_probe += 1
+            if self._since_probe >= self.probe_every:
+                self._since_probe = 0
+                self._probing = self.probe_frames
+            if self._probing:
+                self._probing -= 1
+                backend = self.primary
+
+        start = now()
+        found = backend.process(image)
+        cost = now() - start
+        self._last = backend
+        self.cost[backend] += self.smoothing * (cost - self.cost[backend])
+
+        if backend is self.primary and self.fallback is not None:
+            if self.active is self.primary and self.cost[backend] > self.frame_budget:
+                self._switch(self.fallback)
+            elif self.active is not self.primary and self.cost[backend] < self.hysteresis * self.frame_budget:
+                self._switch(self.primary)
+        return found
+
+    def _switch(self, backend):
+        self.active = backend
+        self.switches += 1
+        self._since_probe = self._probing = self._frame = 0
+        backend.reset()
+
+    def draw(self, frame):
+        self._last.draw(frame)
+
+
+if __name__ == "__main__":
+
+    # The adaptive backend on the webcam: FaceMesh while it fits in the budget, the cascade otherwise
+    import threading
+    from Webcam import Webcam
+
+    webcam = Webcam(show_preview=False, backend='adaptive', frame_budget=1 / 60)
+    threading.Timer(10, webcam.stop_recording).start()
+    webcam.start_recording_webcam()
+    codes = np.bincount(webcam.get_data()['backend'], minlength=len(WEBCAM_BACKENDS))
+    print("[Webcam] " + ", ".join(f"{name}: {count} samples" for name, count in zip(WEBCAM_BACKENDS, codes)))
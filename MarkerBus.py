@@ -0,0 +1,147 @@
+#One timestamp per marker, shared by every recorder
+
+import numpy as np
+
+from GazeBuffer import GazeBuffer, BUS_MARKER_DTYPE
+from ClockSync import now
+
+
+def samples_between(data, start, end, column='system_timestamp'):
+    """
+    Rows of a recorded stream from time start (included) to time end (excluded).
+
+    The stream is sorted by time, so this is two binary searches and returns a
+    view, without scanning or copying the samples.
+
+    Args:
+    - data (np.ndarray): Structured array of any stream (TOBII_DTYPE, WEBCAM_DTYPE, ...)
+    - start, end (float): Times in the common timebase
+    - column (str): Time column ('onset' for EVENT_DTYPE)
+
+    Returns:
+    - np.ndarray: View of the rows
+    """
+    first, last = np.searchsorted(data[column], (start, end), side='left')
+    return data[first:last]
+
+
+class MarkerBus:
+
+    """
+    Publishes markers to every recorder with a single timestamp.
+
+    publish() reads the clock once and appends the marker with that time to
+    the bus's own table and to the marker table of every registered recorder
+    (Tobii, Webcam, WebcamProcess, MultiCamera: anything with
+    add_marker(marker, timestamp)), so the trackers no longer disagree on
+    when a marker happened. The tables are GazeBuffers, appended in place
+    without locks; publish from one thread (the experiment loop).
+
+    The bus keeps the rows of every marker name, so between() finds the
+    samples of a stream between two markers in O(log n).
+    """
+
+    def __init__(self, *recorders):
+        self.recorders = list(recorders)
+        self.markers = GazeBuffer(BUS_MARKER_DTYPE, capacity=256, chunk_size=256)
+        self._rows = {}
+        self.session_writer = None
+        self._spilled = 0
+
+    def register(self, recorder):
+        """Add a recorder; it receives the markers published from now on."""
+        self.recorders.append(recorder)
+
+    def attach_writer(self, session_writer):
+        """Stream the bus's marker table to disk ('markers')."""
+        session_writer.add_stream('markers', BUS_MARKER_DTYPE)
+        self.session_writer = session_writer
+
+    def publish(self, marker, timestamp=None):
+        """
+        Add a marker to every recorder.
+
+        Args:
+        - marker (str): Marker name (e.g., 'Start stimulus')
+        - timestamp (float): Time of the marker, now() by default
+
+        Returns:
+        - float: The timestamp given to all recorders
+        """
+        if timestamp is None:
+            timestamp = now()
+        for recorder in self.recorders:
+            recorder.add_marker(marker, timestamp)
+        self._rows.setdefault(marker, []).append(len(self.markers))
+        self.markers.append((timestamp, marker))
+        if self.session_writer is not None:
+            self.flush(timeout=0.0)
+        return timestamp
+
+    def flush(self, timeout=None):
+        """
+        Hand the markers the full writer queue refused so far to the session writer.
+
+        publish() does not block and retries them with the next marker; call
+        flush() once the last marker is published, before closing the writer.
+        """
+        if self.session_writer is not None:
+            self._spilled = self.session_writer.spill('markers', self.markers.view(), self._spilled, timeout)
+
+    def time_of(self, marker, occurrence=0):
+        """
+        Timestamp of a published marker.
+
+        Args:
+        - marker (str): Marker name
+        - occurrence (int): Which occurrence of the marker, negative counts from the last
+
+        Returns:
+        - float
+        """
+        rows = self._rows.get(marker)
+        if not rows:
+            raise KeyError(f"marker {marker!r} was not published")
+        return float(self.markers.view()['system_timestamp'][rows[occurrence]])
+
+    def between(self, data, start_marker, end_marker, occurrence=0, column='system_timestamp'):
+        """
+        Samples of a stream recorded between two markers (see samples_between).
+
+        Args:
+        - data (np.ndarray): Stream of any recorder, e.g. tobii.get_data()
+        - start_marker, end_marker (str): Marker names
+        - occurrence (int): Occurrence of both markers, e.g. the trial number
+
+        Returns:
+        - np.ndarray: View of the rows
+        """
+        return samples_between(data, self.time_of(start_marker, occurrence),
+                               self.time_of(end_marker, occurrence), column)
+
+    def get_markers(self):
+        """Returns the published markers as a structured array (zero-copy view)."""
+        return self.markers.view()
+
+    def clear(self):
+        self.markers.clear()
+        self._rows = {}
+        self._spilled = 0
+
+
+if __name__ == "__main__":
+
+    # Both recorders get the same timestamp; the window between two markers is a binary search away
+    from FakeDevices import FakeTobiiResearch
+    from Tobii import Tobii
+    import time
+
+    tracker = Tobii(FakeTobiiResearch())
+    bus = MarkerBus(tracker)
+    tracker.start_recording()
+    bus.publish('Start stimulus')
+    time.sleep(0.5)
+    bus.publish('End stimulus')
+    tracker.stop_recording()
+    window = bus.between(tracker.get_data(), 'Start stimulus', 'End stimulus')
+    print(f"[MarkerBus] {len(window)} samples between the markers, markers: {tracker.get_markers()}")
@@ -0,0 +1,147 @@
+#Always-on stage timers, latency histograms and counters for the recording hot paths
+
+import json
+import threading
+
+import numpy as np
+
+from ClockSync import now
+
+
+class LatencyHistogram:
+
+    """
+    Fixed-memory latency histogram with HDR-style log-linear buckets.
+
+    Values are recorded in whole microseconds. Below 2**sub_bits us every
+    microsecond has its own bucket; above, every power of two is split into
+    2**sub_bits buckets, so a bucket is never wider than 1/2**sub_bits of its
+    value (6% with the default). Recording is a few integer operations and a
+    list increment; increments from concurrent threads are not locked, so a
+    rare count may be lost under contention, which is fine for monitoring.
+
+    Args:
+    - sub_bits (int): Precision, 2**sub_bits buckets per power of two
+    - max_exponent (int): Values up to 2**max_exponent us (67 s by default) are resolved,
+      larger values go to the last bucket
+    """
+
+    def __init__(self, sub_bits=4, max_exponent=26):
+        self.sub_bits = sub_bits
+        self._sub = 1 << sub_bits
+        self.counts = [0] * ((max_exponent - sub_bits + 1) << sub_bits)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, seconds):
+        """Add one duration (seconds)."""
+        value = int(seconds * 1e6)
+        if value < self._sub:
+            index = value if value > 0 else 0
+        else:
+            shift = value.bit_length() - self.sub_bits - 1
+            index = (shift << self.sub_bits) + (value >> shift)
+            if index >= len(self.counts):
+                index = len(self.counts) - 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def bucket_bounds(self):
+        """Returns the lower and upper bound (us) of every bucket as two arrays."""
+        index = np.arange(len(self.counts))
+        shift = np.maximum(index // self._sub - 1, 0)
+        lower = np.where(index < self._sub, index, (index - (shift << self.sub_bits)) << shift)
+        upper = np.where(index < self._sub, index + 1, (index - (shift << self.sub_bits) + 1) << shift)
+        return lower, upper
+
+    def percentile(self, q):
+        """Value (us) below which q percent of the recorded values fall (bucket midpoint)."""
+        if not self.count:
+            return float('nan')
+        counts = np.array(self.counts)
+        index = int(np.searchsorted(np.cumsum(counts), q / 100 * self.count))
+        lower, upper = self.bucket_bounds()
+        return float(min((lower[index] + upper[index] - 1) / 2, self.max))
+
+    def merge(self, other):
+        """Add the counts of another histogram with the same layout."""
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def snapshot(self):
+        """Returns count, mean, percentiles and max in microseconds (JSON-serializable)."""
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean_us': self.total / self.count,
+            'p50_us': self.percentile(50),
+            'p90_us': self.percentile(90),
+            'p99_us': self.percentile(99),
+            'p999_us': self.percentile(99.9),
+            'max_us': float(self.max),
+        }
+
+
+class Metrics:
+
+    """
+    Named stage timers and counters of one component (Tobii, Webcam, ...).
+
+    Hot paths fetch a histogram once and time a stage with two now() reads:
+
+        read_time = metrics.stage('read').record
+        start = now(); ret, frame = cap.read(); read_time(now() - start)
+
+    snapshot() can be called at any time from any thread.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._created = now()
+
+    def stage(self, name):
+        """Returns the histogram of a stage, created on first use."""
+        histogram = self.stages.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.stages.setdefault(name, LatencyHistogram())
+        return histogram
+
+    def count(self, name, n=1):
+        """Increment a counter."""
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self):
+        for histogram in list(self.stages.values()):
+            histogram.reset()
+        self.counters = {}
+        self._created = now()
+
+    def snapshot(self):
+        """Returns the counters and the latency summary of every stage that ran (JSON-serializable)."""
+        return {
+            'uptime_s': now() - self._created,
+            'counters': dict(self.counters),
+            'stages': {name: histogram.snapshot() for name, histogram in list(self.stages.items())
+                       if histogram.count},
+        }
+
+    def dump(self, path):
+        """Write the snapshot to a JSON file."""
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
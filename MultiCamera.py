@@ -0,0 +1,167 @@
+#Concurrent recording from several webcams, one process per camera
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from GazeBuffer import MULTI_WEBCAM_DTYPE
+from WebcamProcess import WebcamProcess
+from ClockSync import now
+
+
+class VideoFileSource:
+
+    """
+    VideoCapture-like source that plays a video file like a camera.
+
+    Frames are delivered at the file's frame rate (instead of as fast as
+    they decode), optionally looping, so recorded clips can stand in for
+    devices. Pass it as a picklable factory, e.g.
+    functools.partial(VideoFileSource, 'front.avi', loop=True).
+
+    Args:
+    - path (str): Video file
+    - realtime (bool): Pace the frames at the file's frame rate
+    - loop (bool): Restart at the end of the file instead of ending the stream
+    """
+
+    def __init__(self, path, realtime=True, loop=False):
+        self.path = path
+        self.realtime = realtime
+        self.loop = loop
+        self.cap = cv2.VideoCapture(path)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self._next_frame = None
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def read(self):
+        if self.realtime:
+            t = now()
+            if self._next_frame is None:
+                self._next_frame = t
+            elif t < self._next_frame:
+                time.sleep(self._next_frame - t)
+            self._next_frame = max(self._next_frame + 1.0 / self.fps, now() - 1.0 / self.fps)
+        ret, frame = self.cap.read()
+        if not ret and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.cap.read()
+        return ret, frame
+
+    def release(self):
+        self.cap.release()
+
+
+class MultiCamera:
+
+    """
+    Record several webcams at once.
+
+    Every camera runs in its own WebcamProcess (its own capture thread,
+    FaceMesh and GIL), so the cameras scale across cores and a slow one
+    does not hold back the others. Each camera's samples carry the grab
+    timestamps of its frames and are stored in the stream 'webcam_<id>'.
+
+    Args:
+    - sources (list or dict): Camera id -> source (device index, video file or a
+      callable returning a VideoCapture-like object); a list gets the ids 0, 1, ...
+    - **webcam_args: Arguments of Webcam shared by all cameras
+    """
+
+    def __init__(self, sources, **webcam_args):
+        if not isinstance(sources, dict):
+            sources = dict(enumerate(sources))
+        self.cameras = {camera_id: WebcamProcess(stream_name=f'webcam_{camera_id}', cam_index=source, **webcam_args)
+                        for camera_id, source in sources.items()}
+
+    def _each(self, method, *args):
+        # Run the same call on every camera concurrently (process start-up and joins overlap)
+        with ThreadPoolExecutor(max_workers=len(self.cameras)) as pool:
+            futures = {camera_id: pool.submit(getattr(camera, method), *args)
+                       for camera_id, camera in self.cameras.items()}
+        return {camera_id: future.result() for camera_id, future in futures.items()}
+
+    def attach_writer(self, session_writer):
+        """Stream every camera to disk ('webcam_<id>' and 'webcam_<id>_markers')."""
+        for camera in self.cameras.values():
+            camera.attach_writer(session_writer)
+
+    def open(self):
+        """Start all camera processes. Returns camera id -> True if ready."""
+        return self._each('open')
+
+    def start_recording(self):
+        """Start capturing on all cameras. Returns camera id -> True if capturing."""
+        return self._each('start_recording')
+
+    def add_marker(self, marker_type, timestamp=None):
+        """Add the marker to every camera's marker table, with one timestamp for all cameras."""
+        if timestamp is None:
+            timestamp = now()
+        for camera in self.cameras.values():
+            camera.add_marker(marker_type, timestamp)
+
+    def stop_recording(self):
+        """Stop all cameras and print their rates and drop counts."""
+        self._each('stop_recording')
+        for camera_id, stats in self.pipeline_stats().items():
+            print(f"[Webcam] Camera {camera_id}: {stats.get('processed_fps', 0):.1f} fps processed, "
+                  f"{stats.get('dropped', 0)} frames dropped, {stats.get('samples', 0)} samples.")
+
+    def pipeline_stats(self):
+        """Returns camera id -> FPS, drop counts and samples of that camera."""
+        return self._each('pipeline_stats')
+
+    def metrics_snapshot(self):
+        """Returns camera id -> stage timers and counters of that camera."""
+        return self._each('metrics_snapshot')
+
+    def get_data(self, camera_id):
+        """Returns a zero-copy view of one camera's iris positions."""
+        return self.cameras[camera_id].get_data()
+
+    def get_markers(self, camera_id):
+        """Returns a zero-copy view of one camera's marker table."""
+        return self.cameras[camera_id].get_markers()
+
+    def streams(self):
+        """Returns every camera's data and markers, keyed by stream name (for export_session)."""
+        streams = {}
+        for camera in self.cameras.values():
+            streams[camera.stream_name] = camera.get_data()
+            streams[camera.stream_name + '_markers'] = camera.get_markers()
+        return streams
+
+    def get_combined(self):
+        """
+        Merge the cameras into one table sorted by grab timestamp.
+
+        Returns:
+        - np.ndarray with MULTI_WEBCAM_DTYPE (camera_id tells the camera of each row)
+        """
+        parts = [(camera_id, camera.get_data()) for camera_id, camera in self.cameras.items()]
+        data = np.empty(sum(len(part) for _, part in parts), dtype=MULTI_WEBCAM_DTYPE)
+        start = 0
+        for camera_id, part in parts:
+            rows = data[start:start + len(part)]
+            for name in part.dtype.names:
+                rows[name] = part[name]
+            rows['camera_id'] = camera_id
+            start += len(part)
+        return data[np.argsort(data['system_timestamp'], kind='stable')]
+
+
+if __name__ == "__main__":
+
+    cameras = MultiCamera([0, 1], show_preview=False)
+    if all(cameras.start_recording().values()):
+        time.sleep(10)
+    cameras.stop_recording()
+    print(f"[Webcam] {len(cameras.get_combined())} samples from {len(cameras.cameras)} cameras.")
@@ -0,0 +1,296 @@
+#Decimated plots of long Tobii and webcam recordings
+
+import numpy as np
+
+from EventDetector import binocular_gaze_array
+
+
+# Traces of each stream: (column or None for the binocular gaze, label, color)
+TOBII_TRACES = [('gaze_x', 'Tobii gaze X', 'tab:red'), ('gaze_y', 'Tobii gaze Y', 'tab:green')]
+WEBCAM_TRACES = [('right_eye_x', 'Right Eye X', 'red'), ('right_eye_y', 'Right Eye Y', 'green'),
+                 ('left_eye_x', 'Left Eye X', 'blue'), ('left_eye_y', 'Left Eye Y', 'orange')]
+
+
+def minmax_decimate(t, y, bucket_width, origin=0.0):
+    """
+    Min/max decimation: the lowest and highest sample of every time bucket.
+
+    The line drawn through the kept samples covers exactly the pixels of the
+    full trace when a bucket is one pixel wide, so no spike is lost. Buckets
+    are on a fixed grid from origin, so decimating a recording in pieces
+    gives the same samples as all at once. Buckets without a valid sample
+    give a NaN point, which breaks the line at the gap.
+
+    Args:
+    - t (np.ndarray): Sorted times
+    - y (np.ndarray): Values, NaN where invalid
+    - bucket_width (float): Width of a bucket in time units (e.g. the time span of one pixel)
+    - origin (float): Start of the bucket grid
+
+    Returns:
+    - (t, y) of the kept samples
+    """
+    t = np.asarray(t, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if not len(t):
+        return t, y
+    bucket = np.floor((t - origin) / bucket_width).astype(np.int64)
+    starts = np.flatnonzero(np.diff(bucket, prepend=bucket[0] - 1))
+    counts = np.diff(np.append(starts, len(t)))
+    finite = np.isfinite(y)
+    low = np.fmin.reduceat(np.where(finite, y, np.inf), starts)
+    high = np.fmax.reduceat(np.where(finite, y, -np.inf), starts)
+    empty = ~np.isfinite(low)
+
+    # First sample of every bucket that equals its min / max, in time order
+    of_bucket = np.repeat(np.arange(len(starts)), counts)
+    first_low = np.full(len(starts), -1)
+    first_high = np.full(len(starts), -1)
+    index = np.flatnonzero(y == low[of_bucket])[::-1]
+    first_low[of_bucket[index]] = index
+    index = np.flatnonzero(y == high[of_bucket])[::-1]
+    first_high[of_bucket[index]] = index
+
+    first = np.minimum(first_low, first_high)
+    second = np.maximum(first_low, first_high)
+    first[empty] = starts[empty]
+    second[empty] = starts[empty]
+    keep = np.column_stack([first, second]).ravel()
+    out_y = y[keep]
+    out_y[np.repeat(empty, 2)] = np.nan
+    return t[keep], out_y
+
+
+def lttb_decimate(t, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets decimation (Steinarsson 2013) to n_out samples.
+
+    Keeps the samples that preserve the visual shape of the trace best; the
+    choice in one bucket depends on the previous one, so the buckets are
+    looped over (n_out iterations, each vectorized over its bucket). NaN
+    samples are skipped, and a NaN point is inserted where they interrupted
+    the trace between two kept samples.
+
+    Args:
+    - t, y (np.ndarray): Sorted times and values
+    - n_out (int): Number of samples to keep (at least 3)
+
+    Returns:
+    - (t, y) of the kept samples
+    """
+    t = np.asarray(t, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    finite = np.flatnonzero(np.isfinite(y))
+    if len(finite) <= n_out or n_out < 3:
+        return t, y
+    tf = t[finite]
+    yf = y[finite]
+    n = len(tf)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        next_t = tf[end:next_end].mean() if next_end > end else tf[-1]
+        next_y = yf[end:next_end].mean() if next_end > end else yf[-1]
+        area = np.abs((tf[previous] - next_t) * (yf[start:end] - yf[previous])
+                      - (tf[previous] - tf[start:end]) * (next_y - yf[previous]))
+        previous = start + int(np.argmax(area))
+        selected[i + 1] = previous
+
+    kept = finite[selected]
+    # Gaps: invalid samples between two kept samples
+    invalid = np.cumsum(~np.isfinite(y))
+    gap = invalid[kept[1:]] - invalid[kept[:-1]] > 0
+    out_t = t[kept]
+    out_y = y[kept]
+    if gap.any():
+        at = np.flatnonzero(gap) + 1
+        out_t = np.insert(out_t, at, out_t[at - 1])
+        out_y = np.insert(out_y, at, np.nan)
+    return out_t, out_y
+
+
+def decimate(t, y, width_px=1600, method='minmax', start=None, end=None):
+    """
+    Decimate a trace to a pixel budget.
+
+    Args:
+    - t, y (np.ndarray): Sorted times and values
+    - width_px (int): Width of the plot in pixels
+    - method (str): 'minmax' (two samples per pixel, exact envelope) or 'lttb' (width_px samples)
+    - start, end (float): Time span of the axis, the span of t by default
+
+    Returns:
+    - (t, y) of the kept samples
+    """
+    if not len(t):
+        return np.asarray(t, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    start = t[0] if start is None else start
+    end = t[-1] if end is None else end
+    if method == 'lttb':
+        return lttb_decimate(t, y, width_px)
+    return minmax_decimate(t, y, max(end - start, 1e-9) / width_px, start)
+
+
+def _traces(data, traces):
+    # (label, color, values) of every trace of a stream; the Tobii traces are the binocular gaze
+    if traces is TOBII_TRACES:
+        x, y = binocular_gaze_array(data)
+        values = {'gaze_x': x, 'gaze_y': y}
+    else:
+        values = {column: data[column] for column, _, _ in traces}
+    return [(label, color, values[column]) for column, label, color in traces]
+
+
+def _overlays(ax, origin, markers=None, stimulus=None):
+    # Stimulus epochs as shaded spans, markers as vertical lines, each drawn in one call
+    if stimulus is not None and len(stimulus):
+        onsets = stimulus['system_timestamp'] - origin
+        ends = np.append(onsets[1:], onsets[-1] + np.median(np.diff(onsets)) if len(onsets) > 1 else onsets[-1] + 1)
+        ax.broken_barh(list(zip(onsets, ends - onsets)), (0, 1), transform=ax.get_xaxis_transform(),
+                       facecolors=['0.92', '0.85'] * (len(onsets) // 2 + 1), zorder=0)
+    if markers is not None and len(markers):
+        times = markers['system_timestamp'] - origin
+        ax.vlines(times, 0, 1, transform=ax.get_xaxis_transform(), colors='black', linestyles='dashed',
+                  linewidth=0.8)
+        for time, name in zip(times, markers['marker']):
+            ax.text(time, 1.0, f' {name}', transform=ax.get_xaxis_transform(), fontsize=7, va='top', rotation=90)
+
+
+def plot_session(tobii=None, webcam=None, markers=None, stimulus=None, width_px=1600, method='minmax',
+                 show=True):
+    """
+    Tobii and webcam traces on one time axis, decimated to the plot width,
+    with markers and stimulus epochs as overlays.
+
+    Args:
+    - tobii (np.ndarray): Tobii recording (TOBII_DTYPE), plotted as binocular gaze
+    - webcam (np.ndarray): Webcam recording (WEBCAM_DTYPE)
+    - markers (np.ndarray): Marker table (MARKER_DTYPE or the MarkerBus table)
+    - stimulus (np.ndarray): Stimulus onsets (STIMULUS_DTYPE)
+    - width_px (int): Pixel budget of the time axis
+    - method (str): 'minmax' or 'lttb' (see decimate)
+    - show (bool): Call plt.show(); otherwise the figure is returned
+
+    Returns:
+    - matplotlib Figure
+    """
+    import matplotlib.pyplot as plt
+
+    streams = [(data, traces, unit) for data, traces, unit in ((tobii, TOBII_TRACES, 'Gaze (display fraction)'),
+                                                                (webcam, WEBCAM_TRACES, 'Position (pixels)'))
+               if data is not None and len(data)]
+    if not streams:
+        raise ValueError("nothing to plot")
+    origin = min(data['system_timestamp'][0] for data, _, _ in streams)
+    end = max(data['system_timestamp'][-1] for data, _, _ in streams) - origin
+
+    fig, axes = plt.subplots(len(streams), 1, sharex=True, figsize=(width_px / 100, 3 * len(streams) + 1),
+                             squeeze=False)
+    for ax, (data, traces, unit) in zip(axes[:, 0], streams):
+        t = data['system_timestamp'] - origin
+        for label, color, values in _traces(data, traces):
+            ax.plot(*decimate(t, values, width_px, method, 0.0, end), label=label, color=color, linewidth=0.8)
+        _overlays(ax, origin, markers, stimulus)
+        ax.set_ylabel(unit)
+        ax.legend(loc='upper right')
+        ax.grid(True)
+    axes[-1, 0].set_xlabel('Time (s)')
+    axes[-1, 0].set_xlim(0, end)
+    fig.tight_layout()
+    if show:
+        plt.show()
+    return fig
+
+
+class LivePlot:
+
+    """
+    Rolling view of the last window seconds, updated during the recording.
+
+    update() only decimates the samples recorded since the previous call
+    (min/max on a fixed bucket grid, so the result is the same as decimating
+    everything) and appends them to the drawn lines; the samples of the last,
+    still filling bucket wait for the next call.
+
+    Args:
+    - tobii: Tobii (or anything with get_data() returning TOBII_DTYPE), or None
+    - webcam: Webcam / WebcamProcess, or None
+    - window (float): Seconds shown
+    - width_px (int): Pixel budget of the time axis
+    """
+
+    def __init__(self, tobii=None, webcam=None, window=30.0, width_px=1200):
+        import matplotlib.pyplot as plt
+
+        self.plt = plt
+        self.window = window
+        self.bucket_width = window / width_px
+        self.sources = [(source, traces) for source, traces in ((tobii, TOBII_TRACES), (webcam, WEBCAM_TRACES))
+                        if source is not None]
+        self.fig, axes = plt.subplots(len(self.sources), 1, sharex=True, squeeze=False,
+                                      figsize=(width_px / 100, 3 * len(self.sources) + 1))
+        self.axes = axes[:, 0]
+        self.origin = None
+        self.lines = []
+        for ax, (source, traces) in zip(self.axes, self.sources):
+            lines = [ax.plot([], [], label=label, color=color, linewidth=0.8)[0] for _, label, color in traces]
+            ax.legend(loc='upper right')
+            ax.grid(True)
+            # Decimated points kept per line, and the first sample not decimated yet
+            self.lines.append({'lines': lines, 't': [np.empty(0)] * len(lines), 'y': [np.empty(0)] * len(lines),
+                               'next': 0})
+        self.axes[-1].set_xlabel('Time (s)')
+        plt.ion()
+        plt.show(block=False)
+
+    def update(self):
+        """Add the new samples of every source and redraw. Returns the number of new samples."""
+        added = 0
+        now = None
+        for ax, (source, traces), state in zip(self.axes, self.sources, self.lines):
+            data = source.get_data()
+            if not len(data):
+                continue
+            if self.origin is None:
+                self.origin = data['system_timestamp'][0]
+            # Only complete buckets are decimated; the rest waits for the next update
+            t_all = data['system_timestamp']
+            complete = np.floor((t_all[-1] - self.origin) / self.bucket_width) * self.bucket_width + self.origin
+            stop = int(np.searchsorted(t_all, complete, side='left'))
+            new = data[state['next']:stop]
+            state['next'] = max(stop, state['next'])
+            now = t_all[-1] - self.origin if now is None else max(now, t_all[-1] - self.origin)
+            if not len(new):
+                continue
+            added += len(new)
+            for i, (line, (label, color, values)) in enumerate(zip(state['lines'], _traces(new, traces))):
+                t, y = minmax_decimate(new['system_timestamp'] - self.origin, values, self.bucket_width)
+                keep = state['t'][i] >= (t[-1] - self.window)
+                state['t'][i] = np.concatenate([state['t'][i][keep], t])
+                state['y'][i] = np.concatenate([state['y'][i][keep], y])
+                line.set_data(state['t'][i], state['y'][i])
+            ax.relim()
+            ax.autoscale_view(scalex=False)
+        if now is not None:
+            self.axes[-1].set_xlim(max(0.0, now - self.window), max(now, self.window))
+            self.fig.canvas.draw_idle()
+            self.fig.canvas.flush_events()
+        return added
+
+
+if __name__ == "__main__":
+
+    # Usage: python Plotting.py <exported session> [lttb]
+    import sys
+    from DataExport import load_streams
+
+    if len(sys.argv) < 2:
+        sys.exit("Usage: python Plotting.py <session> [minmax|lttb]")
+    streams = load_streams(sys.argv[1])
+    plot_session(streams.get('tobii'), streams.get('webcam'), streams.get('markers', streams.get('tobii_markers')),
+                 streams.get('stimulus'), method=sys.argv[2] if len(sys.argv) > 2 else 'minmax')
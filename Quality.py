@@ -0,0 +1,320 @@
+#Data-quality report of the Tobii and webcam recordings
+
+import json
+import math
+import os
+
+import numpy as np
+
+from EventDetector import binocular_gaze_array
+
+
+# Eye name -> (x column, y column, validity column or None) of each stream
+TOBII_EYES = {
+    'left': ('left_gaze_x', 'left_gaze_y', 'left_gaze_validity'),
+    'right': ('right_gaze_x', 'right_gaze_y', 'right_gaze_validity'),
+}
+WEBCAM_EYES = {
+    'left': ('left_eye_x', 'left_eye_y', None),
+    'right': ('right_eye_x', 'right_eye_y', None),
+}
+SCREEN_EYES = {
+    'gaze': ('gaze_x', 'gaze_y', None),
+}
+
+
+def display_degrees(display_size_mm=(527.0, 296.0), distance_mm=650.0):
+    """
+    Degrees of visual angle spanned by the display, to convert normalized
+    display coordinates to degrees (same approximation as EventDetector).
+
+    Returns:
+    - (degrees across the width, degrees across the height)
+    """
+    return (math.degrees(2 * math.atan(display_size_mm[0] / 2 / distance_mm)),
+            math.degrees(2 * math.atan(display_size_mm[1] / 2 / distance_mm)))
+
+
+class StreamQuality:
+
+    """
+    Running quality metrics of one stream, updated chunk by chunk.
+
+    Every update() takes the rows recorded since the previous one (e.g. the
+    tail of a GazeBuffer view) and only adds a few sums per metric, so the
+    report can be refreshed during the recording; a whole recording in one
+    update() gives the same numbers. The last row of a chunk is kept so the
+    intervals and sample-to-sample distances continue across chunks.
+
+    Args:
+    - eyes (dict): Eye name -> (x column, y column, validity column or None), e.g. TOBII_EYES
+    - frequency (float): Nominal sampling rate (Hz) used to count missing samples;
+      None takes the median interval of the first chunk
+    - scale (tuple): Factor from the x and y units to the reported unit (e.g. display_degrees())
+    - unit (str): Name of the reported unit
+    """
+
+    def __init__(self, eyes, frequency=None, scale=(1.0, 1.0), unit='px'):
+        self.eyes = eyes
+        self.frequency = frequency
+        self.scale = scale
+        self.unit = unit
+        self.samples = 0
+        self.missing = 0
+        self.first_time = None
+        self._last = None
+        self._interval_sum = 0.0
+        self._interval_sumsq = 0.0
+        self._interval_max = 0.0
+        self._valid = dict.fromkeys(eyes, 0)
+        self._s2s_sum = dict.fromkeys(eyes, 0.0)
+        self._s2s_count = dict.fromkeys(eyes, 0)
+
+    def _eye(self, data, eye):
+        x_name, y_name, validity = self.eyes[eye]
+        x = data[x_name].astype(np.float64)
+        y = data[y_name].astype(np.float64)
+        valid = np.isfinite(x) & np.isfinite(y)
+        if validity is not None:
+            valid &= data[validity] != 0
+        return x, y, valid
+
+    def update(self, data):
+        """
+        Add the rows recorded since the previous update.
+
+        Args:
+        - data (np.ndarray): New rows of the stream (structured array)
+
+        Returns:
+        - self
+        """
+        if not len(data):
+            return self
+        t = data['system_timestamp'].astype(np.float64)
+        if self.first_time is None:
+            self.first_time = t[0]
+        # Prepend the last row of the previous chunk so differences span the chunks
+        rows = data if self._last is None else np.concatenate([self._last, data])
+        times = rows['system_timestamp'].astype(np.float64)
+        intervals = np.diff(times)
+        if len(intervals):
+            if self.frequency is None:
+                self.frequency = 1.0 / np.median(intervals)
+            self._interval_sum += intervals.sum()
+            self._interval_sumsq += (intervals ** 2).sum()
+            self._interval_max = max(self._interval_max, float(intervals.max()))
+            self.missing += int(np.maximum(np.round(intervals * self.frequency) - 1, 0).sum())
+
+        for eye in self.eyes:
+            x, y, valid = self._eye(rows, eye)
+            self._valid[eye] += int(valid[len(rows) - len(data):].sum())
+            pairs = valid[1:] & valid[:-1]
+            dx = np.diff(x)[pairs] * self.scale[0]
+            dy = np.diff(y)[pairs] * self.scale[1]
+            self._s2s_sum[eye] += float((dx ** 2 + dy ** 2).sum())
+            self._s2s_count[eye] += int(pairs.sum())
+
+        self.samples += len(data)
+        self._last = data[-1:].copy()
+        return self
+
+    def report(self):
+        """
+        Returns the metrics so far (JSON-serializable):
+        samples, duration, effective rate, interval jitter, data loss (missing
+        samples against the nominal rate), and per eye the validity rate and
+        the RMS sample-to-sample precision.
+        """
+        intervals = self.samples - 1
+        if intervals < 1:
+            return {'samples': self.samples}
+        duration = float(self._last['system_timestamp'][0] - self.first_time)
+        mean = self._interval_sum / intervals
+        report = {
+            'samples': self.samples,
+            'duration_s': duration,
+            'nominal_rate_hz': float(self.frequency),
+            'effective_rate_hz': intervals / duration if duration > 0 else float('nan'),
+            'interval_mean_ms': mean * 1e3,
+            'interval_jitter_ms': math.sqrt(max(self._interval_sumsq / intervals - mean ** 2, 0.0)) * 1e3,
+            'interval_max_ms': self._interval_max * 1e3,
+            'missing_samples': self.missing,
+            'data_loss': self.missing / (self.samples + self.missing),
+        }
+        for eye in self.eyes:
+            report[f'{eye}_validity'] = self._valid[eye] / self.samples
+            count = self._s2s_count[eye]
+            report[f'{eye}_precision_rms_{self.unit}'] = (math.sqrt(self._s2s_sum[eye] / count) if count
+                                                          else float('nan'))
+        return report
+
+
+def stimulus_epochs(stimulus, screen_width, settle_time=0.3, duration=2.0):
+    """
+    Fixation windows and target positions of the stimulus onsets.
+
+    A window starts settle_time after the onset (saccade to the target) and
+    ends duration after it or at the next onset; Stimulus shows every point
+    for at least min_display_time (2 s).
+
+    Args:
+    - stimulus (np.ndarray): Stimulus stream (STIMULUS_DTYPE)
+    - screen_width (int): Screen width in pixels (stimulus_position is a pixel offset from the center)
+
+    Returns:
+    - (starts, ends, target_x, target_y) arrays, targets in normalized display coordinates
+    """
+    onsets = stimulus['system_timestamp'].astype(np.float64)
+    ends = np.minimum(onsets + duration, np.append(onsets[1:], np.inf))
+    target_x = 0.5 + stimulus['stimulus_position'].astype(np.float64) / screen_width
+    return onsets + settle_time, ends, target_x, np.full(len(onsets), 0.5)
+
+
+def epoch_quality(t, x, y, valid, epochs, scale=(1.0, 1.0)):
+    """
+    Per-epoch accuracy, precision and validity of a gaze signal in one pass.
+
+    Every sample is assigned to its epoch with a binary search, and the sums
+    of all epochs are accumulated with bincount.
+
+    Args:
+    - t, x, y (np.ndarray): Times and gaze in normalized display coordinates
+    - valid (np.ndarray): Valid samples
+    - epochs (tuple): (starts, ends, target_x, target_y), see stimulus_epochs
+    - scale (tuple): Units per display width / height, e.g. display_degrees()
+
+    Returns:
+    - dict of arrays: samples, validity, accuracy (mean distance from the
+      target), precision_rms (sample to sample), NaN where an epoch has no valid data
+    """
+    starts, ends, target_x, target_y = epochs
+    n = len(starts)
+    epoch = np.searchsorted(starts, t, side='right') - 1
+    inside = (epoch >= 0) & (t < ends[np.maximum(epoch, 0)])
+    epoch = np.where(inside, epoch, n)  # n collects the samples outside every epoch
+    samples = np.bincount(epoch, minlength=n + 1)[:n]
+    good = valid & inside
+    counts = np.bincount(epoch[good], minlength=n + 1)[:n]
+
+    offset = np.hypot((x - target_x[np.minimum(epoch, n - 1)]) * scale[0],
+                      (y - target_y[np.minimum(epoch, n - 1)]) * scale[1])
+    error = np.bincount(epoch[good], offset[good], minlength=n + 1)[:n]
+
+    pairs = good[1:] & good[:-1] & (epoch[1:] == epoch[:-1])
+    step = (np.diff(x) * scale[0]) ** 2 + (np.diff(y) * scale[1]) ** 2
+    s2s = np.bincount(epoch[1:][pairs], step[pairs], minlength=n + 1)[:n]
+    s2s_counts = np.bincount(epoch[1:][pairs], minlength=n + 1)[:n]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {
+            'samples': samples,
+            'validity': counts / samples,
+            'accuracy': error / counts,
+            'precision_rms': np.sqrt(s2s / s2s_counts),
+        }
+
+
+def session_quality(streams, screen_width=None, display_size_mm=(527.0, 296.0), distance_mm=650.0,
+                    tobii_frequency=None, webcam_frequency=None):
+    """
+    Quality report of a session, per session and per stimulus epoch.
+
+    Args:
+    - streams (dict): Stream name -> structured array, as passed to export_session
+      ('tobii', 'webcam', optional 'stimulus' and 'webcam_screen')
+    - screen_width (int): Screen width in pixels, needed for the accuracy against the stimulus
+    - display_size_mm (tuple): Display size, to report Tobii and mapped webcam gaze in degrees
+    - distance_mm (float): Viewing distance
+    - tobii_frequency, webcam_frequency (float): Nominal rates, None estimates them
+
+    Returns:
+    - dict (JSON-serializable)
+    """
+    scale = display_degrees(display_size_mm, distance_mm)
+    report = {}
+    tobii = streams.get('tobii')
+    webcam = streams.get('webcam')
+    screen = streams.get('webcam_screen')
+    if tobii is not None and len(tobii):
+        report['tobii'] = StreamQuality(TOBII_EYES, tobii_frequency, scale, 'deg').update(tobii).report()
+    if webcam is not None and len(webcam):
+        report['webcam'] = StreamQuality(WEBCAM_EYES, webcam_frequency).update(webcam).report()
+    if screen is not None and len(screen):
+        report['webcam_screen'] = StreamQuality(SCREEN_EYES, webcam_frequency, scale, 'deg').update(screen).report()
+
+    stimulus = streams.get('stimulus')
+    if stimulus is None or not len(stimulus) or screen_width is None:
+        return report
+    epochs = stimulus_epochs(stimulus, screen_width)
+    report['epochs'] = {
+        'onset': stimulus['system_timestamp'].tolist(),
+        'target_x': epochs[2].tolist(),
+        'target_y': epochs[3].tolist(),
+    }
+    signals = []
+    if 'tobii' in report:
+        x, y = binocular_gaze_array(tobii)
+        signals.append(('tobii', tobii['system_timestamp'], x, y, np.isfinite(x)))
+    if 'webcam_screen' in report:
+        x = screen['gaze_x'].astype(np.float64)
+        y = screen['gaze_y'].astype(np.float64)
+        signals.append(('webcam_screen', screen['system_timestamp'], x, y, np.isfinite(x) & np.isfinite(y)))
+    for name, t, x, y, valid in signals:
+        epoch = epoch_quality(t, x, y, valid, epochs, scale)
+        report['epochs'][name] = {key: values.tolist() for key, values in epoch.items()}
+        accuracy = epoch['accuracy'][np.isfinite(epoch['accuracy'])]
+        report[name]['accuracy_deg'] = float(accuracy.mean()) if len(accuracy) else float('nan')
+    return report
+
+
+def write_report(export_path, report):
+    """
+    Store a report next to an exported session (quality.json inside a
+    session directory, <name>_quality.json next to an archive or CSV file).
+
+    Returns:
+    - path of the report
+    """
+    if os.path.isdir(export_path):
+        path = os.path.join(export_path, 'quality.json')
+    else:
+        path = os.path.splitext(export_path)[0] + '_quality.json'
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+def print_report(report):
+    """Print the session-level metrics of a report."""
+    for name in ('tobii', 'webcam', 'webcam_screen'):
+        if name not in report:
+            continue
+        stream = report[name]
+        if 'duration_s' not in stream:
+            print(f"[Quality] {name}: {stream['samples']} samples")
+            continue
+        eyes = ', '.join(f"{key[:-len('_validity')]} {value:.1%}" for key, value in stream.items()
+                         if key.endswith('_validity'))
+        precision = ', '.join(f"{key.split('_precision')[0]} {value:.3f}" for key, value in stream.items()
+                              if '_precision_rms_' in key)
+        line = (f"[Quality] {name}: {stream['samples']} samples, {stream['effective_rate_hz']:.1f} Hz "
+                f"(jitter {stream['interval_jitter_ms']:.2f} ms), data loss {stream['data_loss']:.1%}, "
+                f"validity {eyes}, RMS-S2S {precision}")
+        if 'accuracy_deg' in stream:
+            line += f", accuracy {stream['accuracy_deg']:.2f} deg"
+        print(line)
+
+
+if __name__ == "__main__":
+
+    # Usage: python Quality.py <exported session or SessionWriter directory> [screen width px]
+    import sys
+    from DataExport import load_streams
+
+    if len(sys.argv) < 2:
+        sys.exit("Usage: python Quality.py <session> [screen_width]")
+    streams = load_streams(sys.argv[1])
+    report = session_quality(streams, screen_width=int(sys.argv[2]) if len(sys.argv) > 2 else None)
+    print_report(report)
+    print(f"[Quality] Report written to {write_report(sys.argv[1], report)}")
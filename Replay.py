@@ -0,0 +1,336 @@
+#Replay of recorded sessions through the live Tobii and webcam code paths
+
+import argparse
+import math
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from DataExport import load_streams
+from FakeDevices import FakeEyeTracker, FakeTobiiResearch
+from FramePipeline import BLOCK
+from VideoRecorder import load_frame_timestamps
+from ClockSync import now
+
+
+class ReplayClock:
+
+    """
+    Maps recorded timestamps onto replay time, shared by all replayed streams.
+
+    Args:
+    - speed (float): 1.0 for real time, N for N times faster, None as fast as
+      possible (nothing waits; replayed timestamps keep the recorded spacing)
+    """
+
+    def __init__(self, speed=1.0):
+        self.speed = speed
+        self.origin = 0.0
+        self.start = now()
+
+    def begin(self, origin):
+        """Recorded time origin is replayed from now on."""
+        self.origin = origin
+        self.start = now()
+
+    def time(self, t):
+        """Replay time of the recorded time t."""
+        return self.start + (t - self.origin) / (self.speed or 1.0)
+
+    def wait(self, t):
+        """Sleep until the replay time of t (not at all as fast as possible) and return it."""
+        target = self.time(t)
+        if self.speed:
+            delay = target - now()
+            if delay > 0:
+                time.sleep(delay)
+        return target
+
+
+def _marker_inserter(target, markers, clock, key):
+    # Returns before(position): adds to target the markers recorded before position,
+    # where position is a sample index (key 'sample_index') or a recorded time
+    rows = [] if markers is None else sorted(markers.tolist(), key=lambda row: row[1 if key == 'sample_index' else 0])
+    column = 1 if key == 'sample_index' else 0
+    next_row = [0]
+
+    def before(position):
+        while next_row[0] < len(rows) and rows[next_row[0]][column] <= position:
+            timestamp, _, marker = rows[next_row[0]]
+            target.add_marker(marker, clock.time(timestamp))
+            next_row[0] += 1
+
+    return before
+
+
+class ReplayEyeTracker(FakeEyeTracker):
+
+    """
+    Stand-in of tr.EyeTracker that delivers recorded samples (TOBII_DTYPE) as
+    SDK gaze dictionaries, at their recorded times on the replay clock.
+
+    The SDK system time stamps are those of the replay clock, so ClockSync
+    maps the samples onto the replayed timeline like on a live tracker.
+    """
+
+    def __init__(self, backend, data, clock):
+        period = np.median(np.diff(data['system_timestamp'])) if len(data) > 1 else 0.0
+        super().__init__(backend, frequency=round(1 / period) if period > 0 else 600)
+        self.model = 'Tobii (replay)'
+        self.device_name = 'Replay'
+        self.serial_number = 'REPLAY'
+        self.data = data
+        self.clock = clock
+        self.before_sample = None
+        self.finished = threading.Event()
+
+    def _gaze_loop(self, callback, stop):
+        self.finished.clear()
+        columns = {name: i for i, name in enumerate(self.data.dtype.names)}
+        eyes = [(eye, [columns[f'{eye}_{field}'] for field in (
+            'gaze_x', 'gaze_y', 'gaze_ucs_x', 'gaze_ucs_y', 'gaze_ucs_z', 'gaze_validity',
+            'pupil_diameter', 'pupil_validity', 'origin_ucs_x', 'origin_ucs_y', 'origin_ucs_z',
+            'origin_tbcs_x', 'origin_tbcs_y', 'origin_tbcs_z', 'origin_validity')]) for eye in ('left', 'right')]
+        timestamp = columns['system_timestamp']
+        system_offset = self.backend.system_offset
+        timing = self.timing
+
+        for index, row in enumerate(self.data.tolist()):
+            if stop.is_set():
+                return
+            if self.before_sample is not None:
+                self.before_sample(index)
+            scheduled = self.clock.wait(row[timestamp])
+            system_time_stamp = int((scheduled + system_offset) * 1e6)
+            sample = {
+                'device_time_stamp': self.device_time_stamp(system_time_stamp),
+                'system_time_stamp': system_time_stamp,
+            }
+            for eye, (gx, gy, ux, uy, uz, gv, pd, pv, ox, oy, oz, tx, ty, tz, ov) in eyes:
+                sample[eye + '_gaze_point_on_display_area'] = (row[gx], row[gy])
+                sample[eye + '_gaze_point_in_user_coordinate_system'] = (row[ux], row[uy], row[uz])
+                sample[eye + '_gaze_point_validity'] = row[gv]
+                sample[eye + '_pupil_diameter'] = row[pd]
+                sample[eye + '_pupil_validity'] = row[pv]
+                sample[eye + '_gaze_origin_in_user_coordinate_system'] = (row[ox], row[oy], row[oz])
+                sample[eye + '_gaze_origin_in_trackbox_coordinate_system'] = (row[tx], row[ty], row[tz])
+                sample[eye + '_gaze_origin_validity'] = row[ov]
+            self.emitted += 1
+            start = now()
+            callback(sample)
+            timing.append((start - scheduled, now() - start))
+        if self.before_sample is not None:
+            self.before_sample(math.inf)
+        self.finished.set()
+
+
+class ReplayTobiiResearch(FakeTobiiResearch):
+
+    """Stand-in of the tobii_research module with one ReplayEyeTracker, pass it as Tobii(backend=...)."""
+
+    def __init__(self, data, clock):
+        super().__init__(trackers=0)
+        self.eyetrackers = [ReplayEyeTracker(self, data, clock)]
+
+
+class ReplayVideoSource:
+
+    """
+    VideoCapture-like source replaying a recorded video at its recorded frame times.
+
+    The grab timestamps come from the video's sidecar (see VideoRecorder), or
+    from the frame rate if there is none. FramePipeline uses grab_timestamp()
+    as the timestamp of each frame.
+
+    Args:
+    - path (str): Video file
+    - clock (ReplayClock): Replay clock
+    - before_frame (callable): Called with the recorded time of every frame before it is delivered
+    """
+
+    def __init__(self, path, clock, before_frame=None):
+        self.cap = cv2.VideoCapture(path)
+        self.clock = clock
+        self.before_frame = before_frame
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        timestamps = load_frame_timestamps(path)
+        self.timestamps = None if timestamps is None else timestamps['system_timestamp']
+        self.index = 0
+        self.finished = threading.Event()
+        self._timestamp = None
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def recorded_time(self, index):
+        if self.timestamps is not None and index < len(self.timestamps):
+            return float(self.timestamps[index])
+        return self.clock.origin + index / self.fps
+
+    def read(self):
+        ret, frame = self.cap.read()
+        if not ret:
+            self.finished.set()
+            return False, None
+        t = self.recorded_time(self.index)
+        if self.before_frame is not None:
+            self.before_frame(t)
+        self._timestamp = self.clock.wait(t)
+        self.index += 1
+        return True, frame
+
+    def grab_timestamp(self):
+        return self._timestamp
+
+    def release(self):
+        self.cap.release()
+
+
+class SessionReplay:
+
+    """
+    Play a recorded session back through the live code paths.
+
+    Tobii samples reach Tobii.gaze_data_callback through a stand-in of the
+    SDK; recorded webcam samples go through Webcam._on_result, or with the
+    raw video every frame goes through the capture / FaceMesh pipeline.
+    Markers are re-inserted before the sample they were recorded at (by time
+    for the video). All streams follow one ReplayClock, so the recorded
+    inter-sample timing is kept at 1x, compressed at Nx, or dropped as fast
+    as possible. Attach writers, detectors etc. to tobii / webcam before run().
+
+    Args:
+    - session: Path (see load_streams) or dict of stream name -> structured array
+    - speed (float): 1.0 real time, N for N times faster, None as fast as possible
+    - video (str): Raw video of the session (Webcam record_video), replaces the recorded webcam samples
+    - **webcam_args: Arguments of Webcam when the video is replayed (roi_tracking, num_workers, ...)
+    """
+
+    def __init__(self, session, speed=1.0, video=None, **webcam_args):
+        from Tobii import Tobii
+        from Webcam import Webcam
+
+        self.streams = load_streams(session) if isinstance(session, str) else dict(session)
+        self.speed = speed
+        self.clock = ReplayClock(speed)
+        self.video = video
+        origins = [data['system_timestamp'][0] for data in self.streams.values()
+                   if len(data) and 'system_timestamp' in data.dtype.names]
+        if video is not None:
+            timestamps = load_frame_timestamps(video)
+            if timestamps is not None and len(timestamps):
+                origins.append(timestamps['system_timestamp'][0])
+        self.origin = float(min(origins)) if origins else 0.0
+        self.clock.origin = self.origin
+
+        self.tobii = None
+        if len(self.streams.get('tobii', ())):
+            backend = ReplayTobiiResearch(self.streams['tobii'], self.clock)
+            self.tobii = Tobii(backend)
+            self._tracker = backend.eyetrackers[0]
+            self._tracker.before_sample = _marker_inserter(self.tobii, self.streams.get('tobii_markers'),
+                                                           self.clock, 'sample_index')
+
+        self.webcam = None
+        self._source = None
+        if video is not None:
+            if speed is None:
+                webcam_args.setdefault('drop_policy', BLOCK)  # every frame is processed
+            self.webcam = Webcam(cam_index=lambda: self._source, show_preview=False, **webcam_args)
+            self._source = ReplayVideoSource(video, self.clock, _marker_inserter(
+                self.webcam, self.streams.get('webcam_markers'), self.clock, 'system_timestamp'))
+        elif len(self.streams.get('webcam', ())):
+            self.webcam = Webcam(show_preview=False, eye_contours='webcam_contours' in self.streams)
+
+    def _replay_webcam_samples(self):
+        data = self.streams['webcam']
+        contours = self.streams.get('webcam_contours')
+        before = _marker_inserter(self.webcam, self.streams.get('webcam_markers'), self.clock, 'sample_index')
+        # Sessions recorded before the backend column were all FaceMesh
+        backends = data['backend'].tolist() if 'backend' in data.dtype.names else [0] * len(data)
+        for index, (t, right_x, right_y, left_x, left_y) in enumerate(data[list(data.dtype.names[:5])].tolist()):
+            before(index)
+            timestamp = self.clock.wait(t)
+            sample = np.array([[right_x, right_y], [left_x, left_y]], dtype=np.float32)
+            if contours is not None and index < len(contours):
+                sample = np.vstack([sample, contours['right_eye'][index], contours['left_eye'][index]])
+            self.webcam._on_result(index, timestamp, (sample, None, backends[index]))
+        before(math.inf)
+
+    def run(self):
+        """
+        Replay the whole session and stop the recordings at its end.
+
+        Returns:
+        - dict with the recorded and replay durations, the achieved speed, the
+          samples delivered and the Tobii callback delays
+        """
+        self.clock.begin(self.origin)
+        start = now()
+        threads = []
+        if self.tobii is not None:
+            self.tobii.start_recording()
+        if self.webcam is not None:
+            target = self.webcam.start_recording_webcam if self.video is not None else self._replay_webcam_samples
+            threads.append(threading.Thread(target=target, name='WebcamReplay', daemon=True))
+            threads[-1].start()
+
+        if self.tobii is not None:
+            self._tracker.finished.wait()
+            self.tobii.stop_recording()
+        if self._source is not None:
+            self._source.finished.wait()
+            # stop_recording() discards the queued frames, let the workers take them first
+            while self.webcam.pipeline is not None and len(self.webcam.pipeline.queue):
+                time.sleep(0.005)
+            self.webcam.stop_recording()
+        for thread in threads:
+            thread.join()
+        elapsed = now() - start
+
+        ends = [data['system_timestamp'][-1] for data in self.streams.values()
+                if len(data) and 'system_timestamp' in data.dtype.names]
+        if self._source is not None and self._source.index:
+            ends.append(self._source.recorded_time(self._source.index - 1))
+        recorded = float(max(ends)) - self.origin if ends else 0.0
+        results = {
+            'recorded_s': recorded,
+            'replay_s': elapsed,
+            'speed': recorded / elapsed if elapsed > 0 else math.inf,
+        }
+        if self.tobii is not None:
+            results['tobii_samples'] = len(self.tobii.get_data())
+            results['tobii_samples_per_s'] = results['tobii_samples'] / elapsed
+            results['tobii_callback'] = self._tracker.callback_stats()
+        if self.webcam is not None:
+            results['webcam_samples'] = len(self.webcam.get_data())
+            results['webcam_samples_per_s'] = results['webcam_samples'] / elapsed
+            if self.video is not None:
+                results['webcam_pipeline'] = self.webcam.pipeline_stats()
+        return results
+
+
+if __name__ == "__main__":
+
+    import json
+
+    parser = argparse.ArgumentParser(description='Replay a recorded session through the live code paths.')
+    parser.add_argument('session', help='exported session, SessionWriter directory or .npz')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed (1 = real time)')
+    parser.add_argument('--fast', action='store_true', help='as fast as possible')
+    parser.add_argument('--video', help='raw video of the session, replayed through FaceMesh')
+    args = parser.parse_args()
+
+    replay = SessionReplay(args.session, None if args.fast else args.speed, args.video)
+    results = replay.run()
+    if replay.tobii is not None:
+        results['tobii_metrics'] = replay.tobii.metrics.snapshot()
+    if replay.webcam is not None:
+        results['webcam_metrics'] = replay.webcam.metrics.snapshot()
+    print(json.dumps(results, indent=2, default=float))
@@ -0,0 +1,259 @@
+#Crash-safe streaming of the recorded data to disk
+
+import json
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import zlib
+
+import numpy as np
+
+
+# Every chunk on disk is: magic, payload size, crc32 of the payload, payload.
+# A chunk that is truncated or fails the crc marks the end of valid data.
+CHUNK_MAGIC = b'GZCK'
+CHUNK_HEADER = struct.Struct('<4sII')
+
+
+class SessionWriter:
+
+    """
+    Background writer that appends every stream of a session to disk while recording.
+
+    Producers call write() with NumPy structured arrays; the arrays are handed
+    to a writer thread through a bounded queue and appended as checksummed
+    chunks to per-stream files, which are rotated once they reach
+    max_file_bytes and fsynced every fsync_interval seconds.
+    write() does not block by default: if the queue is full the batch is not
+    queued and write() returns False. The recorders keep a cursor of the rows
+    already queued (see spill()) and hand the refused rows over again with
+    their next batch; their final spill when the recording stops blocks, so
+    nothing is left behind. lost_rows counts the rows still refused, i.e.
+    missing from the files, so it is 0 once every recorder has stopped.
+    """
+
+    def __init__(self, directory, queue_size=4096, fsync_interval=1.0, max_file_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.max_file_bytes = max_file_bytes
+        self.written_rows = {}
+        self._refused_rows = {}
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._streams = {}
+        self._thread = None
+        self._created = time.strftime("%Y%m%d_%H%M%S")
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._write_session_info(complete=False)
+
+    def add_stream(self, name, dtype):
+        """
+        Register a stream before writing to it.
+
+        Args:
+        - name (str): Stream name, also the name of its sub-directory
+        - dtype (np.dtype): Structured dtype of the rows
+        """
+        dtype = np.dtype(dtype)
+        stream_dir = os.path.join(self.directory, name)
+        os.makedirs(stream_dir, exist_ok=True)
+        with open(os.path.join(stream_dir, 'dtype.json'), 'w') as f:
+            json.dump({'names': list(dtype.names),
+                       'formats': [dtype[name].str for name in dtype.names]}, f)
+        self._streams[name] = {'dtype': dtype, 'dir': stream_dir, 'file': None, 'index': -1}
+        self.written_rows[name] = 0
+        self._refused_rows[name] = 0
+        self._write_session_info(complete=False)
+
+    def start(self):
+        """Starts the writer thread."""
+        self._thread = threading.Thread(target=self._run, name='SessionWriter', daemon=True)
+        self._thread.start()
+        print(f"[SessionWriter] Writing session to {self.directory}")
+
+    def write(self, name, records, timeout=0.0):
+        """
+        Queue rows for writing.
+
+        Args:
+        - name (str): Registered stream name
+        - records (np.ndarray): Rows with the stream's dtype; must not be modified afterwards
+        - timeout (float): Seconds to wait for room in the queue, 0 never blocks, None waits as long as needed
+
+        Returns:
+        - bool: False if the queue stayed full and the rows were not queued
+        """
+        try:
+            self._queue.put((name, records), block=timeout is None or timeout > 0, timeout=timeout)
+        except queue.Full:
+            # The rows of a stream not yet queued, the next batch carries them again (see spill)
+            self._refused_rows[name] = len(records)
+            return False
+        self._refused_rows[name] = 0
+        return True
+
+    def spill(self, name, data, spilled, timeout=0.0):
+        """
+        Queue the rows of a growing table that were not queued yet.
+
+        Args:
+        - name (str): Registered stream name
+        - data (np.ndarray): The table so far, rows already written must not change (e.g. a GazeBuffer view)
+        - spilled (int): Number of rows of data already queued
+        - timeout (float): As for write(), None when the recording stops
+
+        Returns:
+        - int: The new number of rows queued, unchanged if the queue was full
+        """
+        if len(data) > spilled and self.write(name, data[spilled:], timeout):
+            return len(data)
+        return spilled
+
+    @property
+    def lost_rows(self):
+        """Rows refused by the full queue and not handed over again since."""
+        return sum(self._refused_rows.values())
+
+    def close(self):
+        """Flushes everything still queued, closes the files and marks the session complete."""
+        if self._thread is not None:
+            self._queue.put((None, None))
+            self._thread.join()
+            self._thread = None
+        self._write_session_info(complete=True)
+        if self.lost_rows:
+            print(f"[SessionWriter] Warning: {self.lost_rows} rows were refused by the full queue "
+                  f"and are missing from the files.")
+        print(f"[SessionWriter] Session closed: {self.written_rows}")
+
+    def _run(self):
+        last_sync = time.monotonic()
+        while True:
+            try:
+                name, records = self._queue.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                name, records = '', None
+            if name is None:
+                break
+            if records is not None:
+                try:
+                    self._write_chunk(name, records)
+                except Exception as e:
+                    print(f"[SessionWriter] Error writing stream '{name}': {e}")
+            if time.monotonic() - last_sync >= self.fsync_interval:
+                self._sync()
+                last_sync = time.monotonic()
+        self._sync(close=True)
+
+    def _write_chunk(self, name, records):
+        stream = self._streams[name]
+        payload = np.ascontiguousarray(records, dtype=stream['dtype']).tobytes()
+        f = stream['file']
+        if f is None or f.tell() + len(payload) > self.max_file_bytes:
+            self._rotate(stream)
+            f = stream['file']
+        f.write(CHUNK_HEADER.pack(CHUNK_MAGIC, len(payload), zlib.crc32(payload)))
+        f.write(payload)
+        self.written_rows[name] += len(records)
+
+    def _rotate(self, stream):
+        if stream['file'] is not None:
+            self._sync_file(stream['file'])
+            stream['file'].close()
+        stream['index'] += 1
+        path = os.path.join(stream['dir'], f"{stream['index']:06d}.chunk")
+        stream['file'] = open(path, 'ab')
+
+    def _sync(self, close=False):
+        for stream in list(self._streams.values()):
+            if stream['file'] is not None:
+                self._sync_file(stream['file'])
+                if close:
+                    stream['file'].close()
+                    stream['file'] = None
+
+    def _sync_file(self, f):
+        f.flush()
+        os.fsync(f.fileno())
+
+    def _write_session_info(self, complete):
+        info = {
+            'created': self._created,
+            'streams': sorted(self._streams),
+            'complete': complete,
+        }
+        path = os.path.join(self.directory, 'session.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(info, f)
+        os.replace(path + '.tmp', path)
+
+
+def read_stream(stream_dir):
+    """
+    Read back all valid chunks of one stream.
+
+    Args:
+    - stream_dir (str): Directory of the stream (contains dtype.json and *.chunk)
+
+    Returns:
+    - np.ndarray with every row that made it to disk intact
+    """
+    with open(os.path.join(stream_dir, 'dtype.json')) as f:
+        dtype = np.dtype(json.load(f))
+
+    parts = []
+    for filename in sorted(os.listdir(stream_dir)):
+        if not filename.endswith('.chunk'):
+            continue
+        path = os.path.join(stream_dir, filename)
+        with open(path, 'rb') as f:
+            data = f.read()
+        pos = 0
+        while pos + CHUNK_HEADER.size <= len(data):
+            magic, size, crc = CHUNK_HEADER.unpack_from(data, pos)
+            payload = data[pos + CHUNK_HEADER.size:pos + CHUNK_HEADER.size + size]
+            if magic != CHUNK_MAGIC or len(payload) != size or zlib.crc32(payload) != crc:
+                print(f"[SessionWriter] Truncated or corrupt chunk in {path} at byte {pos}, ignoring the rest.")
+                break
+            parts.append(np.frombuffer(payload, dtype=dtype))
+            pos += CHUNK_HEADER.size + size
+
+    if not parts:
+        return np.empty(0, dtype=dtype)
+    return np.concatenate(parts)
+
+
+def recover_session(directory):
+    """
+    Rebuild every stream of a (possibly crashed) session.
+
+    Args:
+    - directory (str): Session directory created by SessionWriter
+
+    Returns:
+    - dict mapping stream name to a structured array
+    """
+    streams = {}
+    for name in sorted(os.listdir(directory)):
+        stream_dir = os.path.join(directory, name)
+        if os.path.isfile(os.path.join(stream_dir, 'dtype.json')):
+            streams[name] = read_stream(stream_dir)
+    return streams
+
+
+if __name__ == "__main__":
+
+    # Usage: python SessionWriter.py <session_dir> [output.npz]
+    if len(sys.argv) < 2:
+        sys.exit("Usage: python SessionWriter.py <session_dir> [output.npz]")
+    session_dir = sys.argv[1]
+    output = sys.argv[2] if len(sys.argv) > 2 else os.path.normpath(session_dir) + '_recovered.npz'
+
+    recovered = recover_session(session_dir)
+    for name, rows in recovered.items():
+        print(f"[SessionWriter] {name}: {len(rows)} rows recovered")
+    np.savez(output, **recovered)
+    print(f"[SessionWriter] Recovered session saved to {output}")
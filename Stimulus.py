@@ -1,6 +1,8 @@
 import cv2
 import numpy as np
 import time
+from GazeBuffer import GazeBuffer, STIMULUS_DTYPE
+from ClockSync import now
 
 class Stimulus:
 
@@ -19,6 +21,12 @@ class Stimulus:
         # Randomization parameters
         self.min_display_time = 2  # minimum display time in seconds
         self.max_display_time = 5  # maximum display time in seconds
+        self.blank_time = 1  # blank screen between stimuli in seconds
+
+        # Scheduler: sleep in the HighGUI event loop until spin_time before the deadline, then spin.
+        # spin_time grows to the worst overshoot of a waitKey() slice (see measure_wait_overshoot)
+        self.spin_time = 0.002
+        self.max_sleep = 0.010
 
         # Data recording
         self.stimulus_data = {
@@ -26,6 +34,37 @@ class Stimulus:
             'stimulus_positions': [],
             'stimulus_offsets_cm': []
         }
+        # Per-trial timing: scheduled onset, imshow() call, actual onset, actual display duration
+        self.timing = {
+            'target_onsets': [],
+            'issued': [],
+            'onsets': [],
+            'display_times': [],
+            'durations': []
+        }
+        # Onsets as STIMULUS_DTYPE rows for the session writer, _spilled of them handed over
+        self.stimulus_rows = GazeBuffer(STIMULUS_DTYPE, capacity=256, chunk_size=256)
+        self.session_writer = None
+        self._spilled = 0
+
+        # Pre-render every screen once, presentation only blits a cached frame
+        self.blank_screen = np.full((self.screen_height, self.screen_width, 3), 255, dtype=np.uint8)
+        self.frames = {offset_pixel: self.create_stimulus_screen(offset_pixel) for offset_pixel in self.offset_pixel}
+
+    def attach_writer(self, session_writer):
+        """
+        Stream the stimulus onsets to disk, each one during the blank screen after it.
+
+        Args:
+        - session_writer (SessionWriter): Writer the 'stimulus' stream is added to
+        """
+        session_writer.add_stream('stimulus', STIMULUS_DTYPE)
+        self.session_writer = session_writer
+
+    def _spill(self, timeout=0.0):
+        # If the writer queue is full the rows stay unspilled and go with the next onset
+        if self.session_writer is not None:
+            self._spilled = self.session_writer.spill('stimulus', self.stimulus_rows.view(), self._spilled, timeout)
 
     
     def create_stimulus_screen(self, offset_pixel):
@@ -51,7 +90,105 @@ class Stimulus:
         cv2.circle(screen, (point_x, point_y), 20, (0, 0, 255), -1)
         
         return screen
-    
+
+    def show(self, screen):
+        """
+        Display a screen and return its onset time.
+
+        imshow() only queues the image, it is drawn by the HighGUI event loop,
+        so the onset is taken after waitKey(1) has processed the redraw.
+
+        Returns:
+        - (time imshow() was called, onset, key pressed or -1), times in the ClockSync.now() timebase
+        """
+        issued = now()
+        cv2.imshow('Stimulus Presentation', screen)
+        key = cv2.waitKey(1) & 0xFF
+        return issued, now(), key
+
+    def measure_wait_overshoot(self, samples=10):
+        """
+        Measure how long cv2.waitKey(1) oversleeps and spin at least that long.
+
+        A waitKey() slice ends on the next tick of the OS timer, e.g. up to
+        15.6 ms late with the default Windows timer, so a slice started less
+        than the overshoot before the deadline would miss it. Call once the
+        window exists; wait_until() keeps raising spin_time if a later slice
+        oversleeps more.
+
+        Args:
+        - samples (int): Number of waitKey(1) calls timed
+
+        Returns:
+        - float: Worst overshoot (s)
+        """
+        overshoot = 0.0
+        for _ in range(samples):
+            start = now()
+            cv2.waitKey(1)
+            overshoot = max(overshoot, now() - start - 0.001)
+        self.spin_time = max(self.spin_time, overshoot)
+        return overshoot
+
+    def wait_until(self, deadline):
+        """
+        Wait until deadline (ClockSync.now() timebase) while handling window events.
+
+        The coarse part of the wait sleeps inside cv2.waitKey() in slices of
+        at most max_sleep, so the CPU stays free for the tracker callbacks.
+        The last spin_time seconds are spun on the clock, which waitKey() and
+        sleep() cannot hit with sub-millisecond accuracy; spin_time covers the
+        worst overshoot of a slice seen so far.
+
+        Returns:
+        - False if 'q' was pressed, True otherwise
+        """
+        while True:
+            remaining = deadline - now()
+            if remaining <= self.spin_time:
+                break
+            sleep_ms = max(int((min(remaining - self.spin_time, self.max_sleep)) * 1000), 1)
+            start = now()
+            key = cv2.waitKey(sleep_ms) & 0xFF
+            self.spin_time = max(self.spin_time, now() - start - sleep_ms / 1000)
+            if key == ord('q'):
+                return False
+        while now() < deadline:
+            pass
+        return True
+
+    def timing_stats(self):
+        """
+        Onset timing statistics in milliseconds.
+
+        - schedule_error: imshow() call - scheduled onset (scheduler accuracy)
+        - onset_jitter: actual onset - scheduled onset (adds the redraw latency)
+        - duration_error: actual - requested display time
+
+        Returns:
+        - dict (JSON-serializable), empty if no stimulus was shown
+        """
+        if not self.timing['onsets']:
+            return {}
+        target = np.array(self.timing['target_onsets'])
+        schedule = (np.array(self.timing['issued']) - target) * 1000
+        jitter = (np.array(self.timing['onsets']) - target) * 1000
+        stats = {
+            'trials': len(jitter),
+            'schedule_error_mean_ms': float(np.mean(schedule)),
+            'schedule_error_max_ms': float(np.max(np.abs(schedule))),
+            'onset_jitter_mean_ms': float(np.mean(jitter)),
+            'onset_jitter_std_ms': float(np.std(jitter)),
+            'onset_jitter_p95_ms': float(np.percentile(np.abs(jitter), 95)),
+            'onset_jitter_max_ms': float(np.max(np.abs(jitter))),
+        }
+        if self.timing['durations']:
+            n = len(self.timing['durations'])
+            error = (np.array(self.timing['durations']) - np.array(self.timing['display_times'][:n])) * 1000
+            stats['duration_error_mean_ms'] = float(np.mean(error))
+            stats['duration_error_max_ms'] = float(np.max(np.abs(error)))
+        return stats
+
     def stimulus_loop(self, num_sequence):
         """
         Loop through the stimulus points and display them on the screen.
@@ -99,34 +236,60 @@ class Stimulus:
             cv2.namedWindow('Stimulus Presentation', cv2.WINDOW_NORMAL)
             cv2.setWindowProperty('Stimulus Presentation', cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
             cv2.setWindowProperty('Stimulus Presentation', cv2.WND_PROP_TOPMOST, 1)
+            self.measure_wait_overshoot()
             
+            # Start from a blank screen so the first onset is scheduled like the others
+            _, blank_time, _ = self.show(self.blank_screen)
+            target_onset = blank_time + self.blank_time
             for _ in range(num_sequence):
                 for offset_cm, offset_pixel in zip(self.offset_cm, self.offset_pixel): #zip() allows us to iterate over two lists simultaneously:
 
-                stimulus_screen = self.create_stimulus_screen(offset_pixel)
-                cv2.imshow('Stimulus Presentation', stimulus_screen)
+                    #Random_display_time
+                    display_time = np.random.uniform(self.min_display_time, self.max_display_time)
 
-                #Random_display_time
-                display_time = np.random.uniform(self.min_display_time, self.max_display_time)
-                
-                # Record stimulus presentation data
-                start_time = time.time()
-                self.stimulus_data['timestamps'].append(start_time)
-                self.stimulus_data['stimulus_positions'].append(offset_pixel)
-                self.stimulus_data['stimulus_offsets_cm'].append(offset_cm)
-                
-                # Wait for specified time or key press
-                start_wait = time.time()
-                while time.time() - start_wait < display_time:
-                    if cv2.waitKey(1) & 0xFF == ord('q'):
-                        cv2.destroyAllWindows()
-                        return self.stimulus_data
-                
-                # Blank screen between stimuli
-                blank_screen = np.full((self.screen_height, self.screen_width, 3), 255, dtype=np.uint8)
-                cv2.imshow('Stimulus Presentation', blank_screen)
-                cv2.waitKey(1000)  # 1-second break between stimuli
-        
+                    if not self.wait_until(target_onset):
+                        return self._finish()
+                    issued, start_time, key = self.show(self.frames[offset_pixel])
+
+                    # Record stimulus presentation data
+                    self.stimulus_data['timestamps'].append(start_time)
+                    self.stimulus_data['stimulus_positions'].append(offset_pixel)
+                    self.stimulus_data['stimulus_offsets_cm'].append(offset_cm)
+                    self.timing['target_onsets'].append(target_onset)
+                    self.timing['issued'].append(issued)
+                    self.timing['onsets'].append(start_time)
+                    self.timing['display_times'].append(display_time)
+                    self.stimulus_rows.append((start_time, offset_pixel, offset_cm))
+
+                    # Wait for specified time or key press
+                    if key == ord('q') or not self.wait_until(start_time + display_time):
+                        return self._finish()
+
+                    # Blank screen between stimuli
+                    _, blank_time, key = self.show(self.blank_screen)
+                    self.timing['durations'].append(blank_time - start_time)
+                    if key == ord('q'):
+                        return self._finish()
+                    target_onset = blank_time + self.blank_time
+                    # Out of the timed path: the onset is on screen, the next one is a blank time away
+                    self._spill()
+
+        except Exception as e:
+            # Close the fullscreen window, the error is for the caller
+            print(f"[Stimulus] Error during stimulus presentation: {e}")
+            cv2.destroyAllWindows()
+            raise
+
+        return self._finish()
+
+    def _finish(self):
+        self._spill(timeout=None)
+        stats = self.timing_stats()
+        if stats:
+            print(f"[Stimulus] {stats['trials']} trials, schedule error max "
+                  f"{stats['schedule_error_max_ms']:.3f} ms, onset jitter "
+                  f"{stats['onset_jitter_mean_ms']:.3f} +/- {stats['onset_jitter_std_ms']:.3f} ms "
+                  f"(max {stats['onset_jitter_max_ms']:.3f} ms)")
         cv2.destroyAllWindows()
         return self.stimulus_data
                 
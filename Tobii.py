@@ -1,11 +1,17 @@
 #Code relative to the tobii
 
-import tobii_research as tr
 import time
 import sys
 import os
 import cv2
 import numpy as np
+from GazeBuffer import GazeBuffer, TOBII_DTYPE, MARKER_DTYPE, tobii_record
+from ClockSync import ClockSync, now
+from Metrics import Metrics
+from EventDetector import binocular_gaze
+
+# Points of the short validation (normalized display coordinates)
+VALIDATION_POINTS = [(0.3, 0.3), (0.7, 0.3), (0.7, 0.7), (0.3, 0.7)]
 
 class Tobii:
 
@@ -13,55 +19,82 @@ class Tobii:
     #gaze_data =[]
     
 
-    def __init__(self):
+    def __init__(self, backend=None):
+
+        """
+        Connects to the first eye tracker found.
 
+        Args:
+        - backend: Module providing the tobii_research API, defaults to tobii_research
+          (FakeDevices.FakeTobiiResearch simulates a tracker without hardware)
+        """
+        if backend is None:
+            import tobii_research as backend
+        self.tr = backend
         self.my_eyetracker = None
-        self.gaze_data = []
+        self.gaze_data = GazeBuffer(TOBII_DTYPE)
+        self.markers = GazeBuffer(MARKER_DTYPE, capacity=256, chunk_size=256)
         self._recording = False
         self._subscription_handle = None
+        self.session_writer = None
+        self.event_detector = None
+        self.spill_batch = 120
+        self._spilled = 0
+        self._markers_spilled = 0
+        # Time the callback holds the SDK thread, sample counters (see Metrics)
+        self.metrics = Metrics()
+        self._callback_time = self.metrics.stage('callback').record
         
         
-        found_eyetrackers = tr.find_all_eyetrackers()
+        found_eyetrackers = self.tr.find_all_eyetrackers()
         try:
            self.my_eyetracker = found_eyetrackers[0]
            print("Address: " + self.my_eyetracker.address)
            print("Model: " + self.my_eyetracker.model)
            print("Name (It's OK if this is empty): " + self.my_eyetracker.device_name)
+           # Maps the tracker clocks onto the common timebase of all streams
+           self.clock = ClockSync(self.my_eyetracker, backend=self.tr)
 
         except IndexError:
         #my_eyetracker = None # No eyetracker found, set to None
            sys.exit("No eyetracker found")
         #print("No eyetracker found")
     
-    def calibrate(self, calibration_points, screen_width, screen_height, point_radius, wait_time):
+    def calibrate(self, calibration_points, screen_width, screen_height, point_radius, wait_time, on_point=None):
+
+        """
+        Run the screen-based calibration and apply it.
+
+        Args:
+        - calibration_points (list): (x, y) points in normalized display coordinates
+        - screen_width, screen_height (int): Size of the window in pixels
+        - point_radius (int): Radius of the points in pixels
+        - wait_time (float): Seconds each point is shown before its data is collected
+        - on_point (callable): Called as on_point(x, y, shown, collected) after every point
+          (now() timebase), e.g. to calibrate the webcam on the same sequence (see GazeMapping)
+
+        Returns:
+        - bool: True if the calibration succeeded
+        """
 
         if self.my_eyetracker is None: # Check if eyetracker is initialized before calibration
             print("[Tobii] No eyetracker available. Calibration cannot be started.")
             return
 
-        calibration = tr.ScreenBasedCalibration(self.my_eyetracker)
+        calibration = self.tr.ScreenBasedCalibration(self.my_eyetracker)
         # Enter calibration mode.
         calibration.enter_calibration_mode()
         print(f"[Tobii] Entered calibration mode for eye tracker with serial number {self.my_eyetracker.serial_number}.") # Added serial number for clarity
         
         #Create an OpenCV window
-        cv2.namedWindow("Calibration", cv2.WINDOW_NORMAL)
-        cv2.resizeWindow("Calibration", screen_width, screen_height)
+        window_name = "Calibration"
+        cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
+        cv2.resizeWindow(window_name, screen_width, screen_height)
         #Start collecting data for the calibration points
         for i, (x,y) in enumerate(calibration_points, start=1):
-            px = int(x * screen_width)
-            py = int(y * screen_height)
-            
-            background = np.full((screen_height, screen_width, 3), 255, dtype=np.uint8)
-            #Create the points in the screen
-            # Draw the calibration circle
-            cv2.circle(background, (px, py), point_radius, (0, 0, 255), -1)
-
             msg = f"Point {i}/{len(calibration_points)} at ({x:.2f}, {y:.2f})"
-            cv2.putText(background, msg, (50, 50),
-                        cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0,0,0), 2)
-            cv2.imshow(window_name, background)
-            cv2.waitKey(1)  # update the window
+            self._show_point(window_name, x, y, screen_width, screen_height, point_radius, msg)
+            shown = now()
 
             # Wait for wait_time seconds so user can fixate
             start_time = time.time()
@@ -73,11 +106,13 @@ class Tobii:
             status = calibration.collect_data(x, y)
             print(f"Collect data at ({x:.2f}, {y:.2f}) => {status}")    
                         
-            if status != tr.CALIBRATION_STATUS_SUCCESS:
+            if status != self.tr.CALIBRATION_STATUS_SUCCESS:
                     # Try again if collection fails
-                print(f"[Tobii] Collection failed for point {point}, trying again...")
+                print(f"[Tobii] Collection failed for point ({x:.2f}, {y:.2f}), trying again...")
                 time.sleep(1) # Wait for the data to be collected
                 status = calibration.collect_data(x, y)   
+            if on_point is not None:
+                on_point(x, y, shown, now())
            
             
         
@@ -90,59 +125,228 @@ class Tobii:
         calibration.leave_calibration_mode()
         print("Left calibration mode.")
         cv2.destroyWindow(window_name)
-        return calibration_result.status == tr.CALIBRATION_STATUS_SUCCESS
+        return calibration_result.status == self.tr.CALIBRATION_STATUS_SUCCESS
 
+    @staticmethod
+    def _show_point(window_name, x, y, screen_width, screen_height, point_radius, msg):
+        background = np.full((screen_height, screen_width, 3), 255, dtype=np.uint8)
+        #Create the points in the screen
+        cv2.circle(background, (int(x * screen_width), int(y * screen_height)), point_radius, (0, 0, 255), -1)
+        cv2.putText(background, msg, (50, 50),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0,0,0), 2)
+        cv2.imshow(window_name, background)
+        cv2.waitKey(1)  # update the window
 
-        
-      
-    def read_calibration(self):
-        #Read the calibration
-        filename = "saved_calibration.bin"
-        
-        with open(filename, "wb") as f:
-            calibration_data = eyetracker.retrieve_calibration_data()
-            if calibration_data is not None:
-                f.write(calibration_data)
-            else:
-                print("No calibration data found.")
-            
-        print("Calibration data saved to", filename)
-
-        with open(filename, "rb") as f:
-            calibration_data = f.read()
-            if len(calibration_data) > 0:
-                eyetracker.apply_calibration_data(calibration_data)
-                print("Calibration data loaded from", filename)
-            else:
-                print("No calibration data found in", filename)
-                
+    def validate(self, validation_points, screen_width, screen_height, point_radius, wait_time=1.5, settle_time=0.5):
+
+        """
+        Show points and measure how far from them the gaze lands.
+
+        Runs outside of a recording on its own gaze subscription, so nothing
+        ends up in the recorded data. The error of a point is the distance of
+        the mean gaze (both eyes) from the point on the display area, as an
+        angle seen from the mean eye distance.
+
+        Args:
+        - validation_points (list): (x, y) points in normalized display coordinates
+        - screen_width, screen_height (int): Size of the window in pixels
+        - point_radius (int): Radius of the points in pixels
+        - wait_time (float): Seconds each point is shown
+        - settle_time (float): Seconds at the start of each point that are not used
+
+        Returns:
+        - float: Mean error in degrees of visual angle (nan without valid gaze)
+        """
+        if self.my_eyetracker is None or self._recording:
+            print("[Tobii] Validation needs a tracker that is not recording.")
+            return float('nan')
+
+        samples = []
+
+        def collect(gaze_data):
+            # Mean of the valid eyes: time, display x, y and eye distance (mm)
+            eyes = [gaze_data[eye + '_gaze_point_on_display_area'] + (gaze_data[eye + '_gaze_origin_in_user_coordinate_system'][2],)
+                    for eye in ('left', 'right') if gaze_data[eye + '_gaze_point_validity']]
+            if eyes:
+                samples.append((now(),) + tuple(sum(values) / len(eyes) for values in zip(*eyes)))
+
+        window_name = "Validation"
+        cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
+        cv2.resizeWindow(window_name, screen_width, screen_height)
+        self.my_eyetracker.subscribe_to(self.tr.EYETRACKER_GAZE_DATA, collect, as_dictionary=True)
+        windows = []
         try:
-            os.remove(filename)
-        except OSError:
-            print("No file found")
-            pass
+            for i, (x, y) in enumerate(validation_points, start=1):
+                self._show_point(window_name, x, y, screen_width, screen_height, point_radius,
+                                 f"Validation {i}/{len(validation_points)}")
+                shown = now()
+                while now() - shown < wait_time:
+                    cv2.waitKey(1)
+                windows.append((shown + settle_time, shown + wait_time))
+        finally:
+            self.my_eyetracker.unsubscribe_from(self.tr.EYETRACKER_GAZE_DATA, collect)
+            cv2.destroyWindow(window_name)
+
+        area = self.my_eyetracker.get_display_area()
+        data = np.array(samples, dtype=np.float64).reshape(-1, 4)
+        errors = []
+        for (x, y), (start, end) in zip(validation_points, windows):
+            points = data[(data[:, 0] >= start) & (data[:, 0] < end)]
+            if not len(points):
+                continue
+            gaze_x, gaze_y, distance = points[:, 1:].mean(axis=0)
+            offset = np.hypot((gaze_x - x) * area.width, (gaze_y - y) * area.height)
+            errors.append(np.degrees(np.arctan2(offset, distance)))
+        if len(errors) < len(validation_points):
+            print(f"[Tobii] No valid gaze on {len(validation_points) - len(errors)} validation point(s).")
+        error = float(np.mean(errors)) if errors else float('nan')
+        print(f"[Tobii] Validation error: {error:.2f} deg")
+        return error
+
+    def restore_calibration(self, store, participant_id, screen, max_error=None):
+
+        """
+        Apply the newest stored calibration of a participant (see CalibrationStore).
+
+        Args:
+        - store (CalibrationStore): Store of calibrations
+        - participant_id (str): Participant the calibration belongs to
+        - screen (tuple): Screen geometry the calibration was made on
+        - max_error (float): Only use calibrations validated with at most this error (degrees)
+
+        Returns:
+        - dict: The store entry that was applied, or None
+        """
+        start = now()
+        entry = store.find(self.my_eyetracker.serial_number, participant_id, screen, max_error)
+        if entry is None:
+            return None
+        self.my_eyetracker.apply_calibration_data(store.load(entry))
+        print(f"[Tobii] Calibration of {entry['created_at']} restored in {(now() - start) * 1000:.1f} ms.")
+        return entry
+
+    def store_calibration(self, store, participant_id, screen, score=None):
+
+        """
+        Save the calibration currently applied on the tracker.
+
+        Returns:
+        - dict: The new store entry, or None if the tracker has no calibration
+        """
+        calibration_data = self.my_eyetracker.retrieve_calibration_data()
+        if not calibration_data:
+            print("[Tobii] No calibration data found.")
+            return None
+        return store.save(self.my_eyetracker.serial_number, participant_id, screen, calibration_data, score)
+
+    def ensure_calibration(self, store, participant_id, calibration_points, screen_width, screen_height,
+                           point_radius, wait_time, validate=True, max_error=1.0, validation_points=VALIDATION_POINTS,
+                           on_point=None):
+
+        """
+        Calibrate a participant, reusing a stored calibration when possible.
+
+        A recent calibration of this participant on this tracker and screen is
+        applied straight away. With validate, a short validation checks it, its
+        score is updated, and the full calibration only runs if the error is
+        above max_error; without, only a calibration scored within max_error is
+        reused. A new calibration is validated and only stored if its error is
+        within max_error; otherwise it is not reused and False is returned.
+
+        Args:
+        - store (CalibrationStore): Store of calibrations
+        - participant_id (str): Participant id
+        - calibration_points, screen_width, screen_height, point_radius, wait_time: As for calibrate()
+        - validate (bool): Validate a restored calibration before using it
+        - max_error (float): Largest accepted validation error in degrees
+        - validation_points (list): Points of the validation
+        - on_point (callable): Passed to calibrate(), only called if a full calibration runs
+
+        Returns:
+        - bool: True if the tracker is calibrated (and validated within max_error)
+        """
+        screen = (screen_width, screen_height)
+        entry = self.restore_calibration(store, participant_id, screen, None if validate else max_error)
+        if entry is not None:
+            if not validate:
+                return True
+            error = self.validate(validation_points, screen_width, screen_height, point_radius)
+            # A bad score keeps the entry from being restored unvalidated later
+            store.set_score(entry, error)
+            if error <= max_error:
+                return True
+            print(f"[Tobii] Stored calibration is off by {error:.2f} deg, recalibrating.")
+
+        if not self.calibrate(calibration_points, screen_width, screen_height, point_radius, wait_time, on_point):
+            return False
+        error = self.validate(validation_points, screen_width, screen_height, point_radius)
+        if not error <= max_error:  # also catches a validation without valid samples (NaN)
+            print(f"[Tobii] New calibration is off by {error:.2f} deg (max {max_error:.2f}), not storing it.")
+            return False
+        self.store_calibration(store, participant_id, screen, error)
+        return True
         
     def gaze_data_callback(self, gaze_data):
 
-        gaze_data['system_timestamp'] = time.time()
-        self.gaze_data.append(gaze_data)
+        start = now()
+        # Unpack straight into the columnar buffer, the SDK dict is not kept.
+        # The SDK's own system time stamp is converted instead of reading a clock
+        # here, so callback scheduling jitter does not end up in the data.
+        timestamp = self.clock.system_to_common(gaze_data['system_time_stamp'])
+        self.gaze_data.append(tobii_record(gaze_data, timestamp))
+        self.metrics.count('samples')
+        if not (gaze_data['left_gaze_point_validity'] and gaze_data['right_gaze_point_validity']):
+            self.metrics.count('invalid_samples')
+        if self.event_detector is not None:
+            x, y = binocular_gaze(gaze_data)
+            self.event_detector.add(timestamp, x, y)
+        if self.session_writer is not None and len(self.gaze_data) - self._spilled >= self.spill_batch:
+            self._spill()
+        self._callback_time(now() - start)
         #left_gaze = gaze_data['left_gaze_point_on_display_area']
         #right_gaze = gaze_data['right_gaze_point_on_display_area']
     
-    def add_marker(self, marker):
+    def add_marker(self, marker, timestamp=None):
 
         """
-        Add a custom marker to the gaze data
-        
+        Add a custom marker to the marker table
+
         Args:
         - marker_type (str): Type of marker (e.g., 'STIMULUS_START', 'STIMULUS_END')
+        - timestamp (float): Time of the marker, now() by default (replays pass the recorded time)
+        """
+        self.markers.append((now() if timestamp is None else timestamp, len(self.gaze_data), marker))
+        if self.session_writer is not None:
+            self._markers_spilled = self.session_writer.spill('tobii_markers', self.markers.view(),
+                                                              self._markers_spilled)
+
+    def attach_detector(self, event_detector):
         """
-        marker_data = {
-            'type': 'marker',
-            'marker_type': marker,
-            'system_timestamp': time.time()
-        }
-        self.gaze_data.append(marker_data)
+        Classify the gaze into fixations, saccades and blinks while recording.
+
+        Args:
+        - event_detector (EventDetector): Detector fed from the gaze callback; it is
+          reset when a recording starts and flushed when it stops
+        """
+        self.event_detector = event_detector
+
+    def attach_writer(self, session_writer, spill_batch=120):
+        """
+        Stream samples and markers to disk while recording.
+
+        Args:
+        - session_writer (SessionWriter): Writer the 'tobii' and 'tobii_markers' streams are added to
+        - spill_batch (int): Number of samples handed to the writer at once
+        """
+        session_writer.add_stream('tobii', TOBII_DTYPE)
+        session_writer.add_stream('tobii_markers', MARKER_DTYPE)
+        self.session_writer = session_writer
+        self.spill_batch = spill_batch
+
+    def _spill(self, timeout=0.0):
+        # Rows of the buffer are never rewritten, so the view can be queued as is.
+        # If the writer queue is full the rows stay unspilled and go with the next batch
+        self._spilled = self.session_writer.spill('tobii', self.gaze_data.view(), self._spilled, timeout)
     
     def start_recording(self):
 
@@ -155,14 +359,21 @@ class Tobii:
 
         # Clear out old data if desired
         self.gaze_data.clear()
-
-        self._subscription_handle = self.my_eyetracker.subscribe_to(
-            tr.EYETRACKER_GAZE_DATA,
+        self.markers.clear()
+        self._spilled = 0
+        self._markers_spilled = 0
+        if self.event_detector is not None:
+            self.event_detector.reset()
+
+        self.clock.start()
+        self.my_eyetracker.subscribe_to(
+            self.tr.EYETRACKER_GAZE_DATA,
             self.gaze_data_callback,
             as_dictionary=True
         )
         self._recording = True
-        self._subscription_handle = True
+        # The SDK identifies a subscription by its callback
+        self._subscription_handle = self.gaze_data_callback
         print("[Tobii] Started recording (subscribed to gaze data).")
 
     def stop_recording(self):
@@ -175,17 +386,29 @@ class Tobii:
             return
 
         self.my_eyetracker.unsubscribe_from(
-            tr.EYETRACKER_GAZE_DATA,
+            self.tr.EYETRACKER_GAZE_DATA,
             self._subscription_handle
         )
         self._subscription_handle = None
         self._recording = False
+        self.clock.stop()
+        if self.event_detector is not None:
+            self.event_detector.flush()
+        if self.session_writer is not None:
+            # The tail of the recording waits for room in the queue instead of being left out
+            self._spill(timeout=None)
+            self._markers_spilled = self.session_writer.spill('tobii_markers', self.markers.view(),
+                                                              self._markers_spilled, timeout=None)
         print("[Tobii] Stopped recording (unsubscribed).")
 
     
     def get_data(self):
-        """Returns the collected gaze data."""
-        return self.gaze_data
+        """Returns a zero-copy view (structured array) of the collected gaze data."""
+        return self.gaze_data.view()
+
+    def get_markers(self):
+        """Returns a zero-copy view of the marker table."""
+        return self.markers.view()
 
 
 
@@ -201,7 +424,7 @@ if __name__ == "__main__":
 
     pass
     
-    #tobii.read_calibration()
+    #tobii.ensure_calibration(CalibrationStore(), participant_id, calibration_points, 1920, 1200, 5, 2)
 
       
 
@@ -0,0 +1,107 @@
+#Raw video recording on a background encoder thread
+
+import os
+import queue
+import threading
+
+import cv2
+import numpy as np
+
+
+# Sidecar written next to the video: one row per encoded frame
+FRAME_TIMESTAMP_DTYPE = np.dtype([
+    ('frame_index', 'i8'),
+    ('system_timestamp', 'f8'),
+])
+
+
+def timestamps_path(video_path):
+    """Returns the path of the per-frame timestamp sidecar of a video."""
+    return video_path + '.timestamps.npy'
+
+
+def load_frame_timestamps(video_path):
+    """
+    Load the grab timestamps recorded with a video.
+
+    Returns:
+    - np.ndarray with FRAME_TIMESTAMP_DTYPE (row k belongs to frame k of the file), or None
+    """
+    path = timestamps_path(video_path)
+    if not os.path.exists(path):
+        return None
+    return np.load(path)
+
+
+class VideoRecorder:
+
+    """
+    Encode the raw camera frames to a video file without slowing down capture.
+
+    write() is called from the capture thread and only queues the frame;
+    a background thread encodes it with cv2.VideoWriter. If the encoder
+    falls behind, frames are dropped (and counted) instead of blocking the
+    capture. The grab timestamp of every encoded frame is saved next to the
+    video when the recorder is closed.
+
+    Args:
+    - path (str): Output video file
+    - fps (float): Nominal frame rate written in the file
+    - frame_size (tuple): (width, height) of the frames
+    - fourcc (str): Codec, MJPG keeps every frame seekable for offline reprocessing
+    - queue_size (int): Frames buffered between capture and the encoder
+    """
+
+    def __init__(self, path, fps, frame_size, fourcc='MJPG', queue_size=64):
+        self.path = path
+        self.fps = fps
+        self.frame_size = frame_size
+        self.fourcc = fourcc
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._timestamps = []
+        self._writer = None
+        self._thread = None
+
+    def start(self):
+        """Opens the video file and starts the encoder thread."""
+        self._writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.fourcc), self.fps, self.frame_size)
+        if not self._writer.isOpened():
+            print(f"[VideoRecorder] Could not open {self.path} for writing.")
+            self._writer = None
+            return False
+        self._thread = threading.Thread(target=self._run, name='VideoRecorder', daemon=True)
+        self._thread.start()
+        print(f"[VideoRecorder] Recording raw video to {self.path}")
+        return True
+
+    def write(self, frame_index, timestamp, frame):
+        """Queues one frame (never blocks). The frame must not be modified afterwards."""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put_nowait((frame_index, timestamp, frame))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """Encodes the queued frames, closes the file and saves the timestamps."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._writer.release()
+        np.save(timestamps_path(self.path), np.array(self._timestamps, dtype=FRAME_TIMESTAMP_DTYPE))
+        print(f"[VideoRecorder] {self.written} frames written, {self.dropped} dropped.")
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            frame_index, timestamp, frame = item
+            self._writer.write(frame)
+            self._timestamps.append((frame_index, timestamp))
+            self.written += 1
@@ -1,13 +1,22 @@
 #Code relative to the webcam
 
 import cv2
-import mediapipe as mp
 import numpy as np
 import time
 import csv
 import random
 import sys
-import matplotlib.pyplot as plt
+import threading
+import os
+from concurrent.futures import ProcessPoolExecutor
+from GazeBuffer import GazeBuffer, WEBCAM_DTYPE, MARKER_DTYPE, CONTOUR_DTYPE
+from FramePipeline import FramePipeline, DROP_OLDEST
+from FaceRoi import FaceRoi
+from VideoRecorder import VideoRecorder, load_frame_timestamps
+from ClockSync import now
+from Metrics import Metrics
+from LandmarkBackends import BACKENDS, FaceMeshBackend, CascadeBackend, AdaptiveBackend
+from Filters import PerEyeFilter
 
 
 # ========================
@@ -16,191 +25,689 @@ import matplotlib.pyplot as plt
 SCREEN_WIDTH_CM = 25.0
 VIEWING_DISTANCE_CM = 25.0
 
+# FaceMesh landmark indices (refine_landmarks=True). MediaPipe names the eyes
+# from the participant's point of view: 468 is the right iris, 473 the left one.
+RIGHT_IRIS = 468
+LEFT_IRIS = 473
+RIGHT_EYE_CONTOUR = [33, 7, 163, 144, 145, 153, 154, 155, 133, 173, 157, 158, 159, 160, 161, 246]
+LEFT_EYE_CONTOUR = [263, 249, 390, 373, 374, 380, 381, 382, 362, 398, 384, 385, 386, 387, 388, 466]
+
+
+def _mediapipe():
+    # MediaPipe takes seconds to import, it is only loaded when the first FaceMesh is created
+    import mediapipe as mp
+    return mp
+
 
 class Webcam():
 
-    def __init__(self, cam_index=0, show_preview=True):
-        """Initializes the webcam and MediaPipe."""
+    def __init__(self, cam_index=0, show_preview=True, num_workers=1, queue_size=4, drop_policy=DROP_OLDEST,
+                 preview_every=1, eye_contours=False, roi_tracking=False, roi_width=256, record_video=None,
+                 smoothing=None, backend='face_mesh', frame_budget=1 / 30):
+        """
+        Initializes the webcam settings. The camera and MediaPipe are loaded by prepare()
+        or when the recording starts.
+
+        Args:
+        - cam_index (int): Index of the camera for cv2.VideoCapture, a video file, or a
+          callable returning a VideoCapture-like source (see MultiCamera.VideoFileSource)
+        - show_preview (bool): Show the annotated frames in a window. When False the
+          recording runs headless: no drawing, no window and no flipped copies of the frame
+        - num_workers (int): Number of FaceMesh inference threads
+        - queue_size (int): Frames buffered between capture and inference
+        - drop_policy (str): 'drop_oldest', 'keep_latest' or 'block' when inference falls behind
+        - preview_every (int): Only draw and show every Nth frame of the preview
+        - eye_contours (bool): Also record the 16 contour landmarks of each eye
+        - roi_tracking (bool): Run FaceMesh on a downscaled crop around the previous face
+        - roi_width (int): Width the face crop is downscaled to in ROI mode
+        - record_video (str): Also record the raw frames (and their grab timestamps) to this video file
+        - smoothing (GazeFilter): Filter applied to every sample as it is recorded, each eye
+          on its own (see Filters.PerEyeFilter); the smoothed positions are kept next to
+          the raw ones (get_smoothed_data)
+        - backend (str): Landmark backend (see LandmarkBackends): 'face_mesh', 'cascade'
+          (OpenCV Haar cascades and pupil centroids: much cheaper, irises only, no ROI tracking)
+          or 'adaptive' (FaceMesh, switching to the cascade or skipping frames when the
+          landmark step takes more than frame_budget); every sample records its backend
+        - frame_budget (float): Seconds of landmark step per frame (wall time) for the 'adaptive' backend
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown landmark backend '{backend}', expected one of {BACKENDS}")
         self.cam_index = cam_index
         self.show_preview = show_preview
+        self.preview_every = max(1, preview_every)
+        self.eye_contours = eye_contours
+        self.roi_tracking = roi_tracking
+        self.roi_width = roi_width
+        self.rois = []
+        self.backend = backend
+        self.frame_budget = frame_budget
+        self.backends = []
+        self.record_video = record_video
+        self.video_recorder = None
+        self.num_workers = num_workers
+        self.queue_size = queue_size
+        self.drop_policy = drop_policy
+        self.pipeline = None
+        self._preview_frame = None
+        self._stop_event = threading.Event()
         self.cap = None
         self.frame_width = None
         self.frame_height = None
-        #Mediapipe set-up
-        self.mp_face_mesh = mp.solutions.face_mesh
-        self.mp_drawing = mp.solutions.drawing_utils
+        #Mediapipe set-up (imported on first use, see _create_face_mesh)
+        self.mp_face_mesh = None
+        self.mp_drawing = None
         self.face_mesh = None # Initialize later
-        
-        self.drawing_spec = mp.solutions.drawing_utils.DrawingSpec(thickness=1, circle_radius=1)
+        self.drawing_spec = None
+        # Frame processors warmed up by prepare(), taken by the pipeline workers first
+        self._prepared = []
+        self.startup = {}
         #self.drawing_styles = mp.solutions.drawing_styles
-        self.gaze_data = {  
-            'timestamps': [],
-            'right_eye_x': [],
-            'right_eye_y': [],
-            'left_eye_x': [],
-            'left_eye_y': [],
-            'markers': []  # Changed from 'marker' to 'markers'
-            }                    #(t,x,y)
+        # Iris positions (t, x, y per eye) and markers are kept in separate tables
+        self.gaze_data = GazeBuffer(WEBCAM_DTYPE, capacity=32768, chunk_size=32768)
+        self.markers = GazeBuffer(MARKER_DTYPE, capacity=256, chunk_size=256)
+        self.contours = GazeBuffer(CONTOUR_DTYPE, capacity=4096, chunk_size=32768) if eye_contours else None
+        self.smoothing = PerEyeFilter(smoothing) if smoothing is not None else None
+        self.smoothed = GazeBuffer(WEBCAM_DTYPE, capacity=32768, chunk_size=32768) if smoothing is not None else None
         self._running = False
-    
-    def add_marker(self, marker_type):
+        # Stage timers and counters of the capture, inference and preview (see Metrics)
+        self.metrics = Metrics()
+        self.session_writer = None
+        self.spill_batch = 30
+        self._spilled = 0
+        self._markers_spilled = 0
+        self._smoothed_spilled = 0
+        # Markers are added by the experiment and flushed by the recording thread when it stops
+        self._markers_lock = threading.Lock()
+
+    def add_marker(self, marker_type, timestamp=None):
         """
-        Add a custom marker to the gaze data
-        
+        Add a custom marker to the marker table
+
         Args:
         - marker_type (str): Type of marker (e.g., 'STIMULUS_START', 'STIMULUS_END')
+        - timestamp (float): Time of the marker, now() by default (replays pass the recorded time)
+        """
+        self.markers.append((now() if timestamp is None else timestamp, len(self.gaze_data), marker_type))
+        if self.session_writer is not None:
+            self._spill_markers()
+
+    def attach_writer(self, session_writer, spill_batch=30):
         """
-        now = time.time()
-        self.gaze_data['timestamps'].append(now)
-        self.gaze_data['right_eye_x'].append(None)
-        self.gaze_data['right_eye_y'].append(None)
-        self.gaze_data['left_eye_x'].append(None)
-        self.gaze_data['left_eye_y'].append(None)
-        self.gaze_data['markers'].append(marker_type)
-    
-    
+        Stream iris positions and markers to disk while recording.
+
+        Args:
+        - session_writer (SessionWriter): Writer the 'webcam' and 'webcam_markers' streams are
+          added to, and 'webcam_smoothed' with a smoothing filter
+        - spill_batch (int): Number of samples handed to the writer at once
+        """
+        session_writer.add_stream('webcam', WEBCAM_DTYPE)
+        session_writer.add_stream('webcam_markers', MARKER_DTYPE)
+        if self.smoothed is not None:
+            session_writer.add_stream('webcam_smoothed', WEBCAM_DTYPE)
+        self.session_writer = session_writer
+        self.spill_batch = spill_batch
+
+    def _spill(self, timeout=0.0):
+        # If the writer queue is full the rows stay unspilled and go with the next batch
+        self._spilled = self.session_writer.spill('webcam', self.gaze_data.view(), self._spilled, timeout)
+        if self.smoothed is not None:
+            self._smoothed_spilled = self.session_writer.spill('webcam_smoothed', self.smoothed.view(),
+                                                               self._smoothed_spilled, timeout)
+
+    def _spill_markers(self, timeout=0.0):
+        with self._markers_lock:
+            self._markers_spilled = self.session_writer.spill('webcam_markers', self.markers.view(),
+                                                              self._markers_spilled, timeout)
+
+
+    def _create_face_mesh(self):
+        if self.mp_face_mesh is None:
+            mp = _mediapipe()
+            self.mp_face_mesh = mp.solutions.face_mesh
+            self.mp_drawing = mp.solutions.drawing_utils
+            self.drawing_spec = mp.solutions.drawing_utils.DrawingSpec(thickness=1, circle_radius=1)
+        return self.mp_face_mesh.FaceMesh(
+                         max_num_faces=1,
+                         min_detection_confidence=0.5,
+                         min_tracking_confidence=0.5,
+                         refine_landmarks=True)
+
+    def _draw_face_mesh(self, frame, face_landmarks):
+        self.mp_drawing.draw_landmarks(
+            image=frame,
+            landmark_list=face_landmarks,
+            connections=self.mp_face_mesh.FACEMESH_TESSELATION,
+            landmark_drawing_spec=self.drawing_spec,
+            connection_drawing_spec=self.drawing_spec
+        )
+
+    def _create_backend(self, indices):
+        if self.backend == 'cascade':
+            return CascadeBackend(len(indices), metrics=self.metrics)
+        face_mesh = FaceMeshBackend(self._create_face_mesh(), indices, self.metrics, draw=self._draw_face_mesh)
+        if self.backend == 'face_mesh':
+            return face_mesh
+        try:
+            fallback = CascadeBackend(len(indices), metrics=self.metrics)
+        except RuntimeError as e:
+            print(f"[Webcam] No cascade fallback ({e}), the adaptive backend only skips frames.")
+            fallback = None
+        return AdaptiveBackend(face_mesh, fallback, frame_budget=self.frame_budget)
+
+    def _make_frame_processor(self, roi_tracking=None, preview=True, rois=None, backends=None):
+        """
+        Returns the processing function of one inference worker (each worker owns a landmark backend).
+
+        Its FaceRoi and backend are added to rois and backends, self.rois and
+        self.backends (the recording's) by default.
+        """
+        if roi_tracking is None:
+            roi_tracking = self.roi_tracking
+        roi = FaceRoi(target_width=self.roi_width) if roi_tracking else None
+        if roi is not None:
+            (self.rois if rois is None else rois).append(roi)
+        indices = [RIGHT_IRIS, LEFT_IRIS]
+        if self.eye_contours:
+            indices += RIGHT_EYE_CONTOUR + LEFT_EYE_CONTOUR
+        backend = self._create_backend(indices)
+        (self.backends if backends is None else backends).append(backend)
+        metrics = self.metrics
+        crop_time = metrics.stage('crop').record
+        landmarks_time = metrics.stage('landmarks').record
+        draw_time = metrics.stage('draw').record
+        flip_time = metrics.stage('flip').record
+
+        def process(frame, frame_index):
+            # The adaptive backend drops frames it has no CPU time for
+            if backend.skip():
+                metrics.count('skipped_frames')
+                return None, None, None
+
+            # In ROI mode FaceMesh only sees a downscaled crop around the previous face
+            t0 = now()
+            if roi is not None:
+                image, box = roi.crop(frame)
+                t1 = now()
+                crop_time(t1 - t0)
+                t0 = t1
+            else:
+                image, box = frame, (0, 0, frame.shape[1], frame.shape[0])
+
+            # The backend runs on the unmirrored frame; the mirror of the preview is
+            # applied to the coordinates instead of flipping every frame.
+            found = backend.process(image)
+            t0 = now()
+            metrics.count('frames')
+
+            sample = None
+            if found is not None:
+                metrics.count('faces_found')
+                # Back to full-frame pixels, then mirrored
+                sample = found.points * np.array(box[2:], dtype=np.float32) + np.array(box[:2], dtype=np.float32)
+                sample[:, 0] = frame.shape[1] - sample[:, 0]
+                if roi is not None and found.landmarks is not None:
+                    roi.update(found.landmarks, box, frame.shape)
+                elif roi is not None:
+                    roi.reset()  # only FaceMesh landmarks can place the next crop
+                landmarks_time(now() - t0)
+            elif roi is not None:
+                roi.reset()
+
+            frame_preview = None
+            if preview and self.show_preview and frame_index % self.preview_every == 0:
+                t0 = now()
+                # Draw on a copy, the raw frame may still be queued for the video recorder
+                frame = frame.copy()
+                if found is not None and roi is None:
+                    found.draw(frame)
+                elif found is not None:
+                    # The tessellation is relative to the crop, show the box and irises instead
+                    x, y, w, h = box
+                    cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 1)
+                    for px, py in sample[:2]:
+                        cv2.circle(frame, (int(frame.shape[1] - px), int(py)), 3, (0, 0, 255), -1)
+                t1 = now()
+                draw_time(t1 - t0)
+                frame_preview = cv2.flip(frame, 1)
+                flip_time(now() - t1)
+            return sample, frame_preview, None if found is None else found.code
+
+        return process
+
+    def _next_frame_processor(self):
+        # Pipeline workers take the processors warmed up by prepare() before creating new ones
+        try:
+            return self._prepared.pop()
+        except IndexError:
+            return self._make_frame_processor()
+
+    def _open_camera(self):
+        start = now()
+        self.cap = self.cam_index() if callable(self.cam_index) else cv2.VideoCapture(self.cam_index)
+        if self.cap.isOpened():
+            self.frame_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            self.frame_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.startup['camera_open_s'] = now() - start
+
+    def prepare(self, warmup_size=(640, 480)):
+        """
+        Open the camera and load MediaPipe before the recording starts.
+
+        The camera is opened on a second thread while MediaPipe is imported and
+        every worker's FaceMesh runs once on a blank frame, so the first real
+        frames are not slowed down by model initialization.
+
+        Args:
+        - warmup_size (tuple): Size (width, height) of the blank warm-up frame
+
+        Returns:
+        - bool: True if the camera is open
+        """
+        start = now()
+        opener = threading.Thread(target=self._open_camera, daemon=True)
+        opener.start()
+
+        if self.backend != 'cascade':
+            _mediapipe()
+        self.startup['import_s'] = now() - start
+        t = now()
+        blank = np.zeros((warmup_size[1], warmup_size[0], 3), dtype=np.uint8)
+        self.rois = []
+        self.backends = []
+        self._prepared = []
+        for _ in range(self.num_workers):
+            process = self._make_frame_processor()
+            process(blank, 0)
+            self._prepared.append(process)
+        self.startup['warmup_s'] = now() - t
+
+        opener.join()
+        # The warm-up frames are not part of the recording
+        self.metrics.reset()
+        for roi in self.rois:
+            roi.reset()
+            roi.tracked_frames = roi.full_frames = roi.lost = 0
+        for backend in self.backends:
+            backend.reset()
+        self.startup['ready_s'] = now() - start
+        if not self.cap.isOpened():
+            print("Error: Could not open webcam.")
+            return False
+        print(f"[Webcam] Ready in {self.startup['ready_s']:.2f}s (camera {self.startup['camera_open_s']:.2f}s, "
+              f"MediaPipe import {self.startup['import_s']:.2f}s, warm-up {self.startup['warmup_s']:.2f}s).")
+        return True
+
+    def _on_result(self, frame_index, timestamp, result):
+        # Called by the pipeline in capture order; timestamp is the grab time of the frame
+        sample, preview, backend = result
+        if preview is not None:
+            self._preview_frame = preview
+        if sample is None:
+            return
+        self.metrics.count('samples')
+        if not np.isfinite(sample[:2]).all():
+            self.metrics.count('invalid_samples')
+        self.gaze_data.append((timestamp, sample[0, 0], sample[0, 1], sample[1, 0], sample[1, 1], backend))
+        if self.contours is not None:
+            self.contours.append((timestamp, sample[2:18], sample[18:34]))
+        if self.smoothing is not None:
+            start = now()
+            self.smoothed.append((timestamp, *self.smoothing.filter(timestamp, sample[:2].ravel().tolist()), backend))
+            self.metrics.stage('smoothing').record(now() - start)
+
+        if self.session_writer is not None and len(self.gaze_data) - self._spilled >= self.spill_batch:
+            self._spill()
+
     def start_recording_webcam(self):
-        """Starts the webcam and MediaPipe."""
+        """
+        Starts the webcam and MediaPipe.
+
+        Frames are grabbed and timestamped on a capture thread and processed by
+        num_workers FaceMesh workers (see FramePipeline); this thread only
+        shows the preview and waits for 'q' or stop_recording().
+        """
         try:
-            self.cap = cv2.VideoCapture(self.cam_index)
-        
+            # The camera is already open if prepare() ran
+            if self.cap is None or not self.cap.isOpened():
+                self._open_camera()
+
             if not self.cap.isOpened():
                 print("Error: Could not open webcam.")
                 return False
-        
-            self.frame_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            self.frame_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            self.face_mesh = self.mp_face_mesh.FaceMesh(
-                             max_num_faces=1,
-                             min_detection_confidence=0.5,
-                             min_tracking_confidence=0.5,
-                             refine_landmarks=True)
-            print("[Webcam] Starting capture... Press 'q' to quit.")
+
+            on_capture = None
+            if self.record_video:
+                fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+                self.video_recorder = VideoRecorder(self.record_video, fps, (self.frame_width, self.frame_height))
+                if self.video_recorder.start():
+                    on_capture = self.video_recorder.write
+            self.pipeline = FramePipeline(self.cap, self._next_frame_processor, self._on_result,
+                                          num_workers=self.num_workers,
+                                          queue_size=self.queue_size,
+                                          policy=self.drop_policy,
+                                          on_capture=on_capture,
+                                          metrics=self.metrics)
+            self._stop_event.clear()
+            if not self._prepared:
+                self.rois = []
+                self.backends = []
+            if self.smoothing is not None:
+                self.smoothing.reset()
             self._running = True
-            
-            # Create window with a specific name and make it non-fullscreen
-            cv2.namedWindow('MediaPipe FaceMesh', cv2.WINDOW_NORMAL)
-            cv2.resizeWindow('MediaPipe FaceMesh', 640, 480)  # Smaller window size
-        
-            # Process frames as long as _running is True
-            while self._running:
+
+            if self.show_preview:
+                print("[Webcam] Starting capture... Press 'q' to quit.")
+                # Create window with a specific name and make it non-fullscreen
+                cv2.namedWindow('MediaPipe FaceMesh', cv2.WINDOW_NORMAL)
+                cv2.resizeWindow('MediaPipe FaceMesh', 640, 480)  # Smaller window size
+            else:
+                print("[Webcam] Starting headless capture...")
+
+            self.pipeline.start()
+
+            # Run as long as _running is True and the pipeline gets frames
+            imshow_time = self.metrics.stage('imshow').record
+            while self._running and self.pipeline.running:
+                if not self.show_preview:
+                    # Headless: nothing to pump, just wait for stop_recording()
+                    self._stop_event.wait(0.1)
+                    continue
                 try:
-                    ret, frame = self.cap.read()
-                    if not ret:
-                        print("Error: Could not read frame from webcam.")
-                        time.sleep(0.1)  # Small delay before retrying
-                        continue
-                
-                    # Process the frame
-                    frame = cv2.flip(frame, 1)
-                    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    results = self.face_mesh.process(frame_rgb)
-                
-                    now = time.time()
-                
-                    if results.multi_face_landmarks:
-                        for face_landmarks in results.multi_face_landmarks:
-                            self.mp_drawing.draw_landmarks(
-                                image=frame,
-                                landmark_list=face_landmarks,
-                                connections=self.mp_face_mesh.FACEMESH_TESSELATION,
-                                landmark_drawing_spec=self.drawing_spec,
-                                connection_drawing_spec=self.drawing_spec
-                            )
-            
-                            # Extract eye position
-                            rx = face_landmarks.landmark[473].x * self.frame_width
-                            ry = face_landmarks.landmark[473].y * self.frame_height
-                            lx = face_landmarks.landmark[468].x * self.frame_width
-                            ly = face_landmarks.landmark[468].y * self.frame_height
-            
-                            self.gaze_data['timestamps'].append(now)
-                            self.gaze_data['right_eye_x'].append(rx)
-                            self.gaze_data['right_eye_y'].append(ry)
-                            self.gaze_data['left_eye_x'].append(lx)
-                            self.gaze_data['left_eye_y'].append(ly)
-                            self.gaze_data['markers'].append(None)
-                
-                    if self.show_preview:
+                    frame = self._preview_frame
+                    if frame is not None:
+                        self._preview_frame = None
+                        start = now()
                         cv2.imshow('MediaPipe FaceMesh', frame)
+                        imshow_time(now() - start)
                     key = cv2.waitKey(1) & 0xFF
                     if key == ord('q'):
                         break
                 except Exception as e:
-                    print(f"[Webcam] Error processing frame: {e}")
+                    print(f"[Webcam] Error showing frame: {e}")
                     time.sleep(0.1)  # Small delay before continuing
-        
+
             #Cleanup
             self._running = False
+            self.pipeline.stop()
+            if self.video_recorder is not None:
+                self.video_recorder.close()
+            if self.session_writer is not None:
+                # The tail of the recording waits for room in the queue instead of being left out
+                self._spill(timeout=None)
+                self._spill_markers(timeout=None)
             if self.cap is not None and self.cap.isOpened():
                 self.cap.release()
-            cv2.destroyAllWindows()
-            print("[Webcam] Capture stopped.")
+            if self.show_preview:
+                cv2.destroyWindow('MediaPipe FaceMesh')
+            print(f"[Webcam] Capture stopped. {self.pipeline_stats()}")
         except Exception as e:
             print(f"[Webcam] Critical error in webcam recording: {e}")
             self._running = False
+            if self.pipeline is not None:
+                self.pipeline.stop()
+            if self.video_recorder is not None:
+                self.video_recorder.close()
             if hasattr(self, 'cap') and self.cap is not None and self.cap.isOpened():
                 self.cap.release()
             cv2.destroyAllWindows()
-    
+
     def stop_recording(self):
         """Stops the capture loop from code (no 'q' key required)."""
         if self._running:
+            # The recording thread stops the pipeline and releases the camera,
+            # releasing it here could pull it away from a read in progress.
             print("[Webcam] Stopping capture...")
             self._running = False
-            if self.cap is not None and self.cap.isOpened():
-                self.cap.release()
-            cv2.destroyAllWindows()
-            print("[Webcam] Capture stopped.")
-        
+            self._stop_event.set()
+
+    def pipeline_stats(self):
+        """Returns the frames captured / processed / dropped and the achieved rates."""
+        if self.pipeline is None:
+            return {}
+        stats = self.pipeline.stats()
+        if self.rois:
+            stats['roi_frames'] = sum(roi.tracked_frames for roi in self.rois)
+            stats['full_frames'] = sum(roi.full_frames for roi in self.rois)
+            stats['roi_lost'] = sum(roi.lost for roi in self.rois)
+        adaptive = [backend for backend in self.backends if isinstance(backend, AdaptiveBackend)]
+        if adaptive:
+            stats['backend_switches'] = sum(backend.switches for backend in adaptive)
+            stats['skipped_frames'] = sum(backend.skipped for backend in adaptive)
+        return stats
+
+    def evaluate_roi(self, video_path, max_frames=None):
+        """
+        Compare ROI inference against full-frame inference on a recorded clip.
+
+        Both modes process every frame of the clip with their own FaceMesh instance;
+        the recording's state (frame size, ROIs, backends) is left alone.
+
+        Args:
+        - video_path (str): Video file recorded with the webcam
+        - max_frames (int): Only use the first max_frames frames
+
+        Returns:
+        - dict with the FPS achieved by each mode and the iris position
+          difference (pixels) on the frames where both found a face
+        """
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            print(f"[Webcam] Could not open {video_path}")
+            return {}
+        rois, backends = [], []
+        full = self._make_frame_processor(roi_tracking=False, preview=False, rois=rois, backends=backends)
+        tracked = self._make_frame_processor(roi_tracking=True, preview=False, rois=rois, backends=backends)
+        roi = rois[0]
+
+        full_time = roi_time = 0.0
+        errors = []
+        frames = missed_full = missed_roi = 0
+        while max_frames is None or frames < max_frames:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            start = time.perf_counter()
+            full_sample = full(frame, frames)[0]
+            full_time += time.perf_counter() - start
+            start = time.perf_counter()
+            roi_sample = tracked(frame, frames)[0]
+            roi_time += time.perf_counter() - start
+            frames += 1
+
+            if full_sample is None:
+                missed_full += 1
+            if roi_sample is None:
+                missed_roi += 1
+            if full_sample is not None and roi_sample is not None:
+                errors.append(np.hypot(*(roi_sample[:2] - full_sample[:2]).T))
+        cap.release()
+
+        errors = np.concatenate(errors) if errors else np.array([np.nan])
+        return {
+            'frames': frames,
+            'full_fps': frames / full_time if full_time else 0.0,
+            'roi_fps': frames / roi_time if roi_time else 0.0,
+            'mean_error_px': float(np.mean(errors)),
+            'median_error_px': float(np.median(errors)),
+            'p95_error_px': float(np.percentile(errors, 95)),
+            'max_error_px': float(np.max(errors)),
+            'missed_full': missed_full,
+            'missed_roi': missed_roi,
+            'roi_lost': roi.lost,
+        }
+
+
+    def process_video(self, video_path, num_processes=None, segment_frames=None):
+        """
+        Extract the iris positions from a recorded video on a process pool.
+
+        The video is split into segments of consecutive frames; every worker
+        process owns one FaceMesh (configured like this Webcam) and processes
+        whole segments, and the results are merged back in frame order.
+        Use a seekable codec (the MJPG files written with record_video are).
+
+        Args:
+        - video_path (str): Video recorded with record_video (or any video file)
+        - num_processes (int): Worker processes, defaults to the number of cores
+        - segment_frames (int): Frames per segment, defaults to about 4 segments per worker
+
+        Returns:
+        - np.ndarray with WEBCAM_DTYPE; timestamps are the recorded grab times
+          if the timestamp sidecar exists, otherwise frame_index / fps. Frames
+          past the end of a short sidecar (e.g. a crashed recording) continue
+          from its last grab time at 1 / fps
+        """
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            print(f"[Webcam] Could not open {video_path}")
+            return np.empty(0, dtype=WEBCAM_DTYPE)
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        frame_size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        cap.release()
+
+        num_processes = num_processes or os.cpu_count() or 1
+        if segment_frames is None:
+            segment_frames = max(1, -(-total // (num_processes * 4)))
+        segments = [(start, min(start + segment_frames, total)) for start in range(0, total, segment_frames)]
+        # Offline every frame is processed: the adaptive backend would skip frames
+        # depending on the load of the machine, FaceMesh runs instead
+        settings = {'roi_tracking': self.roi_tracking, 'roi_width': self.roi_width,
+                    'backend': 'face_mesh' if self.backend == 'adaptive' else self.backend}
+
+        start_time = time.time()
+        with ProcessPoolExecutor(max_workers=num_processes, initializer=_init_offline_worker,
+                                 initargs=(settings, frame_size)) as pool:
+            parts = list(pool.map(_process_segment, [video_path] * len(segments), segments))
+        elapsed = time.time() - start_time
+        frame_index = np.concatenate([p[0] for p in parts]) if parts else np.empty(0, dtype=np.int64)
+        points = np.concatenate([p[1] for p in parts]) if parts else np.empty((0, 4), dtype=np.float32)
+        backends = np.concatenate([p[2] for p in parts]) if parts else np.empty(0, dtype=np.uint8)
+
+        order = np.argsort(frame_index, kind='stable')
+        frame_index = frame_index[order]
+        points = points[order]
+        backends = backends[order]
+
+        timestamps = load_frame_timestamps(video_path)
+        data = np.empty(len(frame_index), dtype=WEBCAM_DTYPE)
+        if timestamps is not None and 0 < len(timestamps) < total:
+            print(f"[Webcam] Warning: the timestamp sidecar of {video_path} covers {len(timestamps)} "
+                  f"of {total} frames, the last {total - len(timestamps)} are extrapolated at {fps:.1f} fps.")
+        data['system_timestamp'] = _frame_timestamps(frame_index, timestamps, fps)
+        for i, name in enumerate(('right_eye_x', 'right_eye_y', 'left_eye_x', 'left_eye_y')):
+            data[name] = points[:, i]
+        data['backend'] = backends
+        print(f"[Webcam] Processed {total} frames of {video_path} in {elapsed:.1f}s "
+              f"({total / max(elapsed, 1e-9):.0f} fps, {num_processes} processes, {len(data)} with a face).")
+        return data
+
+    def wait_for_samples(self, timestamp, timeout=1.0):
+        """
+        Wait until the frames grabbed up to timestamp are processed.
+
+        Args:
+        - timestamp (float): Time in the common timebase (now())
+        - timeout (float): Seconds to wait at most, e.g. when no face is found
+
+        Returns:
+        - bool: True if a sample at or after timestamp arrived
+        """
+        deadline = now() + timeout
+        while True:
+            data = self.gaze_data.view()
+            if len(data) and data['system_timestamp'][-1] >= timestamp:
+                return True
+            if now() >= deadline or not self._running:
+                return False
+            time.sleep(0.005)
 
     def get_data(self):
-        """Returns the gaze data."""
-        return self.gaze_data
-
-        
-
-
-    def plot_eye_positions(self):
-        """Plot eye positions from collected data."""
-        data = self.get_data()
-        
-        plt.figure(figsize=(12, 6))
-        
-        plt.subplot(1, 2, 1)
-        plt.plot(data['timestamps'], data['right_eye_x'], label='Right Eye X', color='red')
-        plt.plot(data['timestamps'], data['right_eye_y'], label='Right Eye Y', color='green')
-        plt.title('Right Eye Position vs Time')
-        plt.xlabel('Time (s)')
-        plt.ylabel('Position (pixels)')
-        plt.legend()
-        plt.grid(True)
-
-        plt.subplot(1, 2, 2)
-        plt.plot(data['timestamps'], data['left_eye_x'], label='Left Eye X', color='blue')
-        plt.plot(data['timestamps'], data['left_eye_y'], label='Left Eye Y', color='orange')
-        plt.title('Left Eye Position vs Time')
-        plt.xlabel('Time (s)')
-        plt.ylabel('Position (pixels)')
-        plt.legend()
-        plt.grid(True)
-
-        plt.tight_layout()
-        plt.show()
+        """Returns a zero-copy view (structured array) of the iris positions."""
+        return self.gaze_data.view()
 
+    def get_markers(self):
+        """Returns a zero-copy view of the marker table."""
+        return self.markers.view()
+
+    def get_contours(self):
+        """Returns the eye contours, or None if they are not recorded."""
+        return None if self.contours is None else self.contours.view()
+
+    def get_smoothed_data(self):
+        """Returns the smoothed iris positions (WEBCAM_DTYPE), or None without a smoothing filter."""
+        return None if self.smoothed is None else self.smoothed.view()
 
-if __name__ == "__main__":
 
-    webcam = Webcam()
-    webcam.start_recording_webcam()
-    #webcam.plot_eye_positions()
- 
 
 
-   
-    
+    def plot_eye_positions(self, width_px=1600, method='minmax'):
+        """
+        Plot eye positions from collected data, decimated to the plot width,
+        with the markers (see Plotting.plot_session).
+        """
+        from Plotting import plot_session
+
+        return plot_session(webcam=self.get_data(), markers=self.get_markers(), width_px=width_px, method=method)
+
+
+# Offline reprocessing: state of one worker process of Webcam.process_video
+_offline_process = None
+
+
+def _init_offline_worker(settings, frame_size):
+    global _offline_process
+    cv2.setNumThreads(1)  # one core per worker, parallelism comes from the pool
+    webcam = Webcam(show_preview=False, **settings)
+    webcam.frame_width, webcam.frame_height = frame_size
+    _offline_process = webcam._make_frame_processor(preview=False)
 
 
+def _frame_timestamps(frame_index, timestamps, fps):
+    # Grab times from the sidecar; frames past its end (a crashed recording)
+    # continue from the last grab time, so every row stays on the recorded timebase
+    if timestamps is None or not len(timestamps):
+        return frame_index / fps
+    recorded = timestamps['system_timestamp']
+    last = len(recorded) - 1
+    covered = frame_index <= last
+    result = np.empty(len(frame_index), dtype=np.float64)
+    result[covered] = recorded[frame_index[covered]]
+    result[~covered] = recorded[last] + (frame_index[~covered] - last) / fps
+    return result
 
 
+def _process_segment(video_path, segment):
+    start, end = segment
+    cap = cv2.VideoCapture(video_path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) != start:
+        # Seeking is not supported by this file, skip frames without decoding them
+        cap.release()
+        cap = cv2.VideoCapture(video_path)
+        for _ in range(start):
+            cap.grab()
 
+    frame_index = []
+    points = []
+    backends = []
+    for index in range(start, end):
+        ret, frame = cap.read()
+        if not ret:
+            break
+        sample, _, backend = _offline_process(frame, index)
+        if sample is not None:
+            frame_index.append(index)
+            points.append(sample[:2].reshape(4))
+            backends.append(backend)
+    cap.release()
+    return (np.array(frame_index, dtype=np.int64),
+            np.array(points, dtype=np.float32).reshape(-1, 4),
+            np.array(backends, dtype=np.uint8))
+
+
+if __name__ == "__main__":
+
+    webcam = Webcam()
+    webcam.start_recording_webcam()
+    #webcam.plot_eye_positions()
@@ -0,0 +1,504 @@
+#Webcam tracking in a separate process, results shared through a ring buffer in shared memory
+
+import multiprocessing as mp
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from GazeBuffer import GazeBuffer, WEBCAM_DTYPE, MARKER_DTYPE, CONTOUR_DTYPE
+from ClockSync import now
+from Filters import PerEyeFilter, smooth_rows
+
+
+# The write counter lives in the first bytes, the records start on the next cache line
+RING_HEADER = 64
+
+
+class SharedRing:
+
+    """
+    Single-producer ring buffer of fixed-size records in shared memory.
+
+    The producer writes a record into slot count % capacity and then
+    increments the write counter, so a reader that sees the counter also
+    sees the record (stores are not reordered on the platforms we record
+    on). There is no lock: a reader that falls capacity records behind loses
+    the oldest ones (the slot being written is never returned), and read()
+    reports how many.
+
+    Args:
+    - dtype (np.dtype): Record type
+    - capacity (int): Number of records kept
+    - name (str): Attach to an existing ring (in the other process) instead of creating one
+    """
+
+    def __init__(self, dtype, capacity=4096, name=None):
+        self.dtype = np.dtype(dtype)
+        self.capacity = capacity
+        size = RING_HEADER + self.dtype.itemsize * capacity
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+            self._owner = True
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            self._owner = False
+        self._count = np.ndarray((1,), dtype=np.int64, buffer=self._shm.buf)
+        self._records = np.ndarray((capacity,), dtype=self.dtype, buffer=self._shm.buf, offset=RING_HEADER)
+        if self._owner:
+            self._count[0] = 0
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def count(self):
+        """Number of records written since the ring was created."""
+        return int(self._count[0])
+
+    def __len__(self):
+        # Lets the ring stand in for a GazeBuffer on the producer side
+        return self.count
+
+    def append(self, record):
+        """Write one record (producer only)."""
+        count = int(self._count[0])
+        self._records[count % self.capacity] = record
+        self._count[0] = count + 1
+
+    def read(self, start):
+        """
+        Copy the records written since start.
+
+        Args:
+        - start (int): Write count of the first record wanted (the end returned by the previous read)
+
+        Returns:
+        - (records copy, end to pass to the next read, number of records lost to overwriting)
+        """
+        end = self.count
+        first = max(start, end - self.capacity)
+        i, j = first % self.capacity, end % self.capacity
+        if end - first == 0:
+            data = self._records[:0].copy()
+        elif i < j:
+            data = self._records[i:j].copy()
+        else:
+            data = np.concatenate([self._records[i:], self._records[:j]])
+        # Records the producer overwrote while they were being copied are discarded,
+        # and so is the one in the slot it may be writing right now
+        torn = min(max(0, self.count - self.capacity + 1 - first), len(data))
+        return data[torn:], end, first - start + torn
+
+    def latest(self, n=1):
+        """
+        Zero-copy view of the last n records (fewer if they wrap around the end of the ring).
+
+        The view aliases shared memory and is overwritten after capacity more records.
+        """
+        end = self.count
+        j = end % self.capacity
+        if j == 0 and end:
+            j = self.capacity
+        return self._records[max(0, j - min(n, end)):j]
+
+    def close(self):
+        """Detach from the shared memory; the creating side also frees it."""
+        self._count = None
+        self._records = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+class WebcamProcess:
+
+    """
+    Runs Webcam in its own process so FaceMesh, OpenCV and the preview do not
+    compete with the Tobii callback and the stimulus loop for the GIL.
+
+    The child process publishes every iris sample to a SharedRing; a reader
+    thread here drains it into a GazeBuffer every poll_interval seconds (one
+    memcpy per batch) and spills to the session writer. A smoothing filter runs
+    here on each drained batch, not in the webcam process, so the smoothed
+    positions reach get_smoothed_data() and the writer. Start and stop are
+    sent over a pipe. Markers are timestamped here with now(), which reads the
+    same system-wide monotonic clock in both processes.
+
+    Args:
+    - ring_size (int): Samples the ring holds; must cover poll_interval comfortably
+    - poll_interval (float): Seconds between two reads of the ring
+    - stream_name (str): Name of the session writer streams ('<name>', '<name>_markers' and '<name>_smoothed')
+    - smoothing (GazeFilter): Filter applied to the samples, each eye on its own (see Filters.PerEyeFilter)
+    - **webcam_args: Arguments of Webcam (cam_index, show_preview, roi_tracking, ...)
+    """
+
+    def __init__(self, ring_size=4096, poll_interval=0.05, stream_name='webcam', smoothing=None, **webcam_args):
+        self.webcam_args = webcam_args
+        self.stream_name = stream_name
+        self.ring_size = ring_size
+        self.poll_interval = poll_interval
+        self.eye_contours = webcam_args.get('eye_contours', False)
+        self.gaze_data = GazeBuffer(WEBCAM_DTYPE, capacity=32768, chunk_size=32768)
+        self.markers = GazeBuffer(MARKER_DTYPE, capacity=256, chunk_size=256)
+        self.contours = GazeBuffer(CONTOUR_DTYPE, capacity=4096, chunk_size=32768) if self.eye_contours else None
+        self.smoothing = PerEyeFilter(smoothing) if smoothing is not None else None
+        self.smoothed = GazeBuffer(WEBCAM_DTYPE, capacity=32768, chunk_size=32768) if smoothing is not None else None
+        self.frame_width = None
+        self.frame_height = None
+        self.lost = {}  # ring name -> samples overwritten before they were read
+        self.session_writer = None
+        self.startup = {}  # seconds spent on each start-up step, see open()
+        self._stats = {}
+        self._metrics = {}
+        self._process = None
+        self._conn = None
+        self._rings = {}
+        self._positions = {}
+        self._reader = None
+        self._stop_event = threading.Event()
+        self._pipe_lock = threading.Lock()  # one request/reply exchange at a time
+        self._drain_lock = threading.Lock()  # the tables have a single appender at a time
+        self._first_record = 0  # ring record of the first row of gaze_data (see clear)
+        self._sequence = 0  # id of the last request, echoed by its reply
+        self._spilled = 0
+        self._markers_spilled = 0
+        self._smoothed_spilled = 0
+
+    def attach_writer(self, session_writer):
+        """
+        Stream iris positions and markers to disk while recording.
+
+        Args:
+        - session_writer (SessionWriter): Writer the '<stream_name>' and '<stream_name>_markers' streams
+          are added to, and '<stream_name>_smoothed' with a smoothing filter
+        """
+        session_writer.add_stream(self.stream_name, WEBCAM_DTYPE)
+        session_writer.add_stream(self.stream_name + '_markers', MARKER_DTYPE)
+        if self.smoothed is not None:
+            session_writer.add_stream(self.stream_name + '_smoothed', WEBCAM_DTYPE)
+        self.session_writer = session_writer
+
+    def add_marker(self, marker_type, timestamp=None):
+        """
+        Add a custom marker to the marker table
+
+        Args:
+        - marker_type (str): Type of marker (e.g., 'STIMULUS_START', 'STIMULUS_END')
+        - timestamp (float): Time of the marker, now() by default (see MarkerBus)
+        """
+        # Index of the next sample the webcam process will publish, as a row of
+        # gaze_data: without the samples the ring lost so far. Samples lost after
+        # this call (see lost) still shift the rows after the marker.
+        ring = self._rings.get('webcam')
+        index = ring.count - self._first_record - self.lost['webcam'] if ring is not None else len(self.gaze_data)
+        self.markers.append((now() if timestamp is None else timestamp, index, marker_type))
+        if self.session_writer is not None:
+            self._spill_markers()
+
+    def _spill_markers(self, timeout=0.0):
+        # Markers are added and flushed on the caller's thread, the cursor needs no lock
+        self._markers_spilled = self.session_writer.spill(self.stream_name + '_markers', self.markers.view(),
+                                                          self._markers_spilled, timeout)
+
+    def open(self, timeout=30.0):
+        """
+        Start the webcam process and wait until it is ready.
+
+        The process opens the camera while it loads MediaPipe and warms up
+        FaceMesh (see Webcam.prepare), so the recording starts on the first
+        frame. The time of each step is kept in startup. open() blocks; run
+        it on a thread to overlap it with other start-up work.
+
+        Returns:
+        - True if the process is ready
+        """
+        if self._process is not None:
+            return True
+        self._rings = {'webcam': SharedRing(WEBCAM_DTYPE, self.ring_size)}
+        if self.eye_contours:
+            self._rings['contours'] = SharedRing(CONTOUR_DTYPE, self.ring_size)
+        self._positions = {name: 0 for name in self._rings}
+        self.lost = {name: 0 for name in self._rings}
+        self._first_record = 0
+
+        # spawn: a clean interpreter, no copied threads or locks of this process
+        context = mp.get_context('spawn')
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(target=_run_webcam_process, name=f'WebcamProcess-{self.stream_name}', daemon=True,
+                                        args=(child_conn, self.webcam_args,
+                                              {name: (ring.name, ring.capacity) for name, ring in self._rings.items()}))
+        start = now()
+        self._process.start()
+        child_conn.close()
+        reply = self._request(None, timeout)
+        if reply is None or reply[0] != 'ready':
+            print(f"[Webcam] {self.stream_name}: webcam process failed to start: {reply}")
+            self.close()
+            return False
+        self.startup = dict(reply[1], process_ready_s=now() - start)
+        return True
+
+    def start_recording(self, timeout=10.0):
+        """
+        Start capturing in the webcam process (opening it first if needed).
+
+        Returns once the camera is open, so the first markers fall after the start of the recording.
+
+        Returns:
+        - True if the capture started
+        """
+        if not self.open():
+            return False
+        reply = self._request(('start',), timeout)
+        if reply is None or reply[0] != 'started':
+            print(f"[Webcam] {self.stream_name}: capture did not start: {reply}")
+            return False
+        if self.smoothing is not None:
+            self.smoothing.reset()
+        self.frame_width, self.frame_height = reply[1], reply[2]
+        self._stop_event.clear()
+        self._reader = threading.Thread(target=self._read_loop, name='WebcamReader', daemon=True)
+        self._reader.start()
+        print(f"[Webcam] {self.stream_name}: capture running in a separate process.")
+        return True
+
+    def stop_recording(self, timeout=5.0):
+        """
+        Stop the capture, collect the remaining samples and end the webcam process.
+
+        The process is asked to stop over the pipe and joined; it is only
+        terminated if it does not exit within timeout.
+        """
+        if self._process is None:
+            return
+        reply = self._request(('stop',), timeout)
+        if reply is not None and reply[0] == 'stopped':
+            self._stats, self._metrics = reply[1], reply[2]
+        self._stop_event.set()
+        if self._reader is not None:
+            self._reader.join()
+            self._reader = None
+        # The tail of the recording waits for room in the writer queue instead of being left out
+        self._drain(spill_timeout=None)
+        if self.session_writer is not None:
+            self._spill_markers(timeout=None)
+        self.close(timeout)
+
+    def close(self, timeout=5.0):
+        """Ends the webcam process and frees the shared memory."""
+        if self._process is not None:
+            with self._pipe_lock:
+                try:
+                    self._sequence += 1
+                    self._conn.send((self._sequence, 'exit'))
+                except (BrokenPipeError, OSError):
+                    pass
+            self._process.join(timeout)
+            if self._process.is_alive():
+                print(f"[Webcam] {self.stream_name}: webcam process did not exit, terminating it.")
+                self._process.terminate()
+                self._process.join()
+            self._process = None
+            self._conn.close()
+            self._conn = None
+        for ring in self._rings.values():
+            ring.close()
+        self._rings = {}
+
+    def _request(self, command, timeout):
+        # Send a command (None: only wait for the 'ready' message) and return the
+        # child's reply, None if it died or did not answer in time. Requests carry
+        # a sequence id that the reply echoes: the late reply of a request that
+        # timed out is discarded instead of being taken for the next one's.
+        with self._pipe_lock:
+            expected = 0
+            deadline = now() + timeout
+            try:
+                if command is not None:
+                    self._sequence += 1
+                    expected = self._sequence
+                    self._conn.send((expected,) + command)
+                while self._conn.poll(max(0.0, deadline - now())):
+                    reply = self._conn.recv()
+                    if reply[0] == expected:
+                        return reply[1:]
+            except (BrokenPipeError, EOFError, OSError):
+                pass
+            return None
+
+    def _read_loop(self):
+        while not self._stop_event.wait(self.poll_interval):
+            self._drain()
+
+    def wait_for_samples(self, timestamp, timeout=1.0):
+        """
+        Wait until the samples of the frames grabbed up to timestamp are in gaze_data.
+
+        Args:
+        - timestamp (float): Time in the common timebase (now())
+        - timeout (float): Seconds to wait at most, e.g. when no face is found
+
+        Returns:
+        - bool: True if a sample at or after timestamp arrived
+        """
+        deadline = now() + timeout
+        while True:
+            self._drain()
+            data = self.gaze_data.view()
+            if len(data) and data['system_timestamp'][-1] >= timestamp:
+                return True
+            if now() >= deadline:
+                return False
+            time.sleep(min(0.005, self.poll_interval))
+
+    def clear(self):
+        """
+        Drop the samples, contours and markers recorded so far, e.g. those of the
+        calibration, without stopping the capture. Attach the session writer
+        afterwards: rows already handed to it stay on disk.
+        """
+        with self._drain_lock:
+            self._drain_rings()
+            self.gaze_data.clear()
+            self.markers.clear()
+            if self.contours is not None:
+                self.contours.clear()
+            if self.smoothed is not None:
+                self.smoothed.clear()
+            self._first_record = self._positions.get('webcam', 0)
+            self.lost = {name: 0 for name in self._rings}
+            self._spilled = 0
+            self._markers_spilled = 0
+            self._smoothed_spilled = 0
+
+    def _drain(self, spill_timeout=0.0):
+        # Runs on the reader thread, and on the caller's in wait_for_samples and stop_recording
+        with self._drain_lock:
+            self._drain_rings(spill_timeout)
+
+    def _drain_rings(self, spill_timeout=0.0):
+        for name, ring in self._rings.items():
+            data, self._positions[name], lost = ring.read(self._positions[name])
+            self.lost[name] += lost
+            if len(data):
+                (self.gaze_data if name == 'webcam' else self.contours).extend(data)
+                if name == 'webcam' and self.smoothing is not None:
+                    self.smoothed.extend(smooth_rows(data, self.smoothing))
+        if self.session_writer is not None:
+            # If the writer queue is full the rows stay unspilled and go with the next batch
+            self._spilled = self.session_writer.spill(self.stream_name, self.gaze_data.view(), self._spilled,
+                                                      spill_timeout)
+            if self.smoothed is not None:
+                self._smoothed_spilled = self.session_writer.spill(self.stream_name + '_smoothed',
+                                                                   self.smoothed.view(), self._smoothed_spilled,
+                                                                   spill_timeout)
+
+    def latest(self):
+        """Zero-copy view of the most recent sample in shared memory (empty before the first one)."""
+        ring = self._rings.get('webcam')
+        return ring.latest(1) if ring is not None else self.gaze_data.view()[-1:]
+
+    def pipeline_stats(self, timeout=1.0):
+        """Returns the pipeline counters and rates of the webcam process (live while recording)."""
+        stats = self._stats
+        if self._reader is not None:
+            reply = self._request(('stats',), timeout)
+            if reply is not None and reply[0] == 'stats':
+                stats = reply[1]
+        stats = dict(stats)
+        stats['samples'] = len(self.gaze_data)
+        stats['ring_lost'] = dict(self.lost)
+        return stats
+
+    def metrics_snapshot(self, timeout=1.0):
+        """Returns the stage timers and counters of the webcam process (live while recording)."""
+        if self._reader is not None:
+            reply = self._request(('metrics',), timeout)
+            if reply is not None and reply[0] == 'metrics':
+                return reply[1]
+        return dict(self._metrics)
+
+    def get_data(self):
+        """Returns a zero-copy view (structured array) of the iris positions."""
+        return self.gaze_data.view()
+
+    def get_markers(self):
+        """Returns a zero-copy view of the marker table."""
+        return self.markers.view()
+
+    def get_smoothed_data(self):
+        """Returns the smoothed iris positions (WEBCAM_DTYPE), or None without a smoothing filter."""
+        return None if self.smoothed is None else self.smoothed.view()
+
+    def get_contours(self):
+        """Returns the eye contours, or None if they are not recorded."""
+        return None if self.contours is None else self.contours.view()
+
+
+def _run_webcam_process(conn, webcam_args, ring_specs):
+    # Entry point of the webcam process: the Webcam publishes into the rings
+    # instead of its own buffers, this thread serves the control pipe.
+    from Webcam import Webcam
+
+    rings = {name: SharedRing(WEBCAM_DTYPE if name == 'webcam' else CONTOUR_DTYPE, capacity, shm_name)
+             for name, (shm_name, capacity) in ring_specs.items()}
+    webcam = Webcam(**webcam_args)
+    webcam.gaze_data = rings['webcam']
+    if 'contours' in rings:
+        webcam.contours = rings['contours']
+    webcam.prepare()
+    conn.send((0, 'ready', webcam.startup))
+
+    recording = None
+    while True:
+        try:
+            sequence, *command = conn.recv()
+        except EOFError:
+            sequence, command = None, ['exit']  # The main process is gone
+
+        if command[0] == 'start' and recording is not None:
+            conn.send((sequence, 'started', webcam.frame_width, webcam.frame_height))
+
+        elif command[0] == 'start':
+            recording = threading.Thread(target=webcam.start_recording_webcam, name='WebcamRecording')
+            recording.start()
+            while recording.is_alive() and not (webcam.pipeline is not None and webcam.pipeline.running):
+                time.sleep(0.01)
+            if recording.is_alive():
+                conn.send((sequence, 'started', webcam.frame_width, webcam.frame_height))
+            else:
+                conn.send((sequence, 'error', 'could not open the camera'))
+                recording = None
+
+        elif command[0] == 'stats':
+            conn.send((sequence, 'stats', webcam.pipeline_stats()))
+
+        elif command[0] == 'metrics':
+            conn.send((sequence, 'metrics', webcam.metrics.snapshot()))
+
+        elif command[0] in ('stop', 'exit'):
+            if recording is not None:
+                webcam.stop_recording()
+                recording.join()
+                recording = None
+            if command[0] == 'stop':
+                conn.send((sequence, 'stopped', webcam.pipeline_stats(), webcam.metrics.snapshot()))
+            else:
+                break
+
+    webcam.gaze_data = webcam.contours = None
+    for ring in rings.values():
+        ring.close()
+    conn.close()
+
+
+if __name__ == "__main__":
+
+    webcam = WebcamProcess()
+    if webcam.start_recording():
+        time.sleep(10)
+        webcam.stop_recording()
+        print(f"[Webcam] {len(webcam.get_data())} samples, {webcam.pipeline_stats()}")
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from Alignment import make_grid, resample, align_session, epochs, epochs_by_offset
+from GazeBuffer import TOBII_DTYPE, WEBCAM_DTYPE, STIMULUS_DTYPE
+
+
+def test_make_grid_includes_both_ends():
+    grid = make_grid(1.0, 2.0, 10.0)
+    assert len(grid) == 11 and grid[0] == 1.0 and np.isclose(grid[-1], 2.0)
+
+
+def test_linear_resampling_is_exact_on_a_line():
+    t = np.sort(np.random.default_rng(0).uniform(0, 1, 200))
+    grid = make_grid(t[0], t[-1], 500.0)
+    values, valid = resample(t, 3 * t + 1, grid, max_gap=0.1)
+    assert valid.all()
+    assert np.allclose(values, 3 * grid + 1)
+
+
+def test_gaps_and_invalid_samples_are_not_bridged():
+    t = np.array([0.0, 0.01, 0.02, 0.5, 0.51, 0.52])
+    values = np.array([0.0, 1.0, np.nan, 3.0, 4.0, 5.0])
+    grid = np.array([0.005, 0.015, 0.3, 0.505, 0.52])
+    out, valid = resample(t, values, grid, max_gap=0.05)
+    # 0.015 lies between a valid sample and a NaN, the next valid one is 0.49 s later
+    assert valid.tolist() == [True, False, False, True, True]
+    assert np.allclose(out[valid], [0.5, 3.5, 5.0])
+    assert np.isnan(out[~valid]).all()
+
+
+def test_nearest_resampling_of_several_channels():
+    t = np.array([0.0, 0.1, 0.2])
+    values = np.array([[0, 10], [1, 11], [2, 12]], dtype=float)
+    out, valid = resample(t, values, np.array([0.04, 0.06, 0.3]), method='nearest', max_gap=0.12)
+    assert valid.tolist() == [True, True, False]
+    assert out[:2].tolist() == [[0, 10], [1, 11]]
+    with pytest.raises(ValueError):
+        resample(t, values, t, method='cubic')
+
+
+def test_align_session_and_epochs():
+    tobii = np.zeros(601, dtype=TOBII_DTYPE)
+    tobii['system_timestamp'] = np.linspace(0.0, 1.0, 601)
+    tobii['left_gaze_x'] = tobii['system_timestamp']
+    tobii['left_gaze_validity'] = 1
+    tobii['left_gaze_validity'][300:360] = 0     # a blink of 100 ms
+    webcam = np.zeros(31, dtype=WEBCAM_DTYPE)
+    webcam['system_timestamp'] = np.linspace(1.0, 0.0, 31)   # out of order on purpose
+    webcam['right_eye_x'] = 100 * webcam['system_timestamp']
+    stimulus = np.zeros(2, dtype=STIMULUS_DTYPE)
+    stimulus['system_timestamp'] = [0.25, 0.75]
+    stimulus['stimulus_offset_cm'] = [1.0, 2.0]
+
+    aligned = align_session(stimulus, tobii, webcam, rate=100.0, max_gap=0.05)
+    time = aligned['time']
+    left_x = aligned['channels'].index('tobii_left_x')
+    right_eye = aligned['channels'].index('webcam_right_x')
+    assert len(time) == 101 and aligned['values'].shape == (101, len(aligned['channels']))
+    blink = (time > 0.495) & (time < 0.595)
+    outside = (time < 0.495) | (time > 0.605)
+    assert not aligned['valid'][blink, left_x].any() and aligned['valid'][outside, left_x].all()
+    assert np.allclose(aligned['values'][outside, left_x], time[outside], atol=1e-5)
+    assert aligned['valid'][:, right_eye].all()
+    assert np.allclose(aligned['values'][:, right_eye], 100 * time, atol=1e-3)
+
+    epoch_data = epochs(aligned, stimulus, pre=0.3, post=0.1)
+    assert epoch_data['data'].shape == (2, 41, len(aligned['channels']))
+    # The first epoch starts before the recording
+    assert not epoch_data['valid'][0, :5].any() and np.isnan(epoch_data['data'][0, :5]).all()
+    assert np.isclose(epoch_data['data'][1, 30, left_x], 0.75)
+    by_offset = epochs_by_offset(epoch_data)
+    assert sorted(by_offset) == [1.0, 2.0] and by_offset[2.0].shape == (1, 41, len(aligned['channels']))
+
+
+def test_empty_session_gives_an_empty_grid():
+    aligned = align_session(np.zeros(0, dtype=STIMULUS_DTYPE), np.zeros(0, dtype=TOBII_DTYPE),
+                            np.zeros(0, dtype=WEBCAM_DTYPE))
+    assert len(aligned['time']) == 0
+    assert aligned['values'].shape == aligned['valid'].shape == (0, len(aligned['channels']))
+
+    # Explicit limits still give a grid, with nothing valid on it
+    aligned = align_session(np.zeros(0, dtype=STIMULUS_DTYPE), np.zeros(0, dtype=TOBII_DTYPE),
+                            rate=10.0, start=0.0, end=1.0)
+    assert len(aligned['time']) == 11 and not aligned['valid'].any()
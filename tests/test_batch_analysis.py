@@ -0,0 +1,88 @@
+import os
+import shutil
+
+import numpy as np
+
+import BatchAnalysis
+from BatchAnalysis import ResultCache, DEFAULT_PARAMS, discover_sessions, run_batch
+from DataExport import export_session
+from GazeBuffer import TOBII_DTYPE, EVENT_DTYPE, STIMULUS_DTYPE
+
+
+def _export(directory, timestamp='20240101_120000', fmt='npy', offset=0.0):
+    tobii = np.zeros(1200, dtype=TOBII_DTYPE)
+    tobii['system_timestamp'] = np.arange(1200) / 600
+    for eye in ('left', 'right'):
+        tobii[eye + '_gaze_x'] = 0.5 + offset
+        tobii[eye + '_gaze_y'] = np.where(np.arange(1200) < 600, 0.3, 0.7)
+        tobii[eye + '_gaze_validity'] = 1
+        tobii[eye + '_pupil_validity'] = 1
+    stimulus = np.zeros(1, dtype=STIMULUS_DTYPE)
+    os.makedirs(directory, exist_ok=True)
+    export_session(str(directory), timestamp, {'tobii': tobii, 'stimulus': stimulus},
+                   {'participant_id': 'P01'}, fmt=fmt)
+    return discover_sessions(str(directory))
+
+
+def test_key_follows_the_content_not_the_location(tmp_path):
+    session = _export(tmp_path / 'a')[0]
+    shutil.copytree(tmp_path / 'a', tmp_path / 'b')
+    moved = discover_sessions(str(tmp_path / 'b'))[0]
+    cache = ResultCache(str(tmp_path / 'cache'))
+    assert cache.key(session, DEFAULT_PARAMS) == cache.key(moved, DEFAULT_PARAMS)
+    assert cache.key(session, dict(DEFAULT_PARAMS, velocity_threshold=40.0)) != cache.key(session, DEFAULT_PARAMS)
+    changed = _export(tmp_path / 'c', offset=0.1)[0]
+    assert cache.key(changed, DEFAULT_PARAMS) != cache.key(session, DEFAULT_PARAMS)
+
+
+def test_key_changes_with_the_analysis_version(tmp_path, monkeypatch):
+    session = _export(tmp_path / 'a', fmt='npz')[0]
+    cache = ResultCache(str(tmp_path / 'cache'))
+    key = cache.key(session, DEFAULT_PARAMS)
+    monkeypatch.setattr(BatchAnalysis, 'ANALYSIS_VERSION', BatchAnalysis.ANALYSIS_VERSION + 1)
+    assert cache.key(session, DEFAULT_PARAMS) != key
+
+
+def test_file_digests_are_remembered(tmp_path, monkeypatch):
+    session = _export(tmp_path / 'a')[0]
+    cache = ResultCache(str(tmp_path / 'cache'))
+    key = cache.key(session, DEFAULT_PARAMS)
+    cache.save_digests()
+
+    read = []
+    digest = BatchAnalysis.file_digest
+    monkeypatch.setattr(BatchAnalysis, 'file_digest', lambda path: read.append(path) or digest(path))
+    reopened = ResultCache(str(tmp_path / 'cache'))
+    assert reopened.key(session, DEFAULT_PARAMS) == key and read == []
+    # A rewritten file is read again
+    path = session['files'][0]
+    with open(path, 'ab') as f:
+        f.write(b'\0')
+    reopened.key(session, DEFAULT_PARAMS)
+    assert read == [path]
+
+
+def test_store_and_load(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    events = np.array([('fixation', 0.0, 0.2, 0.5, 0.5)], dtype=EVENT_DTYPE)
+    assert cache.load('ab' * 20) is None
+    cache.store('ab' * 20, {'summary': {'session': 'x', 'fixations': 1}, 'arrays': {'events': events}})
+    result = cache.load('ab' * 20)
+    assert result['summary'] == {'session': 'x', 'fixations': 1}
+    np.testing.assert_array_equal(result['arrays']['events'], events)
+    assert not [name for _, _, files in os.walk(tmp_path / 'cache') for name in files if 'tmp' in name]
+
+
+def test_run_batch_reuses_the_cached_results(tmp_path):
+    _export(tmp_path / 'data', '20240101_120000')
+    _export(tmp_path / 'data', '20240102_120000', fmt='npz')
+    cache_directory = str(tmp_path / 'cache')
+    first = run_batch(str(tmp_path / 'data'), workers=1, cache_directory=cache_directory)
+    assert [summary['cached'] for summary in first] == [False, False]
+    assert all('error' not in summary for summary in first)
+    assert first[0]['fixations'] == 2
+    second = run_batch(str(tmp_path / 'data'), workers=1, cache_directory=cache_directory)
+    assert [summary['cached'] for summary in second] == [True, True]
+    assert [summary['fixations'] for summary in second] == [summary['fixations'] for summary in first]
+    forced = run_batch(str(tmp_path / 'data'), workers=1, cache_directory=cache_directory, force=True)
+    assert [summary['cached'] for summary in forced] == [False, False]
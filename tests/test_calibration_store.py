@@ -0,0 +1,65 @@
+import math
+
+import pytest
+
+from CalibrationStore import CalibrationStore
+from FakeDevices import FakeTobiiResearch
+from Tobii import Tobii
+
+SCREEN = (1920, 1200)
+POINTS = [(0.5, 0.5), (0.1, 0.1), (0.9, 0.9)]
+
+
+def _tracker(validation_error):
+    tobii = Tobii(FakeTobiiResearch())
+
+    def calibrate(*args, **kwargs):
+        tobii.my_eyetracker.apply_calibration_data(b'calibration')
+        return True
+
+    tobii.calibrate = calibrate
+    tobii.validate = lambda *args, **kwargs: validation_error
+    return tobii
+
+
+def _ensure(tobii, store):
+    return tobii.ensure_calibration(store, 'P01', POINTS, *SCREEN, point_radius=5, wait_time=0, max_error=1.0)
+
+
+def test_good_calibration_is_stored_and_reused(tmp_path):
+    store = CalibrationStore(str(tmp_path))
+    tobii = _tracker(0.4)
+    assert _ensure(tobii, store)
+    assert tobii.restore_calibration(store, 'P01', SCREEN) is not None
+
+    tobii.calibrate = lambda *args, **kwargs: pytest.fail("the stored calibration should be reused")
+    assert _ensure(tobii, store)
+
+
+@pytest.mark.parametrize('error', [5.0, math.nan])
+def test_failed_validation_is_not_stored(tmp_path, error):
+    store = CalibrationStore(str(tmp_path))
+    tobii = _tracker(error)
+    assert not _ensure(tobii, store)
+    assert tobii.restore_calibration(store, 'P01', SCREEN) is None
+
+
+@pytest.mark.parametrize('error', [3.0, math.nan])
+def test_restored_calibration_that_fails_validation_is_scored(tmp_path, error):
+    store = CalibrationStore(str(tmp_path))
+    tobii = _tracker(0.4)
+    assert _ensure(tobii, store)
+    entry = store.entries[0]
+
+    # The participant sits differently today: the stored calibration fails, the new one is good
+    errors = [error, 0.5]
+    tobii.validate = lambda *args, **kwargs: errors.pop(0)
+    assert _ensure(tobii, store)
+    assert entry['score'] == error or math.isnan(error) and math.isnan(entry['score'])
+    assert len(store.entries) == 2
+
+    # Without validation, only a calibration scored within max_error is restored
+    store.entries.remove(next(e for e in store.entries if e is not entry))
+    tobii.calibrate = lambda *args, **kwargs: False
+    assert not tobii.ensure_calibration(store, 'P01', POINTS, *SCREEN, point_radius=5, wait_time=0,
+                                        validate=False, max_error=1.0)
@@ -0,0 +1,81 @@
+import time
+
+import numpy as np
+
+from ClockSync import OnlineClockFit, ClockSync
+from FakeDevices import FakeTobiiResearch
+
+
+def _pairs(n, offset=50.0, drift_ppm=30.0, seed=0):
+    # Pairs of a drifting clock; a quarter of the round trips are slow and their midpoints off
+    rng = np.random.default_rng(seed)
+    x = np.arange(n) * 0.5
+    rtt = rng.uniform(100e-6, 200e-6, n)
+    slow = rng.random(n) < 0.25
+    rtt[slow] = rng.uniform(5e-3, 20e-3, slow.sum())
+    error = rng.uniform(-0.5, 0.5, n) * rtt
+    y = offset + x * (1 + drift_ppm * 1e-6) + error
+    return x, y, rtt
+
+
+def test_fit_recovers_offset_and_drift():
+    fit = OnlineClockFit(window=256)
+    for pair in zip(*_pairs(200)):
+        fit.add(*pair)
+    fit.refit()
+    assert abs(fit.forward(0.0) - 50.0) < 100e-6
+    assert abs((fit.params[2] - 1.0) * 1e6 - 30.0) < 5.0
+    assert np.isclose(fit.inverse(fit.forward(12.5)), 12.5)
+
+
+def test_estimate_is_replaced_as_a_whole():
+    # A reader holding params keeps a consistent (x_ref, offset, slope) while a fit runs
+    fit = OnlineClockFit(window=256, refit_every=1)
+    assert not fit.ready
+    x, y, rtt = _pairs(40)
+    fit.add_many(x[:20], y[:20], rtt[:20])
+    params = fit.params
+    before = tuple(params)
+    fit.add_many(x[20:], y[20:] + 1e-3, rtt[20:])
+    assert fit.params is not params and fit.params[1] != before[1]
+    assert params == before  # not updated in place
+    assert fit.params[0] == params[0] == x[0]
+
+
+def test_refits_on_a_cadence():
+    fit = OnlineClockFit(window=256, refit_every=16)
+    fits = []
+    fit._fit = lambda: fits.append(fit.count)
+    for pair in zip(*_pairs(64)):
+        fit.add(*pair)
+    # Every pair while the estimate settles, then every 16 pairs
+    assert fits == list(range(1, 17)) + [32, 48, 64]
+
+
+def test_add_many_fits_at_most_once():
+    fit = OnlineClockFit(window=256, refit_every=16)
+    fits = []
+    fit._fit = lambda: fits.append(fit.count)
+    x, y, rtt = _pairs(40)
+    fit.add_many(x[:20], y[:20], rtt[:20])
+    fit.add_many(x[20:25], y[20:25], rtt[20:25])
+    fit.add_many(x[25:40], y[25:40], rtt[25:40])
+    assert fits == [20, 40]
+
+
+def test_clock_sync_maps_the_fake_tracker_clocks():
+    backend = FakeTobiiResearch()
+    tracker = backend.eyetrackers[0]
+    clock = ClockSync(tracker, backend=backend)
+    clock.start()
+    try:
+        time.sleep(1.2)
+    finally:
+        clock.stop()
+    clock.device_fit.refit()
+    t = clock.system_to_common(backend.get_system_time_stamp())
+    assert abs(t - time.perf_counter()) < 1e-3
+    system = backend.get_system_time_stamp()
+    assert abs(clock.device_to_common(tracker.device_time_stamp(system)) - clock.system_to_common(system)) < 1e-3
+    status = clock.status()
+    assert status['system']['measurements'] >= 20 and status['device']['measurements'] >= 2
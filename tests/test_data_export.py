@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from BatchAnalysis import discover_sessions, load_session_streams
+from DataExport import export_session, load_streams, read_csv, write_csv
+from GazeBuffer import MARKER_DTYPE, WEBCAM_DTYPE
+
+
+def _streams():
+    webcam = np.zeros(50, dtype=WEBCAM_DTYPE)
+    webcam['system_timestamp'] = np.arange(50) / 30 + 1e6  # full precision of a real timestamp
+    webcam['right_eye_x'] = np.linspace(100, 200, 50)
+    webcam['backend'][25:] = 1
+    markers = np.array([(1e6, 0, 'Start, stimulus'), (1e6 + 1.5, 45, 'say "end"')], dtype=MARKER_DTYPE)
+    return {'webcam': webcam, 'webcam_markers': markers}
+
+
+def test_csv_round_trip_keeps_commas_and_quotes(tmp_path):
+    markers = _streams()['webcam_markers']
+    path = str(tmp_path / 'markers.csv')
+    write_csv(path, markers)
+    np.testing.assert_array_equal(read_csv(path, MARKER_DTYPE), markers)
+
+
+@pytest.mark.parametrize('fmt', ['npy', 'npz', 'csv'])
+def test_exported_session_loads_back(tmp_path, fmt):
+    streams = _streams()
+    export_session(str(tmp_path), '20240101_120000', streams, {'participant_id': 'P01'}, fmt=fmt)
+    if fmt == 'csv':
+        sessions = discover_sessions(str(tmp_path))
+        assert len(sessions) == 1
+        loaded, metadata = load_session_streams(sessions[0])
+        assert metadata['participant_id'] == 'P01'
+    else:
+        suffix = '.npz' if fmt == 'npz' else ''
+        loaded = load_streams(str(tmp_path / f'session_data_20240101_120000{suffix}'))
+    for name, data in streams.items():
+        np.testing.assert_array_equal(loaded[name], data)
@@ -0,0 +1,117 @@
+import math
+import time
+
+import numpy as np
+import pytest
+
+from EventDetector import (EventDetector, binocular_gaze, binocular_gaze_array, same_events,
+                           FIXATION, FIXATION_START, SACCADE, BLINK)
+from FakeDevices import FakeTobiiResearch
+from GazeBuffer import TOBII_DTYPE
+from Tobii import Tobii
+
+
+def _recording(frequency=600.0, seed=0):
+    # Four 300 ms fixations joined by 30 ms saccades, with a 150 ms blink
+    # in the third fixation and a stretch where only the right eye is valid
+    rng = np.random.default_rng(seed)
+    targets = [(0.2, 0.3), (0.7, 0.3), (0.7, 0.8), (0.2, 0.6)]
+    x, y = [], []
+    for i, (tx, ty) in enumerate(targets):
+        if i:
+            px, py = targets[i - 1]
+            steps = np.linspace(0, 1, int(0.03 * frequency), endpoint=False)
+            x.extend(px + (tx - px) * steps)
+            y.extend(py + (ty - py) * steps)
+        n = int(0.3 * frequency)
+        x.extend(tx + rng.normal(0, 0.001, n))
+        y.extend(ty + rng.normal(0, 0.001, n))
+    n = len(x)
+    data = np.zeros(n, dtype=TOBII_DTYPE)
+    data['system_timestamp'] = 10.0 + np.arange(n) / frequency
+    for eye in ('left', 'right'):
+        data[eye + '_gaze_x'] = x
+        data[eye + '_gaze_y'] = y
+        data[eye + '_gaze_validity'] = 1
+    blink = slice(int(0.75 * frequency), int(0.9 * frequency))
+    data['left_gaze_validity'][blink] = 0
+    data['right_gaze_validity'][blink] = 0
+    data['left_gaze_validity'][int(1.1 * frequency):int(1.2 * frequency)] = 0
+    return data
+
+
+def _online(detector, data):
+    x, y = binocular_gaze_array(data)
+    for t, gx, gy in zip(data['system_timestamp'].tolist(), x.tolist(), y.tolist()):
+        detector.add(t, gx, gy)
+    detector.flush()
+    return detector.get_events()
+
+
+@pytest.mark.parametrize('method', ['ivt', 'idt'])
+def test_online_and_offline_give_the_same_events(method):
+    data = _recording()
+    detector = EventDetector(method, frequency=600.0)
+    online = _online(detector, data)
+    offline = EventDetector(method, frequency=600.0).detect(data)
+    assert same_events(online, offline)
+    fixations = online[online['event'] == FIXATION]
+    # The blink splits the third fixation in two
+    assert len(fixations) == 5
+    assert np.sum(online['event'] == FIXATION_START) == 5
+    assert np.sum(online['event'] == BLINK) == 1
+    assert np.sum(online['event'] == SACCADE) >= 3
+    assert np.allclose(fixations['x'][[0, 1, 4]], [0.2, 0.7, 0.2], atol=0.01)
+
+
+@pytest.mark.parametrize('method', ['ivt', 'idt'])
+def test_recording_ending_without_a_valid_sample(method):
+    data = _recording()[:700]
+    data['left_gaze_validity'][-30:] = 0
+    data['right_gaze_validity'][-30:] = 0
+    online = _online(EventDetector(method, frequency=600.0), data)
+    assert same_events(online, EventDetector(method, frequency=600.0).detect(data))
+
+
+def test_subscribers_and_current_fixation():
+    data = _recording()
+    detector = EventDetector('ivt', frequency=600.0)
+    received = []
+    detector.subscribe(received.append)
+    x, y = binocular_gaze_array(data)
+    for i in range(120):
+        detector.add(data['system_timestamp'][i], x[i], y[i])
+    assert detector.current_fixation is not None
+    assert [event[0] for event in received] == [FIXATION_START]
+    detector.reset()
+    assert len(detector.get_events()) == 0 and detector.current_fixation is None
+
+
+def test_binocular_gaze_matches_the_recorded_columns():
+    sample = {
+        'left_gaze_point_on_display_area': (0.1234567, 0.2),
+        'right_gaze_point_on_display_area': (0.3, 0.4),
+        'left_gaze_point_validity': 1,
+        'right_gaze_point_validity': 0,
+    }
+    data = np.zeros(1, dtype=TOBII_DTYPE)
+    data['left_gaze_x'], data['left_gaze_y'] = 0.1234567, 0.2
+    data['right_gaze_x'], data['right_gaze_y'] = 0.3, 0.4
+    data['left_gaze_validity'] = 1
+    x, y = binocular_gaze_array(data)
+    assert binocular_gaze(sample) == (x[0], y[0])
+    sample['left_gaze_point_validity'] = 0
+    assert all(math.isnan(v) for v in binocular_gaze(sample))
+    with pytest.raises(ValueError):
+        EventDetector('hmm')
+
+
+def test_detector_attached_to_a_simulated_tracker():
+    tobii = Tobii(FakeTobiiResearch(frequency=600))
+    detector = EventDetector('ivt', frequency=600)
+    tobii.attach_detector(detector)
+    tobii.start_recording()
+    time.sleep(1.5)
+    tobii.stop_recording()
+    online = detector.get_events()
+    assert len(online) and same_events(online, detector.detect(tobii.get_data()))
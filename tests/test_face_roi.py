@@ -0,0 +1,71 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from FaceRoi import FaceRoi, FACE_EXTENT_LANDMARKS
+
+
+def _landmarks(points):
+    # FaceMesh-like landmark list with the face extent landmarks at the given normalized points
+    landmark = [SimpleNamespace(x=0.5, y=0.5) for _ in range(478)]
+    for index, (x, y) in zip(FACE_EXTENT_LANDMARKS, points):
+        landmark[index] = SimpleNamespace(x=x, y=y)
+    return landmark
+
+
+def test_full_frame_until_a_face_is_found():
+    roi = FaceRoi()
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    image, box = roi.crop(frame)
+    assert image is frame and box == (0, 0, 640, 480) and roi.full_frames == 1
+
+
+def test_box_follows_the_face_and_is_downscaled():
+    roi = FaceRoi(padding=0.25, target_width=128)
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    # Face from x 240 to 400 and y 160 to 320 in the full frame
+    roi.update(_landmarks([(0.5, 160 / 480), (0.5, 320 / 480), (240 / 640, 0.5), (400 / 640, 0.5)]),
+               (0, 0, 640, 480), frame.shape)
+    assert roi.box == (200, 120, 440, 360)
+    image, box = roi.crop(frame)
+    assert box == (200, 120, 240, 240) and image.shape[:2] == (128, 128) and roi.tracked_frames == 1
+
+    # Landmarks of the crop map back to frame pixels: the face moved 20 px to the right
+    shifted = [((x - 200 + 20) / 240, (y - 120) / 240) for x, y in ((320, 160), (320, 320), (240, 240), (400, 240))]
+    roi.update(_landmarks(shifted), box, frame.shape)
+    assert roi.box == (220, 120, 460, 360)
+
+
+def test_box_is_clipped_to_the_frame_and_reset_counts_losses():
+    roi = FaceRoi(padding=0.35, min_size=96)
+    shape = (480, 640, 3)
+    roi.update(_landmarks([(0.99, 0.0), (0.99, 0.05), (0.98, 0.02), (1.0, 0.02)]), (0, 0, 640, 480), shape)
+    x0, y0, x1, y1 = roi.box
+    assert x1 == 640 and y0 == 0 and x1 - x0 <= 96 and y1 - y0 <= 96
+    roi.reset()
+    roi.reset()
+    assert roi.box is None and roi.lost == 1
+
+
+def test_evaluate_roi_leaves_the_recording_state_alone(tmp_path, monkeypatch):
+    import cv2
+    from Webcam import Webcam
+
+    path = str(tmp_path / 'clip.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 30, (640, 480))
+    for _ in range(5):
+        writer.write(np.zeros((480, 640, 3), dtype=np.uint8))
+    writer.release()
+
+    results = SimpleNamespace(multi_face_landmarks=[SimpleNamespace(
+        landmark=_landmarks([(0.5, 0.3), (0.5, 0.7), (0.4, 0.5), (0.6, 0.5)]))])
+    webcam = Webcam(show_preview=False)
+    monkeypatch.setattr(webcam, '_create_face_mesh', lambda: SimpleNamespace(process=lambda image: results))
+    webcam.frame_width, webcam.frame_height = 1280, 720
+    rois, backends = webcam.rois, webcam.backends
+
+    report = webcam.evaluate_roi(path)
+    assert report['frames'] == 5 and report['missed_full'] == 0 and report['missed_roi'] == 0
+    assert (webcam.frame_width, webcam.frame_height) == (1280, 720)
+    assert webcam.rois is rois and webcam.rois == []
+    assert webcam.backends is backends and webcam.backends == []
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from Filters import OneEuroFilter, KalmanFilter, MedianFilter, PerEyeFilter, smooth, WEBCAM_COLUMNS
+from GazeBuffer import WEBCAM_DTYPE
+
+FILTERS = [OneEuroFilter, KalmanFilter, MedianFilter]
+
+
+def _recording(n=3000, seed=0):
+    # Noisy fixations at 30 Hz with frames without a face and a gap longer than max_gap
+    rng = np.random.default_rng(seed)
+    data = np.zeros(n, dtype=WEBCAM_DTYPE)
+    t = np.arange(n) / 30
+    t[n // 2:] += 1.0
+    data['system_timestamp'] = t
+    truth = np.repeat(rng.uniform(200, 440, n // 30 + 1), 30)[:n]
+    for name in WEBCAM_COLUMNS:
+        data[name] = truth + rng.normal(0, 2, n)
+    data['right_eye_x'][rng.random(n) < 0.05] = np.nan
+    return data, truth
+
+
+def _stream(gaze_filter, data):
+    gaze_filter = PerEyeFilter(gaze_filter)
+    return np.array([gaze_filter.filter(t, row) for t, row in
+                     zip(data['system_timestamp'].tolist(), data[list(WEBCAM_COLUMNS)].tolist())])
+
+
+def _columns(data):
+    return np.column_stack([data[name] for name in WEBCAM_COLUMNS])
+
+
+@pytest.mark.parametrize('filter_class', FILTERS)
+def test_batch_and_stream_give_the_same_result(filter_class):
+    data, _ = _recording()
+    gaze_filter = filter_class()
+    stream = _stream(gaze_filter, data)
+    for chunk_size in (len(data), 257, 1):
+        batch = _columns(smooth(data, gaze_filter, chunk_size=chunk_size))
+        assert np.allclose(stream, batch, equal_nan=True, rtol=0, atol=1e-3)
+
+
+@pytest.mark.parametrize('filter_class', FILTERS)
+def test_frames_without_a_face_stay_missing(filter_class):
+    data, truth = _recording()
+    smoothed = smooth(data, filter_class())
+    missing = np.isnan(data['right_eye_x'])
+    assert np.isnan(smoothed['right_eye_x'][missing]).all() and np.isnan(smoothed['right_eye_y'][missing]).all()
+    assert np.isfinite(_columns(smoothed)[~missing]).all()
+    # The other eye is smoothed on its own
+    assert np.isfinite(smoothed['left_eye_x']).all() and np.isfinite(smoothed['left_eye_y']).all()
+    # Fixation samples, once the filter caught up with the jump
+    settled = (np.arange(len(data)) % 30 >= 10) & ~missing
+    error = np.mean(np.abs(smoothed['left_eye_x'] - truth)[settled])
+    assert error < np.mean(np.abs(data['left_eye_x'] - truth)[settled])
+
+
+@pytest.mark.parametrize('filter_class', FILTERS)
+def test_restart_after_a_long_gap(filter_class):
+    gaze_filter = filter_class()
+    gaze_filter.filter(0.0, [0.0, 0.0])
+    gaze_filter.filter(0.033, [0.0, 0.0])
+    # Past max_gap the previous position has no influence
+    assert np.allclose(gaze_filter.filter(1.0, [100.0, 50.0]), [100.0, 50.0])
+
+
+def test_median_removes_a_single_frame_outlier():
+    gaze_filter = MedianFilter(window=5)
+    out = [gaze_filter.filter(i / 30, [10.0 if i != 6 else 500.0]) for i in range(10)]
+    assert np.allclose(out, 10.0)
+
+
+@pytest.mark.parametrize('filter_class', FILTERS)
+def test_one_lost_eye_keeps_the_other(filter_class):
+    gaze_filter = PerEyeFilter(filter_class())
+    gaze_filter.filter(0.0, [1.0, 2.0, 3.0, 4.0])
+    out = gaze_filter.filter(0.033, [np.nan, np.nan, 3.0, 4.0])
+    assert np.isnan(out[:2]).all()
+    assert np.allclose(out[2:], [3.0, 4.0])
+    # Smoothed together, the sample would be a gap for both eyes
+    assert np.isnan(filter_class().filter(0.0, [np.nan, np.nan, 3.0, 4.0])).all()
@@ -0,0 +1,82 @@
+import threading
+import time
+
+import pytest
+
+from FakeDevices import SyntheticCamera
+from FramePipeline import FrameQueue, FramePipeline, DROP_OLDEST, KEEP_LATEST, BLOCK
+
+
+def test_drop_oldest_keeps_the_newest_frames():
+    queue = FrameQueue(3, DROP_OLDEST)
+    dropped = [queue.put(i) for i in range(5)]
+    assert dropped == [[], [], [], [0], [1]]
+    assert [queue.get(0) for _ in range(3)] == [2, 3, 4]
+    assert queue.get(0) is None
+
+
+def test_keep_latest_only_keeps_the_last_frame():
+    queue = FrameQueue(3, KEEP_LATEST)
+    queue.put(0)
+    queue.put(1)
+    assert queue.put(2) == [1]
+    assert len(queue) == 1 and queue.get(0) == 2
+
+
+def test_block_waits_for_a_free_slot():
+    queue = FrameQueue(1, BLOCK)
+    queue.put(0)
+    put = threading.Thread(target=queue.put, args=(1,))
+    put.start()
+    time.sleep(0.05)
+    assert put.is_alive() and len(queue) == 1
+    assert queue.get(0) == 0
+    put.join(1.0)
+    assert not put.is_alive() and queue.get(0) == 1
+
+
+def test_close_wakes_up_a_blocked_put():
+    queue = FrameQueue(1, BLOCK)
+    queue.put(0)
+    result = []
+    put = threading.Thread(target=lambda: result.append(queue.put(1)))
+    put.start()
+    time.sleep(0.05)
+    assert queue.close() == [0]
+    put.join(1.0)
+    assert result == [[1]] and queue.get(0) is None
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        FrameQueue(1, 'drop_newest')
+
+
+@pytest.mark.parametrize('policy', [DROP_OLDEST, KEEP_LATEST, BLOCK])
+def test_pipeline_delivers_results_in_capture_order(policy):
+    results = []
+
+    def worker_factory():
+        def process(frame, index):
+            time.sleep(0.004 if index % 3 else 0.012)
+            return frame.shape
+        return process
+
+    camera = SyntheticCamera(64, 48, fps=1000.0, frames=120)
+    pipeline = FramePipeline(camera, worker_factory, lambda i, t, r: results.append((i, t)),
+                             num_workers=3, queue_size=2, policy=policy, max_read_failures=1)
+    pipeline.start()
+    deadline = time.monotonic() + 10.0
+    while pipeline.running and time.monotonic() < deadline:
+        time.sleep(0.01)
+    pipeline.stop(timeout=1.0)
+
+    stats = pipeline.stats()
+    indices = [i for i, _ in results]
+    timestamps = [t for _, t in results]
+    assert stats['captured'] == 120
+    assert stats['processed'] + stats['dropped'] == 120 and stats['failed'] == 0
+    assert indices == sorted(indices) and len(indices) == stats['processed']
+    assert timestamps == sorted(timestamps)
+    if policy == BLOCK:
+        assert stats['dropped'] == 0
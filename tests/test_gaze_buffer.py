@@ -0,0 +1,72 @@
+import time
+
+import numpy as np
+
+from GazeBuffer import GazeBuffer, TOBII_DTYPE, WEBCAM_DTYPE, tobii_record
+from FakeDevices import FakeTobiiResearch
+
+
+def test_append_grows_and_keeps_every_row():
+    buffer = GazeBuffer(WEBCAM_DTYPE, capacity=4, chunk_size=4)
+    for i in range(100):
+        buffer.append((i, i, i + 1, i + 2, i + 3, 0))
+    assert len(buffer) == 100 and buffer.capacity >= 100
+    assert np.array_equal(buffer.view()['system_timestamp'], np.arange(100))
+    assert np.array_equal(buffer.view()['left_eye_y'], np.arange(100) + 3)
+
+
+def test_growth_is_geometric():
+    buffer = GazeBuffer(WEBCAM_DTYPE, capacity=4, chunk_size=1)
+    capacities = set()
+    for i in range(1000):
+        buffer.append((i, 0, 0, 0, 0, 0))
+        capacities.add(buffer.capacity)
+    # Doubling from 4 to 1024 takes 9 reallocations
+    assert len(capacities) == 9
+
+
+def test_extend_past_the_capacity():
+    buffer = GazeBuffer(WEBCAM_DTYPE, capacity=8, chunk_size=8)
+    records = np.zeros(50, dtype=WEBCAM_DTYPE)
+    records['system_timestamp'] = np.arange(50)
+    buffer.extend(records[:5])
+    buffer.extend(records[5:])
+    assert np.array_equal(buffer.view(), records)
+
+
+def test_views_survive_growth_and_clear():
+    buffer = GazeBuffer(WEBCAM_DTYPE, capacity=4, chunk_size=4)
+    for i in range(4):
+        buffer.append((i, 0, 0, 0, 0, 0))
+    view = buffer.view()
+    for i in range(4, 20):
+        buffer.append((i, 0, 0, 0, 0, 0))
+    buffer.clear()
+    buffer.append((99, 0, 0, 0, 0, 0))
+    assert np.array_equal(view['system_timestamp'], np.arange(4))
+    assert len(buffer) == 1 and buffer.view()['system_timestamp'][0] == 99
+
+
+def test_tobii_record_flattens_the_sdk_dictionary():
+    backend = FakeTobiiResearch()
+    tracker = backend.eyetrackers[0]
+    samples = []
+    tracker.subscribe_to(backend.EYETRACKER_GAZE_DATA, samples.append, as_dictionary=True)
+    try:
+        deadline = time.monotonic() + 5.0
+        while len(samples) < 10 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        tracker.unsubscribe_from(backend.EYETRACKER_GAZE_DATA)
+    buffer = GazeBuffer(TOBII_DTYPE, capacity=2)
+    for sample in samples[:10]:
+        buffer.append(tobii_record(sample, 1.5))
+    data = buffer.view()
+    sample = samples[3]
+    assert data['system_timestamp'][3] == 1.5
+    assert data['system_time_stamp'][3] == sample['system_time_stamp']
+    assert data['device_time_stamp'][3] == sample['device_time_stamp']
+    assert np.isclose(data['left_gaze_x'][3], sample['left_gaze_point_on_display_area'][0], equal_nan=True)
+    assert np.isclose(data['right_origin_tbcs_z'][3],
+                      sample['right_gaze_origin_in_trackbox_coordinate_system'][2], equal_nan=True)
+    assert data['right_pupil_validity'][3] == sample['right_pupil_validity']
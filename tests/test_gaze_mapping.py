@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from GazeBuffer import WEBCAM_DTYPE, CONTOUR_DTYPE
+from GazeMapping import GazeModel, default_degree, eye_features, fit_webcam, match_contours
+
+
+def _session(rng, n=600):
+    # Iris positions as a smooth function of the screen position looked at
+    screen = rng.uniform(0.1, 0.9, (n, 2))
+    data = np.zeros(n, dtype=WEBCAM_DTYPE)
+    data['system_timestamp'] = np.arange(n) / 30
+    data['right_eye_x'] = 300 + 40 * screen[:, 0] + 5 * screen[:, 0] ** 2
+    data['right_eye_y'] = 200 + 25 * screen[:, 1]
+    data['left_eye_x'] = 360 + 40 * screen[:, 0]
+    data['left_eye_y'] = 200 + 25 * screen[:, 1] + 3 * screen[:, 0] * screen[:, 1]
+    return data, screen
+
+
+def test_model_recovers_a_quadratic_mapping():
+    rng = np.random.default_rng(0)
+    data, screen = _session(rng)
+    model = GazeModel().fit(eye_features(data), screen)
+    assert model.training_error < 0.01
+    mapped = model.map(data[:10])
+    np.testing.assert_allclose(np.column_stack([mapped['gaze_x'], mapped['gaze_y']]), screen[:10], atol=0.02)
+
+
+def test_contours_are_joined_on_the_timestamp():
+    data = np.zeros(5, dtype=WEBCAM_DTYPE)
+    data['system_timestamp'] = [1, 2, 3, 4, 5]
+    contours = np.zeros(3, dtype=CONTOUR_DTYPE)
+    contours['system_timestamp'] = [2, 4, 6]  # drained independently: not row for row
+    contours['right_eye'][:, 0, 0] = [20, 40, 60]
+    rows, matched = match_contours(data, contours)
+    np.testing.assert_array_equal(rows['system_timestamp'], [2, 4])
+    np.testing.assert_array_equal(matched['right_eye'][:, 0, 0], [20, 40])
+
+
+class _RecordedWebcam:
+
+    def __init__(self, data):
+        self.data = data
+        self.waited_for = None
+
+    def wait_for_samples(self, timestamp, timeout=1.0):
+        self.waited_for = timestamp
+        return True
+
+    def get_data(self):
+        return self.data
+
+    def get_contours(self):
+        return None
+
+
+def test_fit_webcam_uses_the_point_windows():
+    rng = np.random.default_rng(1)
+    points = [(0.1, 0.1), (0.9, 0.1), (0.5, 0.5), (0.1, 0.9), (0.9, 0.9), (0.3, 0.7)]
+    data = np.zeros(len(points) * 60, dtype=WEBCAM_DTYPE)
+    windows = []
+    for i, (x, y) in enumerate(points):
+        rows = slice(i * 60, (i + 1) * 60)
+        data['system_timestamp'][rows] = i * 2 + np.arange(60) / 30
+        data['right_eye_x'][rows] = 300 + 40 * x + rng.normal(0, 0.1, 60)
+        data['right_eye_y'][rows] = 200 + 25 * y + rng.normal(0, 0.1, 60)
+        data['left_eye_x'][rows] = 360 + 40 * x + rng.normal(0, 0.1, 60)
+        data['left_eye_y'][rows] = 200 + 25 * y + rng.normal(0, 0.1, 60)
+        windows.append((x, y, i * 2.0, i * 2.0 + 2.0))
+    webcam = _RecordedWebcam(data)
+    model = fit_webcam(webcam, windows, degree=1)
+    assert webcam.waited_for == windows[-1][3]
+    assert model.training_error < 0.05
+
+
+def test_few_targets_default_to_a_linear_model():
+    five = [(0.1, 0.1, 0, 1), (0.9, 0.1, 1, 2), (0.5, 0.5, 2, 3), (0.1, 0.9, 3, 4), (0.9, 0.9, 4, 5)]
+    assert default_degree(five) == 1
+    assert default_degree(five + five) == 1
+    grid = [(x, y, 0, 1) for x in (0.1, 0.3, 0.5, 0.7, 0.9) for y in (0.2, 0.8)]
+    assert default_degree(grid) == 2
+
+
+def test_fit_webcam_without_samples_raises():
+    webcam = _RecordedWebcam(np.zeros(0, dtype=WEBCAM_DTYPE))
+    with pytest.raises(ValueError):
+        fit_webcam(webcam, [(0.5, 0.5, 0.0, 2.0)])
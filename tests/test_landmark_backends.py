@@ -0,0 +1,142 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import LandmarkBackends
+from GazeBuffer import WEBCAM_BACKENDS
+from LandmarkBackends import LandmarkBackend, FaceMeshBackend, AdaptiveBackend
+
+
+class _Clock:
+
+    # Stands in for ClockSync.now in LandmarkBackends; the stub backends advance it
+    def __init__(self):
+        self.t = 0.0
+
+    def now(self):
+        return self.t
+
+
+class _CostlyBackend(LandmarkBackend):
+
+    # Takes `cost` seconds per frame: on the fake clock if one is given, otherwise
+    # as CPU time of the calling thread (cpu_times records what each frame used)
+    def __init__(self, name, cost, clock=None):
+        super().__init__(2)
+        self.name = name
+        self.cost = cost
+        self.clock = clock
+        self.cpu_times = []
+
+    def process(self, image):
+        if self.clock is not None:
+            self.clock.t += self.cost
+        else:
+            start = time.thread_time()
+            while time.thread_time() < start + self.cost:
+                pass
+            self.cpu_times.append(time.thread_time() - start)
+        self.points[:] = 0.5
+        return self
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(LandmarkBackends, 'now', clock.now)
+    return clock
+
+
+def _run(backend, frames):
+    codes = []
+    for _ in range(frames):
+        if backend.skip():
+            codes.append(None)
+        else:
+            codes.append(backend.process(None).code)
+    return codes
+
+
+def test_falls_back_while_the_primary_is_over_budget(clock):
+    primary = _CostlyBackend('face_mesh', 0.004, clock)
+    fallback = _CostlyBackend('cascade', 0.0005, clock)
+    adaptive = AdaptiveBackend(primary, fallback, frame_budget=0.002, probe_every=20, probe_frames=3)
+    codes = _run(adaptive, 60)
+    assert codes[0] == WEBCAM_BACKENDS.index('face_mesh')
+    assert adaptive.switches == 1
+    assert codes.count(WEBCAM_BACKENDS.index('cascade')) > 30
+
+    primary.cost = 0.0002  # e.g. the load went away: a probe switches back
+    codes = _run(adaptive, 200)
+    assert adaptive.active is primary
+    assert codes[-1] == WEBCAM_BACKENDS.index('face_mesh')
+
+
+def test_skips_frames_without_a_fallback(clock):
+    adaptive = AdaptiveBackend(_CostlyBackend('face_mesh', 0.003, clock), None, frame_budget=0.001)
+    codes = _run(adaptive, 80)
+    skipped = codes[40:].count(None)
+    assert adaptive.skipped == codes.count(None)
+    assert 26 <= skipped <= 27  # 2 of every 3 frames once the average settled
+
+
+def test_contention_counts_in_the_cost():
+    # The primary needs 2 ms of CPU per frame, within the 4 ms budget; with busy
+    # threads taking the GIL its frames last longer than the budget, and the
+    # adaptive backend falls back although no frame used more CPU than allowed
+    primary = _CostlyBackend('face_mesh', 0.002)
+    fallback = _CostlyBackend('cascade', 0.0001)
+    adaptive = AdaptiveBackend(primary, fallback, frame_budget=0.004, probe_every=1000, smoothing=0.5)
+    stop = threading.Event()
+
+    def spin():
+        while not stop.is_set():
+            pass
+
+    threads = [threading.Thread(target=spin, daemon=True) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    try:
+        for _ in range(50):
+            if adaptive.active is not primary:
+                break
+            adaptive.process(None)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    assert adaptive.active is fallback and adaptive.switches == 1
+    assert adaptive.cost[primary] > 0.004
+    assert np.mean(primary.cpu_times) < 0.004
+
+
+def test_face_mesh_points_follow_the_indices():
+    landmarks = [SimpleNamespace(x=i / 1000, y=i / 2000) for i in range(478)]
+    results = SimpleNamespace(multi_face_landmarks=[SimpleNamespace(landmark=landmarks)])
+    face_mesh = SimpleNamespace(process=lambda image: results)
+    backend = FaceMeshBackend(face_mesh, [468, 473])
+    found = backend.process(np.zeros((48, 64, 3), dtype=np.uint8))
+    assert found is backend and found.code == WEBCAM_BACKENDS.index('face_mesh')
+    np.testing.assert_allclose(found.points, [[0.468, 0.234], [0.473, 0.2365]], rtol=1e-6)
+
+    results.multi_face_landmarks = []
+    assert backend.process(np.zeros((48, 64, 3), dtype=np.uint8)) is None
+
+
+def test_adaptive_webcam_only_skips_without_cascades(monkeypatch):
+    import Webcam
+
+    def no_cascades(*args, **kwargs):
+        raise RuntimeError("this OpenCV build has no CascadeClassifier")
+
+    monkeypatch.setattr(Webcam, 'CascadeBackend', no_cascades)
+    webcam = Webcam.Webcam(show_preview=False, backend='adaptive')
+    face_mesh = SimpleNamespace(process=lambda image: SimpleNamespace(multi_face_landmarks=[]))
+    monkeypatch.setattr(webcam, '_create_face_mesh', lambda: face_mesh)
+    backend = webcam._create_backend([468, 473])
+    assert isinstance(backend, AdaptiveBackend)
+    assert backend.fallback is None
@@ -0,0 +1,77 @@
+import time
+
+import numpy as np
+import pytest
+
+from FakeDevices import FakeTobiiResearch
+from GazeBuffer import EVENT_DTYPE
+from MarkerBus import MarkerBus, samples_between
+from SessionWriter import SessionWriter, recover_session
+from Tobii import Tobii
+
+
+class _Recorder:
+
+    def __init__(self):
+        self.markers = []
+
+    def add_marker(self, marker, timestamp=None):
+        self.markers.append((marker, timestamp))
+
+
+def test_every_recorder_gets_the_same_timestamp():
+    first, second = _Recorder(), _Recorder()
+    bus = MarkerBus(first)
+    bus.register(second)
+    start = bus.publish('Start stimulus')
+    end = bus.publish('End stimulus', timestamp=start + 1.0)
+    assert first.markers == second.markers == [('Start stimulus', start), ('End stimulus', start + 1.0)]
+    assert bus.get_markers()['system_timestamp'].tolist() == [start, end]
+
+
+def test_time_of_occurrences():
+    bus = MarkerBus()
+    for trial in range(3):
+        bus.publish('trial', timestamp=10.0 + trial)
+    assert bus.time_of('trial') == 10.0 and bus.time_of('trial', 2) == 12.0 and bus.time_of('trial', -1) == 12.0
+    with pytest.raises(KeyError):
+        bus.time_of('missing')
+    bus.clear()
+    assert len(bus.get_markers()) == 0
+    with pytest.raises(KeyError):
+        bus.time_of('trial')
+
+
+def test_samples_between_is_a_view_of_the_window():
+    data = np.zeros(100, dtype=EVENT_DTYPE)
+    data['onset'] = np.arange(100) / 10
+    window = samples_between(data, 2.0, 3.0, column='onset')
+    assert window['onset'].tolist() == (np.arange(20, 30) / 10).tolist()
+    assert np.shares_memory(window, data)
+
+
+def test_markers_of_a_simulated_tracker(tmp_path):
+    tobii = Tobii(FakeTobiiResearch())
+    bus = MarkerBus(tobii)
+    writer = SessionWriter(str(tmp_path / 'session'))
+    bus.attach_writer(writer)
+    writer.start()
+    tobii.start_recording()
+    time.sleep(0.2)
+    bus.publish('Start stimulus')
+    time.sleep(0.3)
+    bus.publish('End stimulus')
+    tobii.stop_recording()
+    writer.close()
+
+    markers = tobii.get_markers()
+    assert markers['marker'].tolist() == ['Start stimulus', 'End stimulus']
+    assert markers['system_timestamp'].tolist() == bus.get_markers()['system_timestamp'].tolist()
+    window = bus.between(tobii.get_data(), 'Start stimulus', 'End stimulus')
+    assert 100 < len(window) < 250
+    # sample_index is the number of samples received when the marker was added,
+    # a sample stamped just before the marker may still have been in flight
+    first = np.searchsorted(tobii.get_data()['system_timestamp'], markers['system_timestamp'][0])
+    assert abs(markers['sample_index'][0] - first) <= 2
+    streams = recover_session(str(tmp_path / 'session'))
+    assert streams['markers'].tolist() == bus.get_markers().tolist()
@@ -0,0 +1,84 @@
+import json
+import threading
+
+import numpy as np
+
+from Metrics import LatencyHistogram, Metrics
+
+
+def test_buckets_cover_the_range_without_gaps():
+    histogram = LatencyHistogram(sub_bits=4, max_exponent=26)
+    lower, upper = histogram.bucket_bounds()
+    assert lower[0] == 0 and np.array_equal(lower[1:], upper[:-1])
+    assert upper[-1] == 2 ** 26
+    # Exact below 2**sub_bits us, then never wider than 1/16 of the value
+    assert np.all(upper[:16] - lower[:16] == 1)
+    assert np.all((upper - lower)[16:] / lower[16:] <= 1 / 16)
+
+
+def test_every_value_lands_in_its_bucket():
+    histogram = LatencyHistogram()
+    lower, upper = histogram.bucket_bounds()
+    for value in [0, 1, 15, 16, 17, 31, 32, 33, 1000, 123456, 2 ** 26 - 1]:
+        histogram.reset()
+        histogram.record(value * 1e-6 + 1e-9)
+        index = histogram.counts.index(1)
+        assert lower[index] <= value < upper[index]
+
+
+def test_large_values_go_to_the_last_bucket():
+    histogram = LatencyHistogram()
+    histogram.record(3600.0)
+    assert histogram.counts[-1] == 1 and histogram.max == 3600 * 10 ** 6
+
+
+def test_percentiles_within_the_bucket_precision():
+    rng = np.random.default_rng(0)
+    values = rng.lognormal(np.log(2e-3), 0.7, 20000)
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    for q in (50, 90, 99):
+        exact = np.percentile(values * 1e6, q)
+        assert abs(histogram.percentile(q) - exact) / exact < 1 / 16
+    snapshot = histogram.snapshot()
+    assert snapshot['count'] == 20000 and snapshot['max_us'] == int(values.max() * 1e6)
+    assert np.isclose(snapshot['mean_us'], np.mean(np.floor(values * 1e6)))
+    assert LatencyHistogram().snapshot() == {'count': 0}
+
+
+def test_merge_adds_the_counts():
+    a, b = LatencyHistogram(), LatencyHistogram()
+    a.record(10e-6)
+    b.record(10e-6)
+    b.record(1.0)
+    a.merge(b)
+    assert a.count == 3 and sum(a.counts) == 3 and a.max == 10 ** 6
+
+
+def test_metrics_snapshot_and_dump(tmp_path):
+    metrics = Metrics()
+    record = metrics.stage('read').record
+
+    def work():
+        for _ in range(1000):
+            record(1e-4)
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    metrics.stage('idle')
+    metrics.count('frames', 3)
+    metrics.count('frames')
+
+    snapshot = metrics.snapshot()
+    assert metrics.stage('read') is metrics.stages['read']
+    assert list(snapshot['stages']) == ['read']
+    # Increments are not locked, a few may be lost under contention
+    assert 3900 <= snapshot['stages']['read']['count'] <= 4000
+    assert snapshot['counters'] == {'frames': 4}
+    metrics.dump(tmp_path / 'metrics.json')
+    assert json.loads((tmp_path / 'metrics.json').read_text())['counters'] == {'frames': 4}
+    metrics.reset()
+    assert metrics.snapshot()['stages'] == {} and metrics.snapshot()['counters'] == {}
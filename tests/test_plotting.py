@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from Plotting import minmax_decimate, lttb_decimate, decimate
+
+
+def _trace(n=100000, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(n) / 600
+    y = np.cumsum(rng.normal(0, 1, n))
+    y[rng.integers(0, n, 20)] += 500     # single-sample spikes
+    y[40000:40100] = np.nan               # a blink
+    return t, y
+
+
+def test_minmax_keeps_the_envelope_of_every_bucket():
+    t, y = _trace()
+    width = (t[-1] - t[0]) / 800
+    out_t, out_y = minmax_decimate(t, y, width, origin=t[0])
+    assert len(out_t) <= 2 * 801 and np.all(np.diff(out_t) >= 0)
+    bucket = np.floor((t - t[0]) / width).astype(np.int64)
+    kept_bucket = np.floor((out_t - t[0]) / width).astype(np.int64)
+    for b in np.unique(bucket)[::37]:
+        values = y[bucket == b]
+        kept = out_y[kept_bucket == b]
+        if np.isnan(values).all():
+            assert np.isnan(kept).all()
+        else:
+            assert np.nanmin(kept) == np.nanmin(values) and np.nanmax(kept) == np.nanmax(values)
+    # Every spike survives
+    assert np.nanmax(out_y) == np.nanmax(y)
+
+
+def test_minmax_gap_breaks_the_line():
+    t = np.arange(10.0)
+    y = np.array([0, 1, np.nan, np.nan, np.nan, np.nan, 2, 3, 4, 5])
+    out_t, out_y = minmax_decimate(t, y, 2.0)
+    assert np.isnan(out_y[2:6]).all() and np.isfinite(np.delete(out_y, [2, 3, 4, 5])).all()
+
+
+def test_minmax_in_pieces_equals_all_at_once():
+    t, y = _trace()
+    whole = minmax_decimate(t, y, 0.125, origin=0.0)
+    split = 50025   # a bucket boundary, 75 samples per bucket
+    first = minmax_decimate(t[:split], y[:split], 0.125, origin=0.0)
+    second = minmax_decimate(t[split:], y[split:], 0.125, origin=0.0)
+    assert np.array_equal(whole[0], np.concatenate([first[0], second[0]]))
+    assert np.array_equal(whole[1], np.concatenate([first[1], second[1]]), equal_nan=True)
+
+
+def test_lttb_keeps_the_ends_and_the_spikes():
+    t, y = _trace()
+    out_t, out_y = lttb_decimate(t, y, 1000)
+    finite = np.isfinite(out_y)
+    assert finite.sum() == 1000 and np.all(np.diff(out_t) >= 0)
+    assert out_t[0] == t[0] and out_t[-1] == t[-1]
+    assert np.nanmax(out_y) == np.nanmax(y)
+    # One NaN point where the blink interrupts the trace
+    assert (~finite).sum() == 1
+
+
+def test_lttb_short_trace_is_returned_as_is():
+    t = np.arange(5.0)
+    out_t, out_y = lttb_decimate(t, t * 2, 10)
+    assert np.array_equal(out_t, t) and np.array_equal(out_y, t * 2)
+
+
+@pytest.mark.parametrize('method', ['minmax', 'lttb'])
+def test_decimate_to_a_pixel_budget(method):
+    t, y = _trace()
+    out_t, out_y = decimate(t, y, width_px=500, method=method)
+    assert len(out_t) <= 1002
+    empty_t, empty_y = decimate(np.empty(0), np.empty(0), method=method)
+    assert len(empty_t) == 0 and len(empty_y) == 0
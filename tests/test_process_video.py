@@ -0,0 +1,32 @@
+import numpy as np
+
+from VideoRecorder import FRAME_TIMESTAMP_DTYPE
+from Webcam import _frame_timestamps
+
+
+def _sidecar(times):
+    timestamps = np.empty(len(times), dtype=FRAME_TIMESTAMP_DTYPE)
+    timestamps['frame_index'] = np.arange(len(times))
+    timestamps['system_timestamp'] = times
+    return timestamps
+
+
+def test_complete_sidecar_gives_the_grab_times():
+    timestamps = _sidecar(100.0 + np.arange(10) * 0.04)
+    frame_index = np.array([0, 3, 9])
+    assert np.array_equal(_frame_timestamps(frame_index, timestamps, 25.0),
+                          timestamps['system_timestamp'][frame_index])
+
+
+def test_short_sidecar_keeps_the_covered_frames_and_extrapolates_the_rest():
+    # A crashed recording: the sidecar stops two frames before the video
+    timestamps = _sidecar(100.0 + np.arange(8) * 0.04)
+    frame_index = np.array([0, 5, 7, 8, 9])
+    result = _frame_timestamps(frame_index, timestamps, 25.0)
+    assert np.array_equal(result[:3], timestamps['system_timestamp'][[0, 5, 7]])
+    assert np.allclose(result[3:], 100.0 + np.array([8, 9]) * 0.04)
+
+
+def test_without_sidecar_uses_the_frame_rate():
+    frame_index = np.array([0, 10, 20])
+    assert np.allclose(_frame_timestamps(frame_index, None, 10.0), [0.0, 1.0, 2.0])
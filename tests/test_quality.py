@@ -0,0 +1,103 @@
+import json
+import math
+
+import numpy as np
+import pytest
+
+from GazeBuffer import TOBII_DTYPE, WEBCAM_DTYPE, STIMULUS_DTYPE
+from Quality import (StreamQuality, TOBII_EYES, WEBCAM_EYES, display_degrees, stimulus_epochs, epoch_quality,
+                     session_quality, write_report)
+
+
+def _tobii(n=6000, frequency=600.0, seed=0):
+    # Noisy fixations with 5% of the samples lost and the left eye invalid for a while
+    rng = np.random.default_rng(seed)
+    t = np.arange(n) / frequency
+    keep = rng.random(n) >= 0.05
+    data = np.zeros(keep.sum(), dtype=TOBII_DTYPE)
+    data['system_timestamp'] = t[keep]
+    for eye in ('left', 'right'):
+        data[eye + '_gaze_x'] = 0.5 + rng.normal(0, 0.002, len(data))
+        data[eye + '_gaze_y'] = 0.5 + rng.normal(0, 0.002, len(data))
+        data[eye + '_gaze_validity'] = 1
+    data['left_gaze_validity'][:len(data) // 4] = 0
+    return data
+
+
+def test_chunked_updates_equal_one_update():
+    data = _tobii()
+    whole = StreamQuality(TOBII_EYES, 600.0, display_degrees(), 'deg').update(data).report()
+    quality = StreamQuality(TOBII_EYES, 600.0, display_degrees(), 'deg')
+    for start in range(0, len(data), 777):
+        quality.update(data[start:start + 777])
+    chunked = quality.report()
+    assert chunked.keys() == whole.keys()
+    for key in whole:
+        assert chunked[key] == pytest.approx(whole[key], rel=1e-9)
+
+
+def test_rates_loss_and_validity():
+    data = _tobii()
+    report = StreamQuality(TOBII_EYES, 600.0).update(data).report()
+    assert report['samples'] == len(data)
+    assert report['data_loss'] == pytest.approx(0.05, abs=0.01)
+    assert report['missing_samples'] + len(data) == pytest.approx(6000, abs=2)
+    assert report['effective_rate_hz'] == pytest.approx(570, rel=0.02)
+    assert report['right_validity'] == 1.0 and report['left_validity'] == pytest.approx(0.75, abs=0.01)
+    # Independent noise of 0.002 per axis: sample-to-sample RMS of 0.002 * 2
+    assert report['right_precision_rms_px'] == pytest.approx(0.004, rel=0.05)
+
+
+def test_frequency_is_estimated_and_missing_faces_count_as_invalid():
+    webcam = np.zeros(300, dtype=WEBCAM_DTYPE)
+    webcam['system_timestamp'] = np.arange(300) / 30
+    webcam['right_eye_x'][::10] = np.nan
+    report = StreamQuality(WEBCAM_EYES).update(webcam).report()
+    assert report['nominal_rate_hz'] == pytest.approx(30.0)
+    assert report['right_validity'] == pytest.approx(0.9) and report['left_validity'] == 1.0
+    assert StreamQuality(WEBCAM_EYES).update(webcam[:1]).report() == {'samples': 1}
+
+
+def test_epoch_quality_matches_a_loop():
+    rng = np.random.default_rng(1)
+    t = np.sort(rng.uniform(0, 10, 3000))
+    x = rng.normal(0.5, 0.05, 3000)
+    y = rng.normal(0.5, 0.05, 3000)
+    valid = rng.random(3000) > 0.1
+    epochs = (np.array([1.0, 4.0, 7.0, 9.5]), np.array([3.0, 6.0, 9.0, 9.6]),
+              np.array([0.4, 0.5, 0.6, 0.5]), np.array([0.5, 0.5, 0.5, 0.5]))
+    result = epoch_quality(t, x, y, valid, epochs, scale=(30.0, 20.0))
+    for i, (start, end, tx, ty) in enumerate(zip(*epochs)):
+        inside = (t >= start) & (t < end)
+        good = inside & valid
+        assert result['samples'][i] == inside.sum()
+        if not good.any():
+            assert math.isnan(result['accuracy'][i])
+            continue
+        assert result['validity'][i] == pytest.approx(good.sum() / inside.sum())
+        error = np.hypot((x[good] - tx) * 30.0, (y[good] - ty) * 20.0).mean()
+        assert result['accuracy'][i] == pytest.approx(error)
+        index = np.flatnonzero(inside)
+        pairs = good[index[1:]] & good[index[:-1]]
+        step = (np.diff(x[index]) * 30.0) ** 2 + (np.diff(y[index]) * 20.0) ** 2
+        assert result['precision_rms'][i] == pytest.approx(np.sqrt(step[pairs].mean()))
+
+
+def test_session_report(tmp_path):
+    tobii = _tobii()
+    stimulus = np.zeros(3, dtype=STIMULUS_DTYPE)
+    stimulus['system_timestamp'] = [0.5, 3.0, 12.0]
+    stimulus['stimulus_position'] = [0, 192, -192]
+    epochs = stimulus_epochs(stimulus, 1920)
+    assert epochs[1].tolist() == [2.5, 5.0, 14.0] and epochs[2].tolist() == [0.5, 0.6, 0.4]
+
+    report = session_quality({'tobii': tobii, 'stimulus': stimulus}, screen_width=1920)
+    # The recording ends at 10 s
+    assert report['epochs']['tobii']['samples'][2] == 0 and math.isnan(report['epochs']['tobii']['accuracy'][2])
+    # The gaze stays at the center: the first target is hit, the others are 10% of the width off
+    width_deg = display_degrees()[0]
+    assert report['epochs']['tobii']['accuracy'][0] < 0.2
+    assert report['epochs']['tobii']['accuracy'][1] == pytest.approx(0.1 * width_deg, rel=0.05)
+    path = write_report(str(tmp_path), report)
+    with open(path) as f:
+        assert json.load(f)['tobii']['samples'] == len(tobii)
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from GazeBuffer import TOBII_DTYPE, WEBCAM_DTYPE, MARKER_DTYPE
+from Replay import ReplayClock, SessionReplay
+
+
+def _session(seconds=1.0, seed=0):
+    rng = np.random.default_rng(seed)
+    tobii = np.zeros(int(seconds * 600), dtype=TOBII_DTYPE)
+    tobii['system_timestamp'] = 5000.0 + np.arange(len(tobii)) / 600
+    for eye in ('left', 'right'):
+        tobii[eye + '_gaze_x'] = rng.uniform(0, 1, len(tobii))
+        tobii[eye + '_gaze_y'] = rng.uniform(0, 1, len(tobii))
+        tobii[eye + '_gaze_validity'] = 1
+        tobii[eye + '_pupil_diameter'] = 3.0
+    tobii['right_gaze_validity'][100:150] = 0
+    webcam = np.zeros(int(seconds * 30), dtype=WEBCAM_DTYPE)
+    webcam['system_timestamp'] = 5000.01 + np.arange(len(webcam)) / 30
+    webcam['right_eye_x'] = rng.uniform(200, 400, len(webcam))
+    webcam['backend'][::3] = 1
+    tobii_markers = np.array([(tobii['system_timestamp'][120], 120, 'Start'),
+                              (tobii['system_timestamp'][240], 240, 'End')], dtype=MARKER_DTYPE)
+    webcam_markers = np.array([(tobii['system_timestamp'][120], 6, 'Start')], dtype=MARKER_DTYPE)
+    return {'tobii': tobii, 'webcam': webcam, 'tobii_markers': tobii_markers, 'webcam_markers': webcam_markers}
+
+
+def test_replay_clock():
+    clock = ReplayClock(speed=2.0)
+    clock.begin(100.0)
+    assert clock.time(104.0) - clock.start == pytest.approx(2.0)
+    fast = ReplayClock(speed=None)
+    fast.begin(100.0)
+    # As fast as possible: nothing waits, the recorded spacing is kept
+    assert fast.wait(1e6) - fast.start == pytest.approx(1e6 - 100.0)
+
+
+def test_fast_replay_reproduces_the_session():
+    session = _session()
+    replay = SessionReplay(session, speed=None)
+    results = replay.run()
+    assert results['tobii_samples'] == len(session['tobii'])
+    assert results['webcam_samples'] == len(session['webcam'])
+
+    tobii = replay.tobii.get_data()
+    for name in ('left_gaze_x', 'right_gaze_y', 'right_gaze_validity', 'left_pupil_diameter'):
+        np.testing.assert_array_equal(tobii[name], session['tobii'][name])
+    # Same timeline, shifted to the replay start
+    shift = tobii['system_timestamp'] - session['tobii']['system_timestamp']
+    assert np.ptp(shift) < 1e-3
+
+    webcam = replay.webcam.get_data()
+    np.testing.assert_array_equal(webcam['right_eye_x'], session['webcam']['right_eye_x'])
+    np.testing.assert_array_equal(webcam['backend'], session['webcam']['backend'])
+
+    markers = replay.tobii.get_markers()
+    assert markers['marker'].tolist() == ['Start', 'End']
+    assert markers['sample_index'].tolist() == [120, 240]
+    assert replay.webcam.get_markers()['sample_index'].tolist() == [6]
+
+
+def test_replay_keeps_the_recorded_speed():
+    session = _session(seconds=0.5)
+    results = SessionReplay(session, speed=2.0).run()
+    assert results['recorded_s'] == pytest.approx(0.5, abs=0.05)
+    assert results['speed'] == pytest.approx(2.0, rel=0.2)
@@ -0,0 +1,95 @@
+import os
+
+import numpy as np
+
+from FakeDevices import FakeTobiiResearch
+from GazeBuffer import TOBII_DTYPE, MARKER_DTYPE
+from SessionWriter import SessionWriter, recover_session
+from Tobii import Tobii
+
+
+def _rows(start, n):
+    rows = np.zeros(n, dtype=TOBII_DTYPE)
+    rows['system_time_stamp'] = np.arange(start, start + n)
+    return rows
+
+
+def test_written_rows_are_recovered(tmp_path):
+    writer = SessionWriter(str(tmp_path / 'session'))
+    writer.add_stream('tobii', TOBII_DTYPE)
+    writer.add_stream('tobii_markers', MARKER_DTYPE)
+    writer.start()
+    for start in range(0, 300, 100):
+        assert writer.write('tobii', _rows(start, 100))
+    writer.write('tobii_markers', np.array([(1.0, 5, 'Start stimulus')], dtype=MARKER_DTYPE), timeout=0.1)
+    writer.close()
+
+    streams = recover_session(str(tmp_path / 'session'))
+    np.testing.assert_array_equal(streams['tobii']['system_time_stamp'], np.arange(300))
+    assert streams['tobii_markers']['marker'][0] == 'Start stimulus'
+
+
+def test_truncated_chunk_keeps_the_rows_before_it(tmp_path):
+    writer = SessionWriter(str(tmp_path / 'session'))
+    writer.add_stream('tobii', TOBII_DTYPE)
+    writer.start()
+    writer.write('tobii', _rows(0, 100))
+    writer.write('tobii', _rows(100, 100))
+    writer.close()
+
+    # A crash in the middle of the last chunk
+    path = os.path.join(str(tmp_path / 'session'), 'tobii', '000000.chunk')
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 10)
+    streams = recover_session(str(tmp_path / 'session'))
+    np.testing.assert_array_equal(streams['tobii']['system_time_stamp'], np.arange(100))
+
+
+def test_full_queue_is_reported(tmp_path):
+    writer = SessionWriter(str(tmp_path / 'session'), queue_size=1)
+    writer.add_stream('tobii', TOBII_DTYPE)
+    assert writer.write('tobii', _rows(0, 10))
+    assert not writer.write('tobii', _rows(10, 10))
+    assert not writer.write('tobii', _rows(10, 10), timeout=0.01)
+    assert writer.lost_rows == 10  # the retried batch is counted once
+
+    writer.start()
+    assert writer.write('tobii', _rows(10, 10), timeout=None)
+    writer.close()
+    assert writer.lost_rows == 0
+
+
+def test_spill_retries_rows_the_full_queue_refused(tmp_path):
+    writer = SessionWriter(str(tmp_path / 'session'), queue_size=1)
+    tobii = Tobii(FakeTobiiResearch())
+    tobii.attach_writer(writer)
+    tobii.gaze_data.extend(_rows(0, 10))
+    tobii._spill()
+    tobii.gaze_data.extend(_rows(10, 10))
+    tobii._spill()  # queue full, the rows stay unspilled
+    assert tobii._spilled == 10
+
+    writer.start()
+    tobii.gaze_data.extend(_rows(20, 10))
+    while tobii._spilled < 30:
+        tobii._spill()  # retried until the writer thread made room in the queue
+    writer.close()
+    streams = recover_session(str(tmp_path / 'session'))
+    np.testing.assert_array_equal(streams['tobii']['system_time_stamp'], np.arange(30))
+
+
+def test_markers_refused_by_the_full_queue_are_written_at_stop(tmp_path):
+    writer = SessionWriter(str(tmp_path / 'session'), queue_size=1)
+    tobii = Tobii(FakeTobiiResearch())
+    tobii.attach_writer(writer)
+    tobii.start_recording()
+    writer.write('tobii', _rows(0, 10))  # fills the queue
+    tobii.add_marker('Start stimulus', timestamp=1.0)
+    tobii.add_marker('End stimulus', timestamp=2.0)
+    assert tobii._markers_spilled == 0
+
+    writer.start()
+    tobii.stop_recording()  # the final spill waits for room in the queue
+    writer.close()
+    streams = recover_session(str(tmp_path / 'session'))
+    assert list(streams['tobii_markers']['marker']) == ['Start stimulus', 'End stimulus']
@@ -0,0 +1,63 @@
+import numpy as np
+
+from GazeBuffer import WEBCAM_DTYPE
+from WebcamProcess import SharedRing
+
+
+def _record(i):
+    return (float(i), i, i, i, i, 0)
+
+
+def test_read_returns_new_records_in_order():
+    ring = SharedRing(WEBCAM_DTYPE, capacity=8)
+    try:
+        for i in range(5):
+            ring.append(_record(i))
+        data, end, lost = ring.read(0)
+        assert list(data['system_timestamp']) == [0, 1, 2, 3, 4]
+        assert (end, lost) == (5, 0)
+        for i in range(5, 11):  # wraps around the end of the ring
+            ring.append(_record(i))
+        data, end, lost = ring.read(end)
+        assert list(data['system_timestamp']) == [5, 6, 7, 8, 9, 10]
+        assert (end, lost) == (11, 0)
+    finally:
+        ring.close()
+
+
+def test_reader_capacity_behind_skips_the_slot_being_written():
+    # The next record goes into the slot of the oldest one, which may be half written
+    ring = SharedRing(WEBCAM_DTYPE, capacity=4)
+    try:
+        for i in range(4):
+            ring.append(_record(i))
+        data, end, lost = ring.read(0)
+        assert list(data['system_timestamp']) == [1, 2, 3]
+        assert (end, lost) == (4, 1)
+    finally:
+        ring.close()
+
+
+def test_overwritten_records_are_counted_as_lost():
+    ring = SharedRing(WEBCAM_DTYPE, capacity=4)
+    try:
+        for i in range(10):
+            ring.append(_record(i))
+        data, end, lost = ring.read(0)
+        assert list(data['system_timestamp']) == [7, 8, 9]
+        assert end == 10
+        assert lost + len(data) == 10
+    finally:
+        ring.close()
+
+
+def test_latest_is_the_last_record():
+    ring = SharedRing(WEBCAM_DTYPE, capacity=4)
+    try:
+        assert len(ring.latest()) == 0
+        for i in range(6):
+            ring.append(_record(i))
+        assert ring.latest()['system_timestamp'][0] == 5
+        np.testing.assert_array_equal(ring.latest(2)['system_timestamp'], [4, 5])
+    finally:
+        ring.close()
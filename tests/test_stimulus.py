@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+import Stimulus as stimulus_module
+from Stimulus import Stimulus
+
+TICK = 1e-5  # time one read of the clock takes
+
+
+class FakeClock:
+
+    # now() advances by TICK per call; waitKey(ms) sleeps ms plus the overshoot
+    # of a coarse OS timer and returns the next queued key
+
+    def __init__(self, overshoot=0.0, keys=()):
+        self.t = 100.0
+        self.overshoot = overshoot
+        self.keys = list(keys)
+        self.waits = []
+
+    def now(self):
+        self.t += TICK
+        return self.t
+
+    def wait_key(self, ms):
+        self.waits.append(ms)
+        self.t += ms / 1000 + self.overshoot
+        return self.keys.pop(0) if self.keys else -1
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(stimulus_module, 'now', clock.now)
+    monkeypatch.setattr(stimulus_module.cv2, 'waitKey', clock.wait_key)
+    return clock
+
+
+def _stimulus():
+    return Stimulus(64, 48, 38, 24, 64 / 38)
+
+
+def test_wait_until_ends_on_the_deadline(clock):
+    stimulus = _stimulus()
+    deadline = clock.t + 0.5
+    assert stimulus.wait_until(deadline)
+    assert deadline <= clock.t < deadline + 2 * TICK
+    assert max(clock.waits) <= stimulus.max_sleep * 1000
+
+
+def test_coarse_timer_overshoot_is_spun(clock):
+    # A Windows-like timer: every waitKey() slice ends 14.6 ms late
+    clock.overshoot = 0.0146
+    stimulus = _stimulus()
+    assert stimulus.measure_wait_overshoot() == pytest.approx(0.0146, abs=1e-4)
+    assert stimulus.spin_time >= 0.0146
+    for _ in range(5):
+        deadline = clock.t + 0.3
+        assert stimulus.wait_until(deadline)
+        assert deadline <= clock.t < deadline + 2 * TICK
+
+
+def test_wait_until_learns_a_larger_overshoot(clock):
+    stimulus = _stimulus()
+    clock.overshoot = 0.008
+    stimulus.wait_until(clock.t + 0.3)  # may be late once
+    assert stimulus.spin_time >= 0.008
+    deadline = clock.t + 0.3
+    stimulus.wait_until(deadline)
+    assert deadline <= clock.t < deadline + 2 * TICK
+
+
+def test_q_stops_the_wait(clock):
+    clock.keys = [-1, ord('q')]
+    stimulus = _stimulus()
+    deadline = clock.t + 1.0
+    assert not stimulus.wait_until(deadline)
+    assert clock.t < deadline
+    assert len(clock.waits) == 2
+
+
+def test_timing_stats():
+    stimulus = _stimulus()
+    assert stimulus.timing_stats() == {}
+    stimulus.timing['target_onsets'] = [1.0, 2.0, 3.0, 4.0]
+    stimulus.timing['issued'] = [1.0001, 2.0, 3.0002, 4.0001]
+    stimulus.timing['onsets'] = [1.010, 2.012, 3.010, 4.016]
+    stimulus.timing['display_times'] = [0.5, 0.5, 0.5, 0.5]
+    stimulus.timing['durations'] = [0.51, 0.49, 0.52]  # the last trial was interrupted
+
+    stats = stimulus.timing_stats()
+    assert stats['trials'] == 4
+    assert stats['schedule_error_mean_ms'] == pytest.approx(0.1)
+    assert stats['schedule_error_max_ms'] == pytest.approx(0.2)
+    assert stats['onset_jitter_mean_ms'] == pytest.approx(12.0)
+    assert stats['onset_jitter_std_ms'] == pytest.approx(np.std([10, 12, 10, 16]))
+    assert stats['onset_jitter_max_ms'] == pytest.approx(16.0)
+    assert stats['duration_error_mean_ms'] == pytest.approx(20 / 3)
+    assert stats['duration_error_max_ms'] == pytest.approx(20.0)
@@ -0,0 +1,111 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import Webcam as webcam_module
+from FakeDevices import SyntheticCamera
+from FramePipeline import BLOCK
+
+
+def _face_mesh():
+    # FaceMesh stand-in finding the same face on every frame
+    landmarks = [SimpleNamespace(x=0.5, y=0.4) for _ in range(478)]
+    results = SimpleNamespace(multi_face_landmarks=[SimpleNamespace(landmark=landmarks)])
+    return SimpleNamespace(process=lambda image: results)
+
+
+@pytest.fixture
+def gui_calls(monkeypatch):
+    # Every HighGUI call and flip made by the webcam, by name
+    calls = []
+    for name in ('imshow', 'waitKey', 'namedWindow', 'resizeWindow', 'destroyWindow', 'flip'):
+        original = getattr(webcam_module.cv2, name)
+
+        def record(*args, name=name, original=original):
+            calls.append(name)
+            return -1 if name == 'waitKey' else original(*args) if name == 'flip' else None
+
+        monkeypatch.setattr(webcam_module.cv2, name, record)
+    return calls
+
+
+def _webcam(monkeypatch, **args):
+    webcam = webcam_module.Webcam(**args)
+    drawn = []
+    monkeypatch.setattr(webcam, '_create_face_mesh', _face_mesh)
+    monkeypatch.setattr(webcam, '_draw_face_mesh', lambda frame, face: drawn.append(face))
+    return webcam, drawn
+
+
+def test_headless_recording_never_draws_or_shows(monkeypatch, gui_calls):
+    webcam, drawn = _webcam(monkeypatch, cam_index=lambda: SyntheticCamera(320, 240, fps=500, frames=40),
+                            show_preview=False, drop_policy=BLOCK)
+    recording = threading.Thread(target=webcam.start_recording_webcam)
+    recording.start()
+    deadline = time.monotonic() + 10
+    while len(webcam.get_data()) < 40 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    webcam.stop_recording()
+    recording.join(5)
+
+    assert not recording.is_alive()
+    assert len(webcam.get_data()) == 40
+    assert gui_calls == [] and drawn == []
+
+
+def test_preview_renders_every_nth_frame(monkeypatch, gui_calls):
+    webcam, drawn = _webcam(monkeypatch, show_preview=True, preview_every=3)
+    process = webcam._make_frame_processor()
+    frame = np.zeros((240, 320, 3), dtype=np.uint8)
+
+    previews = [process(frame, frame_index)[1] for frame_index in range(9)]
+    assert [preview is not None for preview in previews] == [i % 3 == 0 for i in range(9)]
+    assert len(drawn) == 3 and gui_calls == ['flip'] * 3
+    assert not frame.any()  # drawn on a copy
+
+    # Headless, a processor never renders a preview
+    webcam.show_preview = False
+    assert all(process(frame, frame_index)[1] is None for frame_index in range(9))
+    assert len(drawn) == 3
+
+
+def test_prepare_records_the_startup_timings(monkeypatch):
+    imported = []
+    monkeypatch.setattr(webcam_module, '_mediapipe', lambda: imported.append('mediapipe'))
+    webcam, _ = _webcam(monkeypatch, cam_index=lambda: SyntheticCamera(320, 240), show_preview=False, num_workers=2)
+    assert webcam.prepare()
+
+    assert imported == ['mediapipe']
+    assert set(webcam.startup) == {'camera_open_s', 'import_s', 'warmup_s', 'ready_s'}
+    assert all(seconds >= 0 for seconds in webcam.startup.values())
+    assert webcam.startup['ready_s'] >= webcam.startup['import_s'] + webcam.startup['warmup_s']
+    assert len(webcam._prepared) == 2
+    assert webcam.metrics.snapshot()['counters'] == {}  # the warm-up frames are not counted
+    webcam.cap.release()
+
+
+def test_importing_the_experiment_loads_no_heavy_module():
+    # In a fresh interpreter: MediaPipe and Matplotlib take seconds to import and
+    # are only needed once a FaceMesh is created or a figure drawn
+    code = (
+        "import sys\n"
+        "attempts = []\n"
+        "class Watch:\n"
+        "    def find_spec(self, name, path=None, target=None):\n"
+        "        if name.split('.')[0] in ('mediapipe', 'matplotlib'):\n"
+        "            attempts.append(name)\n"
+        "sys.meta_path.insert(0, Watch())\n"
+        "import Experiment\n"
+        "loaded = [name for name in sys.modules if name.split('.')[0] in ('mediapipe', 'matplotlib')]\n"
+        "print(attempts + loaded)\n"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1] == '[]'
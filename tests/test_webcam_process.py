@@ -0,0 +1,113 @@
+import multiprocessing as mp
+import threading
+import time
+
+import numpy as np
+
+from WebcamProcess import WebcamProcess
+
+
+def _slow_child(conn, delay):
+    # Answers every request after delay seconds, like a child busy inside 'start'
+    while True:
+        sequence, *command = conn.recv()
+        if command[0] == 'exit':
+            break
+        time.sleep(delay)
+        conn.send((sequence, command[0] + '_reply', sequence))
+
+
+def test_late_reply_is_not_taken_for_the_next_request():
+    webcam = WebcamProcess()
+    webcam._conn, child = mp.Pipe()
+    child_thread = threading.Thread(target=_slow_child, args=(child, 0.2), daemon=True)
+    child_thread.start()
+
+    assert webcam._request(('stats',), timeout=0.05) is None  # times out, its reply arrives later
+    reply = webcam._request(('stop',), timeout=2.0)
+    assert reply[0] == 'stop_reply'
+    assert reply[1] == webcam._sequence
+
+    webcam._conn.send((0, 'exit'))
+    child_thread.join(1.0)
+
+
+def test_marker_index_counts_the_rows_of_gaze_data():
+    from GazeBuffer import WEBCAM_DTYPE
+    from WebcamProcess import SharedRing
+
+    webcam = WebcamProcess()
+    ring = SharedRing(WEBCAM_DTYPE, capacity=4)
+    webcam._rings = {'webcam': ring}
+    webcam._positions = {'webcam': 0}
+    webcam.lost = {'webcam': 0}
+    try:
+        for i in range(10):
+            ring.append((float(i), 0, 0, 0, 0, 0))
+        webcam._drain()
+        webcam.add_marker('Start stimulus')
+        marker = webcam.get_markers()[-1]
+        assert marker['sample_index'] == len(webcam.get_data())
+        ring.append((10.0, 0, 0, 0, 0, 0))
+        webcam._drain()
+        assert webcam.get_data()['system_timestamp'][marker['sample_index']] == 10.0
+    finally:
+        webcam._rings = {}
+        ring.close()
+
+
+def test_clear_drops_the_calibration_samples():
+    from GazeBuffer import WEBCAM_DTYPE
+    from WebcamProcess import SharedRing
+
+    webcam = WebcamProcess()
+    ring = SharedRing(WEBCAM_DTYPE, capacity=16)
+    webcam._rings = {'webcam': ring}
+    webcam._positions = {'webcam': 0}
+    webcam.lost = {'webcam': 0}
+    try:
+        for i in range(5):
+            ring.append((float(i), 0, 0, 0, 0, 0))
+        webcam.add_marker('Calibration point')
+        webcam.clear()
+        assert len(webcam.get_data()) == 0 and len(webcam.get_markers()) == 0
+
+        webcam.add_marker('Start stimulus')
+        for i in range(5, 8):
+            ring.append((float(i), 0, 0, 0, 0, 0))
+        assert webcam.wait_for_samples(7.0, timeout=1.0)
+        np.testing.assert_array_equal(webcam.get_data()['system_timestamp'], [5, 6, 7])
+        assert webcam.get_markers()['sample_index'][0] == 0
+        assert not webcam.wait_for_samples(8.0, timeout=0.05)
+    finally:
+        webcam._rings = {}
+        ring.close()
+
+
+def test_samples_are_smoothed_in_the_parent():
+    from Filters import OneEuroFilter, smooth
+    from GazeBuffer import WEBCAM_DTYPE
+    from WebcamProcess import SharedRing
+
+    webcam = WebcamProcess(smoothing=OneEuroFilter())
+    assert 'smoothing' not in webcam.webcam_args  # the child process does not filter
+    ring = SharedRing(WEBCAM_DTYPE, capacity=64)
+    webcam._rings = {'webcam': ring}
+    webcam._positions = {'webcam': 0}
+    webcam.lost = {'webcam': 0}
+    rng = np.random.default_rng(0)
+    try:
+        for i in range(40):
+            x = 300 + rng.normal(0, 2)
+            ring.append((i / 30, np.nan if i % 7 == 0 else x, 200, x, 200, 0))
+            if i % 10 == 9:
+                webcam._drain()
+        smoothed = webcam.get_smoothed_data()
+        expected = smooth(webcam.get_data(), OneEuroFilter())
+        assert len(smoothed) == 40
+        for name in ('right_eye_x', 'left_eye_x'):
+            np.testing.assert_allclose(smoothed[name], expected[name], rtol=0, atol=1e-3)
+        assert np.isfinite(smoothed['left_eye_x']).all()
+    finally:
+        webcam._rings = {}
+        ring.close()